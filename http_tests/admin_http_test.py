@@ -2,7 +2,6 @@ import pytest
 import requests
 import json
 from src import config
-from src.other import clear_v1
 from src.helper import create_token
 import src.data as d
 
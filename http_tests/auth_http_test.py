@@ -4,13 +4,11 @@ import json
 from src import config
 import jwt
 from src.helper import create_token
-from src.other import clear_v1
 import re
 
-clear_v1()
-
+requests.delete(f"{config.url}/clear/v1")
 def test_register():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user_data = {
         'email': 'someemail@gmail.com',
         'password': 'password',
@@ -23,7 +21,7 @@ def test_register():
 
 
 def test_register_two_users():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user_data = {
         'email': 'someemail3@gmail.com',
         'password': 'password',
@@ -40,7 +38,7 @@ def test_register_two_users():
     assert data['auth_user_id'] == 1
 
 def test_register_email_taken():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user_data = {
         'email': 'someemail@gmail.com',
         'password': 'password',
@@ -53,7 +51,7 @@ def test_register_email_taken():
     assert data == {'code': 400, 'name': 'System Error', 'message': '<p>Email already taken</p>'}
 
 def test_register_email_invalid():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user_data = {
         'email': 'someemail@gmai@@gmail.coamsroagnsl.com',
         'password': 'password',
@@ -65,7 +63,7 @@ def test_register_email_invalid():
     assert data == {'code': 400, 'name': 'System Error', 'message': '<p>Invalid Email</p>'}
 
 def test_register_shortpass():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user_data = {
         'email': 'someemail@gmail.com',
         'password': 'pass',
@@ -77,7 +75,7 @@ def test_register_shortpass():
     assert data == {'code': 400, 'name': 'System Error', 'message': '<p>Password too short</p>'}
 
 def test_register_shortfirst():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user_data = {
         'email': 'someemail@gmail.com',
         'password': 'password',
@@ -89,7 +87,7 @@ def test_register_shortfirst():
     assert data == {'code': 400, 'name': 'System Error', 'message': '<p>Name length not within limits</p>'}
 
 def test_register_shortlast():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user_data = {
         'email': 'someemail@gmail.com',
         'password': 'password',
@@ -101,7 +99,7 @@ def test_register_shortlast():
     assert data == {'code': 400, 'name': 'System Error', 'message': '<p>Name length not within limits</p>'}
 
 def test_register_longfirst():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user_data = {
         'email': 'someemail@gmail.com',
         'password': 'password',
@@ -113,7 +111,7 @@ def test_register_longfirst():
     assert data == {'code': 400, 'name': 'System Error', 'message': '<p>Name length not within limits</p>'}
 
 def test_register_longlast():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user_data = {
         'email': 'someemail@gmail.com',
         'password': 'password',
@@ -126,7 +124,7 @@ def test_register_longlast():
 
 
 def test_login():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user_data = {
         'email': 'someemail@gmail.com',
         'password': 'password',
@@ -139,7 +137,7 @@ def test_login():
     assert data['auth_user_id'] == 0
 
 def test_login_2times():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user_data = {
         'email': 'someemail@gmail.com',
         'password': 'password',
@@ -155,7 +153,7 @@ def test_login_2times():
     assert data['auth_user_id'] == 0
 
 def test_login_invalid_email():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user_data = {
         'email': 'someemail@gmail.com',
         'password': 'password',
@@ -168,7 +166,7 @@ def test_login_invalid_email():
     assert data == {'code': 400, 'name': 'System Error', 'message': '<p>Invalid Email</p>'}
 
 def test_login_no_email():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user_data = {
         'email': 'someemail@gmail.com',
         'password': 'password',
@@ -181,7 +179,7 @@ def test_login_no_email():
     assert data == {'code': 400, 'name': 'System Error', 'message': '<p>Email not Found</p>'}
 
 def test_login_incorrect_pass():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user_data = {
         'email': 'someemail@gmail.com',
         'password': 'password',
@@ -195,7 +193,7 @@ def test_login_incorrect_pass():
     assert data == {'code': 400, 'name': 'System Error', 'message': '<p>Incorrect Password</p>'}
 
 def test_logout_valid():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user_data = {
         'email': 'someemail@gmail.com',
         'password': 'password',
@@ -212,7 +210,7 @@ def test_logout_valid():
 
 
 def test_logout_invalid():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user_data = {
         'email': 'someemail@gmail.com',
         'password': 'password',
@@ -2,7 +2,6 @@ import pytest
 import requests
 import json
 from src import config
-from src.other import clear_v1
 from src.helper import create_token, token_decode, valid_message, load_data, save_data
 import src.data as d
 
@@ -10,7 +9,7 @@ d.data = load_data()
 
 @pytest.fixture
 def Case1():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     requests.post(f"{config.url}/auth/register/v2", json = {"email":"email2@gmail.com", "password":"password2", "name_first":"David", "name_last":"Peng"})
     requests.post(f"{config.url}/auth/register/v2", json = {"email":"email3@gmail.com", "password":"password3", "name_first":"Krishnan", "name_last":"Winter"})
     requests.post(f"{config.url}/auth/register/v2", json = {"email":"email4@gmail.com", "password":"password4", "name_first":"Joel", "name_last":"Engelman"})
@@ -81,6 +80,24 @@ def test_channel_messages_not_member(Case1):
 
     assert data['code'] == 403
 
+def test_channel_history_cursor(Case1):
+    for i in range(5):
+        requests.post(f"{config.url}/message/send/v2", json = {'token': create_token("davidpeng"), "channel_id": Case1['CH1'], "message": f"{i}"})
+    c = requests.get(f"{config.url}/channel/history/v1", params = {'token': create_token("davidpeng"), "channel_id": Case1['CH1'], "limit": 3})
+    data = c.json()
+    assert [m['message'] for m in data['messages']] == ["4", "3", "2"]
+
+    c = requests.get(f"{config.url}/channel/history/v1", params = {'token': create_token("davidpeng"), "channel_id": Case1['CH1'], "before_message_id": data['before_message_id'], "limit": 3})
+    data = c.json()
+    assert [m['message'] for m in data['messages']] == ["1", "0"]
+    assert data['before_message_id'] == -1
+
+def test_channel_history_invalid_limit(Case1):
+    c = requests.get(f"{config.url}/channel/history/v1", params = {'token': create_token("davidpeng"), "channel_id": Case1['CH1'], "limit": 0})
+    data = c.json()
+
+    assert data['code'] == 400
+
 # Error testing for channel_join
 def test_channel_join_private(Case1):
     r = requests.post(f"{config.url}/channel/join/v2", json = {'token': create_token("krishnanwinter"), 'channel_id': Case1['CH3']})
@@ -3,7 +3,6 @@ import requests
 import json
 from src import config
 from src.helper import create_token, token_decode, load_data, get_channel, channel_exists, get_channel_listformat
-from src.other import clear_v1
 import src.data as d
 
 @pytest.fixture
@@ -12,7 +11,7 @@ def case1():
     creates 4 users and 3 channels for testing
 
     """
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user1 = requests.post(f"{config.url}/auth/register/v2", json={
         "email" : "email@gmail.com",
         "password" : "password",
@@ -55,9 +54,8 @@ def test_channels_create():
     Tests the create function. Creates a user and tests to see if they exist
 
     '''
-    clear_v1()
-    d.data = load_data()
     requests.delete(f"{config.url}/clear/v1")
+    d.data = load_data()
     requests.post(f"{config.url}/auth/register/v2", json={
         "email" : "email@gmail.com",
         "password" : "password",
@@ -70,7 +68,9 @@ def test_channels_create():
         "is_public" : True,
     })
     data = json.loads(channel1.text)
-    assert channel_exists(data["channel_id"])
+    r = requests.get(f"{config.url}/channels/listall/v2", params={"token": create_token("alexfulton")})
+    channel_ids = [channel["channel_id"] for channel in r.json()["channels"]]
+    assert data["channel_id"] in channel_ids
 
 def test_channels_create_exception(case1):
     """
@@ -92,14 +92,13 @@ def test_channels_list(case1):
     of only channels that the user is in.
 
     """
-    d.data = load_data()
     channels = requests.get(f"{config.url}/channels/list/v2", params={
         "token" : create_token("alexfulton")
     })
     data = json.loads(channels.text)
-    assert get_channel_listformat(case1["channel1"]['channel_id']) in data['channels']
-    assert get_channel_listformat(case1["channel2"]['channel_id']) not in data['channels']
-    assert get_channel_listformat(case1["channel3"]['channel_id']) in data['channels']
+    assert {"channel_id": case1["channel1"]['channel_id'], "name": "Channel1"} in data['channels']
+    assert {"channel_id": case1["channel2"]['channel_id'], "name": "Channel2"} not in data['channels']
+    assert {"channel_id": case1["channel3"]['channel_id'], "name": "Channel3"} in data['channels']
 
 def test_channels_list_exception(case1):
     """
@@ -117,14 +116,13 @@ def test_channels_list_all(case1):
     tests that a list of all channels is returned
 
     """
-    d.data = load_data()
     channels = requests.get(f"{config.url}/channels/listall/v2", params={
         "token" : create_token("alexfulton")
     })
     data = json.loads(channels.text)
-    assert get_channel_listformat(case1["channel1"]['channel_id']) in data['channels']
-    assert get_channel_listformat(case1["channel2"]['channel_id']) in data['channels']
-    assert get_channel_listformat(case1["channel3"]['channel_id']) in data['channels']
+    assert {"channel_id": case1["channel1"]['channel_id'], "name": "Channel1"} in data['channels']
+    assert {"channel_id": case1["channel2"]['channel_id'], "name": "Channel2"} in data['channels']
+    assert {"channel_id": case1["channel3"]['channel_id'], "name": "Channel3"} in data['channels']
 
 def test_channels_list_all_exception(case1):
     """
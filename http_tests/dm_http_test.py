@@ -2,20 +2,19 @@ import pytest
 import requests
 import json
 from src import config
-from src.other import clear_v1
 from src.helper import create_token
 import src.data as d
 
 @pytest.fixture
 def Case1():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     requests.post(f"{config.url}/auth/register/v2", json = {"email":"email2@gmail.com", "password":"password2", "name_first":"David", "name_last":"Peng"})
     requests.post(f"{config.url}/auth/register/v2", json = {"email":"email3@gmail.com", "password":"password3", "name_first":"Kirshnan", "name_last":"Winter"})
     requests.post(f"{config.url}/auth/register/v2", json = {"email":"email4@gmail.com", "password":"password4", "name_first":"Joel", "name_last":"Engelman"})
     requests.post(f"{config.url}/auth/register/v2", json = {"email":"email@gmail.com", "password":"password1", "name_first":"David", "name_last":"Peng"})
 
 def test_details_no_DM():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     user_data = {
         'email': 'someemail@gmail.com',
         'password': 'password',
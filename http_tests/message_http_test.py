@@ -2,14 +2,13 @@ import pytest
 import requests
 import json
 from src import config
-from src.other import clear_v1
 from src.helper import create_token, token_decode, valid_message
 import src.data as d
 import time
 
 @pytest.fixture
 def testing_data():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     requests.post(f"{config.url}/auth/register/v2", json = {"email":"email2@gmail.com", "password":"password2", "name_first":"David", "name_last":"Peng"})
     requests.post(f"{config.url}/auth/register/v2", json = {"email":"email3@gmail.com", "password":"password3", "name_first":"Krishnan", "name_last":"Winter"})
     requests.post(f"{config.url}/auth/register/v2", json = {"email":"email4@gmail.com", "password":"password4", "name_first":"Joel", "name_last":"Engelman"})
@@ -537,6 +536,17 @@ def test_message_sendlater_1(testing_data):
     timestamp = time.time()
     timestamp += 5
     start = time.time()
-    requests.post(f"{config.url}/message/sendlaterdm/v1", json = {'token': create_token("davidpeng"), 'dm_id': dm_id, 'message': "Hello", 'time_sent': timestamp})
+    r = requests.post(f"{config.url}/message/sendlaterdm/v1", json = {'token': create_token("davidpeng"), 'dm_id': dm_id, 'message': "Hello", 'time_sent': timestamp})
     end = time.time()
-    assert int(end-start) == 5
\ No newline at end of file
+    message_id = r.json()['message_id']
+
+    # Returns straight away, and the message appears once the time comes
+    assert int(end-start) == 0
+    c = requests.get(f"{config.url}/dm/messages/v1", params = {'token': create_token("davidpeng"), "dm_id": dm_id, "start": 0})
+    assert c.json()['messages'] == []
+
+    time.sleep(max(timestamp - time.time(), 0) + 1)
+    c = requests.get(f"{config.url}/dm/messages/v1", params = {'token': create_token("davidpeng"), "dm_id": dm_id, "start": 0})
+    sent = c.json()['messages'][0]
+    assert sent['message'] == 'Hello'
+    assert sent['message_id'] == message_id
\ No newline at end of file
@@ -42,6 +42,15 @@ def test_clear():
         "channels" : [],
         "messages" : [],
         "dms" : [],
+        "stats" : [],
+        "notifications" : [],
+        "sessions" : [],
+        "outbox" : [],
+        "reset_codes" : [],
+        "scheduled" : [],
+        "standups" : [],
+        "standup_lines" : [],
+        "sequences" : [],
     }
     
 
@@ -2,13 +2,12 @@ import pytest
 import requests
 import json
 from src import config
-from src.other import clear_v1
 from src.helper import create_token, token_decode, valid_message, load_data, save_data
 import src.data as d
 
 @pytest.fixture
 def Case1():
-    clear_v1()
+    requests.delete(f"{config.url}/clear/v1")
     requests.post(f"{config.url}/auth/register/v2", json = {"email":"email2@gmail.com", "password":"password2", "name_first":"David", "name_last":"Peng"})
     requests.post(f"{config.url}/channels/create/v2", json = {"token": create_token("davidpeng"), "name": "example channel", "is_public": True})
 
@@ -8,7 +8,6 @@ import pytest
 import requests
 import json
 from src import config
-from src.other import clear_v1
 from src.helper import create_token, token_decode, load_data, save_data, channel_exists, user_exists
 from time import sleep
 
@@ -38,7 +37,8 @@ def register_users_channels():
         "is_public" : True,
     })
     c_id1 = json.loads(createc1.text)['channel_id']
-    assert channel_exists(c_id1)
+    listall = requests.get(f"{config.url}/channels/listall/v2", params={"token": create_token("haydensmith")})
+    assert c_id1 in [channel['channel_id'] for channel in listall.json()['channels']]
 
     createc2 = requests.post(f'{config.url}/channels/create/v2', json={
         "token": create_token("haydensmith"),
@@ -46,7 +46,8 @@ def register_users_channels():
         "is_public": True
     })
     c_id2= json.loads(createc2.text)['channel_id']
-    assert channel_exists(c_id2)
+    listall = requests.get(f"{config.url}/channels/listall/v2", params={"token": create_token("haydensmith")})
+    assert c_id2 in [channel['channel_id'] for channel in listall.json()['channels']]
 
     # Member
     member_reg = requests.post(f'{config.url}/auth/register/v2', json={
@@ -6,7 +6,6 @@ import pytest
 import requests
 import json
 from src.config import url
-from src.other import clear_v1
 from src.helper import create_token, get_user, load_data
 import src.data as d
 
@@ -16,7 +15,7 @@ def register_login():
     Fixture registers a user and then logs them in
     Returns dictionary containing their u_id and token.
     '''
-    clear_v1()
+    requests.delete(f"{url}/clear/v1")
     # User 1
     result1 = requests.post(url + '/auth/register/v2', json={
         "email":"email1@gmail.com", 
@@ -42,7 +41,7 @@ def setup_multiple_users():
     """
     Fixture to access and use multiple users. Used in testing for users_all, user_stats, users_stats
     """
-    clear_v1()
+    requests.delete(f"{url}/clear/v1")
     #d.data = load_data()
     # User 1
     user1 = requests.post(url + '/auth/register/v2', json={
@@ -387,14 +386,17 @@ def test_user_profile_sethandle_invalid_handle_otheruser(register_login):
 # user_all tests
 
 def test_user_all(setup_multiple_users):
-    d.data = load_data()
     token = setup_multiple_users['user1']['token']
     users = requests.get(f"{url}/users/all/v1", params={
         "token" : token
     })
     data = users.json()
-    assert get_user(setup_multiple_users['user2']['auth_user_id']) in data['users']
-    assert get_user(setup_multiple_users['user3']["auth_user_id"]) in data['users']
+    for user in ('user2', 'user3'):
+        profile = requests.get(f"{url}/user/profile/v2", params={
+            "token" : token,
+            "u_id" : setup_multiple_users[user]['auth_user_id']
+        })
+        assert profile.json()['user'] in data['users']
 
 """ (To do when error handling is fixed)
 def test_user_all_access_exception(setup_multiple_users):
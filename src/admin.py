@@ -2,10 +2,14 @@
 admin.py
 '''
 
-import src.data as d
+import src.store as store
+import src.search as search
+import src.sessions as sessions
+import src.token_cache as token_cache
 from src.error import InputError, AccessError
-from src.helper import token_decode, user_exists, load_data, save_data
+from src.helper import token_decode, user_exists
 
+@store.atomic
 def admin_user_remove_v1(token, u_id):
     '''
     < Given a User by their user ID, remove the user from the Dreams.
@@ -28,15 +32,11 @@ def admin_user_remove_v1(token, u_id):
         { }
 
     '''
-    d.data = load_data()
     # Check if the user is an owner 
     token_id = token_decode(token)
-    for user in d.data['users']:
-        if token_id == user['u_id']:
-            if user['permission'] == 1:
-                break
-            elif user['permission'] == 2:
-                raise AccessError(description="Error: User is not an owner")
+    user = store.get('users', token_id)
+    if user is not None and user['permission'] == 2:
+        raise AccessError(description="Error: User is not an owner")
 
     # Check for valid u_id
     if user_exists(u_id) is False:
@@ -44,7 +44,7 @@ def admin_user_remove_v1(token, u_id):
     
     # Check if the user is currently the only owner
     owner_flag = False
-    for user in d.data['users']:
+    for user in store.scan('users'):
         if user['permission'] == 1 and user['u_id'] != u_id:
             owner_flag = True
             break
@@ -55,19 +55,23 @@ def admin_user_remove_v1(token, u_id):
 
     # Removing user
     # Replace name with 'Removed user'
-    for user in d.data['users']:
-        if user['u_id'] == u_id:
-            user['name_first'] = 'Removed user'
-            user['name_last'] = 'Removed user'
+    store.update("users", u_id, {
+        'name_first': 'Removed user',
+        'name_last': 'Removed user'
+    })
 
     # Replace messages sent with 'Removed user' both in messages and dms
-    for message in d.data['messages']:
-        if message['u_id'] == u_id:
-            message['message'] = 'Removed user'
-    save_data()
+    for message in store.find_all('messages', 'u_id', u_id):
+        store.update("messages", message['message_id'], {'message': 'Removed user'})
+        search.index_message(store.get("messages", message['message_id']))
+
+    # Log the removed user out everywhere
+    sessions.end_user(u_id)
+    token_cache.invalidate_user(u_id)
     return {}
 
 
+@store.atomic
 def admin_userpermission_change_v1(token, u_id, permission_id):
     '''
     < Given a User by their user ID, set their permissions to new permissions
@@ -88,15 +92,11 @@ def admin_userpermission_change_v1(token, u_id, permission_id):
         { }
 
     '''
-    d.data = load_data()
     # Check if the user is an owner
     token_id = token_decode(token)
-    for user in d.data['users']:
-        if token_id == user['u_id']:
-            if user['permission'] == 1:
-                break
-            elif user['permission'] == 2:
-                raise AccessError(description="Error: User is not an owner")
+    user = store.get('users', token_id)
+    if user is not None and user['permission'] == 2:
+        raise AccessError(description="Error: User is not an owner")
 
     # Check if u_id refers to a valid user
     if user_exists(u_id) is False:
@@ -108,8 +108,5 @@ def admin_userpermission_change_v1(token, u_id, permission_id):
                                     a valid permission")
 
     # Change the user's permission
-    for user in d.data['users']:
-        if u_id == user['u_id']:
-            user['permission'] = permission_id
-    save_data()
+    store.update("users", u_id, {'permission': permission_id})
     return {}
@@ -5,15 +5,20 @@ As well as login with the account once it has been created.
 '''
 
 import re
-from src.helper import user_exists, get_id_and_password, create_token, get_user, load_data, save_data
+from src.helper import user_exists, get_id_and_password, create_token, get_user
 from src.error import InputError, AccessError
 from src.config import port
-import src.data as d
+import src.store as store
+import src.stats as stats
+import src.mentions as mentions
+import src.passwords as passwords
+import src.mail as mail
+import src.ids as ids
+from src import config
 from src.other import clear_v1
-import jwt
-import random
-import smtplib
+import secrets
 import string
+import time
 
 
 
@@ -34,7 +39,6 @@ def auth_login_v2(email, password):
 
     Return Value: The function returns the auth_user_id of the user
     '''
-    d.data = load_data()
     regex = '^[a-zA-Z0-9]+[\\._]?[a-zA-Z0-9]+[@]\\w+[.]\\w{2,3}$'
 
     if not re.search(regex, email):
@@ -45,12 +49,16 @@ def auth_login_v2(email, password):
     if details == None:
         raise InputError
 
-    if password == details['password']:
+    if passwords.verify(password, details['password']):
         user_id = details['user_id']
         handle = get_user(user_id)['handle_str']
     else:
         raise InputError("Incorrect Password")
 
+    # Now the password is known, bring a hash made with older parameters up to date
+    if passwords.needs_rehash(details['password']):
+        store.update("users", user_id, {'password': passwords.hash_password(password)})
+
     token = create_token(handle)
 
     return {
@@ -85,7 +93,6 @@ def auth_register_v2(email, password, name_first, name_last):
 
     Return Value: The function returns the auth_user_id of the user
     '''
-    d.data = load_data()
     regex = '^[a-zA-Z0-9]+[\\._]?[a-zA-Z0-9]+[@]\\w+[.]\\w{2,3}$'
 
     if re.search(regex, email):
@@ -94,9 +101,8 @@ def auth_register_v2(email, password, name_first, name_last):
     else:
         raise InputError("Invalid Email")
 
-    for user in d.data['users']:
-        if user['email'] == email:
-            raise InputError("Email already taken")
+    if store.find('users', 'email', email) is not None:
+        raise InputError("Email already taken")
 
     if len(password) < 6:
         raise InputError("Password too short")
@@ -107,6 +113,29 @@ def auth_register_v2(email, password, name_first, name_last):
     if len(name_last) < 1 or len(name_last) > 50:
         raise InputError("Name length not within limits")
 
+    # Hashing is slow, so it is done before taking the store for writing
+    password = passwords.hash_password(password)
+    return _add_user(email, password, name_first, name_last)
+
+@store.atomic
+def _add_user(email, password, name_first, name_last):
+    '''
+    Adds a newly registered user with a unique handle and the next u_id
+
+    Arguments:
+    email (string) - The user's email
+    password (dict) - Their password, hashed by passwords.hash_password
+    name_first (string) - Their first name
+    name_last (string) - Their last name
+
+    Exceptions:
+    InputError - Occurs when the email was taken while the password was hashed
+
+    Return Value: Returns the token and auth_user_id of the user
+    '''
+    if store.find('users', 'email', email) is not None:
+        raise InputError("Email already taken")
+
     #name has to be all lowercase
     handle = name_first.lower() + name_last.lower()
 
@@ -121,8 +150,8 @@ def auth_register_v2(email, password, name_first, name_last):
     #This can result in handle > 20 characters
     first_handle = handle
     handle_counter = 0
-    for i in range(len(d.data['users'])):
-        if d.data['users'][i]['handle_str'] == handle:
+    for user in store.scan('users'):
+        if user['handle_str'] == handle:
             handle = first_handle + str(handle_counter)
             handle_counter += 1
 
@@ -131,13 +160,7 @@ def auth_register_v2(email, password, name_first, name_last):
     #create dict
     new_user = {}
 
-    #searches for next available user id
-    if len(d.data['users']) == 0:
-        auth_user_id = 0
-    else:
-        auth_user_id = d.data['users'][-1]['u_id'] + 1
-    
-    password = jwt.encode({'password': password}, "", algorithm='HS256')
+    auth_user_id = ids.next_id('users')
 
     if auth_user_id == 0:
         permission = 1
@@ -152,17 +175,21 @@ def auth_register_v2(email, password, name_first, name_last):
         "name_last" : name_last,
         "u_id" : auth_user_id,
         "handle_str" : handle,
-        "permission": permission
+        "permission": permission,
+        "channels": [],
+        "dms": []
     }
 
-    #append that dictionary to the data["users"] list
-    d.data['users'].append(new_user)
-    save_data()
+    #add that dictionary to the users in the store
+    store.insert("users", new_user)
+    mentions.add_handle(handle, auth_user_id)
+    stats.init_user(auth_user_id)
     return {
         'token' : token,
         'auth_user_id': auth_user_id,
     }
 
+@store.atomic
 def auth_passwordreset_request_v1(email):
     '''
     Given an email address, if the user is a registered user,
@@ -170,47 +197,37 @@ def auth_passwordreset_request_v1(email):
     that when entered in auth_passwordreset_reset, shows that
     the user trying to reset the password is the one who got
     sent this email.
+
+    The email is queued with mail.send and sent in the background, and the
+    code is kept in the "reset_codes" collection until it is used or
+    config.reset_code_ttl seconds have passed. Requesting a new code
+    replaces any the user already had
     '''
-    email_exists = False
-    for user in d.data['users']:
-        if email == user['email']:
-            print(email)
-            print(user['email'])
-            email_exists = True
-            name_first = user['name_first']
-    
-    if email_exists == False:
+    user = store.find('users', 'email', email)
+    if user is None:
         raise InputError("Email does not exist")
 
-    if email_exists is True:
-        with smtplib.SMTP("smtp.gmail.com", 587) as smtp:
-            smtp.ehlo() #become identified as a connection
-            smtp.starttls() #info becomes encrypted
-            smtp.ehlo() #connection now encrypted
-
-            #email and password for sending emails for password reset
-            EMAIL_ADDRESS = "mysomeemail38@gmail.com"
-            PASSWORD = "Pineapple1!"
-
-            smtp.login(EMAIL_ADDRESS, PASSWORD)
-
-            email_subject = "Forgotten passwrd?"
-            name_first = f"Hello {name_first},"
-            body = "In order to reset password, enter the code: "
+    string1 = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    string2 = "1234567890"
+    code = ''
+    for _ in range(0, 8):
+        code += secrets.choice(string1) + secrets.choice(string2)
+
+    for old in store.find_all('reset_codes', 'u_id', user['u_id']):
+        store.delete('reset_codes', old['code_id'])
+    last_code_id = store.max_key('reset_codes')
+    store.insert('reset_codes', {
+        'code_id': 0 if last_code_id is None else last_code_id + 1,
+        'code': code,
+        'u_id': user['u_id'],
+        'expires': time.time() + config.reset_code_ttl,
+    })
+
+    email_subject = "Forgotten passwrd?"
+    name_first = f"Hello {user['name_first']},"
+    body = "In order to reset password, enter the code: "
+    mail.send(email, email_subject, f"{name_first}\n{body}\n\n{code}")
 
-            string1 = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-            string2 = "1234567890"
-            code = ''
-            for _ in range(0, 8):
-                code += random.choice(string1) + random.choice(string2)
-
-            email_msg = f"{email_subject}\n\n{name_first}\n{body}\n\n{code}"
-            smtp.sendmail(EMAIL_ADDRESS, email, email_msg)
-
-            for user in d.data['users']:
-                if email == user['email']:
-                    user.update({'code': code})
-    
     return {}
 
 def auth_passwordreset_reset_v1(reset_code, new_password):
@@ -221,18 +238,22 @@ def auth_passwordreset_reset_v1(reset_code, new_password):
 
     if len(new_password) < 6:
         raise InputError("Password too short")
-    
-    password = jwt.encode({'password': new_password}, "", algorithm = 'HS256')
-
-    valid_reset_code = False
-    for user in d.data['users']:
-        if reset_code == user['code']:
-            user.update({'password': password})
-            valid_reset_code = True
-            user.update({'code': None}) #code returned to None as it is a one-time code
 
-    if valid_reset_code is False:
+    reset = store.find('reset_codes', 'code', reset_code)
+    if reset is None:
         raise InputError("Not a valid reset code")
-    
-    return {}
+    if reset['expires'] < time.time():
+        store.delete('reset_codes', reset['code_id'])
+        raise InputError("Reset code has expired")
+
+    password = passwords.hash_password(new_password)
+    with store.writing():
+        #the code may have been used while the password was hashed
+        current = store.get('reset_codes', reset['code_id'])
+        if current is None or current['code'] != reset_code:
+            raise InputError("Not a valid reset code")
+        store.update("users", reset['u_id'], {'password': password})
+        #the code is deleted as it is a one-time code
+        store.delete('reset_codes', reset['code_id'])
 
+    return {}
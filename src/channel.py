@@ -1,8 +1,10 @@
-import src.data as d
+import src.store as store
+import src.notifications as notifications
 from src.error import InputError, AccessError
-from src.helper import get_user, is_member, user_exists, channel_exists, get_channel, valid_message, remove_invalid_messages, save_data, load_data, get_message, refresh_reacts
+from src.helper import get_members, add_channel_member, remove_channel_member, is_member, is_owner, user_exists, channel_exists, get_channel, messages_page, messages_history
 
 
+@store.atomic
 def channel_invite_v1(auth_user_id, channel_id, u_id):
     '''
     This function takes an authorised user which is a part of the channel specified
@@ -25,7 +27,6 @@ def channel_invite_v1(auth_user_id, channel_id, u_id):
     Return Value:
         Returns {}
     '''
-    d.data = load_data()
     if not channel_exists(channel_id):
         raise InputError("Channel Specified does not exist")
     if not user_exists(u_id):
@@ -37,9 +38,8 @@ def channel_invite_v1(auth_user_id, channel_id, u_id):
         raise AccessError("Auth User is not a member of Channel")
 
     #Adding the u_id to the channel
-    channel = get_channel(channel_id)
-    channel["all_members"].append(get_user(u_id))
-    save_data()
+    add_channel_member(u_id, channel_id)
+    notifications.added(u_id, auth_user_id, channel_id=channel_id)
     return {
     }
 
@@ -76,8 +76,8 @@ def channel_details_v1(auth_user_id, channel_id):
 
     return {
         'name': channel["name"],
-        'owner_members': channel["owner_members"],
-        'all_members': channel["all_members"],
+        'owner_members': get_members(channel["owner_members"]),
+        'all_members': get_members(channel["all_members"]),
     }
 
 # Given a channel_id, that auth_user_id is apart of, returns 50 of the most 
@@ -114,59 +114,53 @@ def channel_messages_v1(auth_user_id, channel_id, start):
     if channel_exists(channel_id) is False:
         raise InputError("Channel does not exist")
 
-    # Removing all of the invalid messages from the list
-    remove_invalid_messages(channel_id)
-    save_data()
-    # Update all the reacts for the current session user
-    refresh_reacts(auth_user_id)
+    # Only the requested page is read, newest message first
+    page = messages_page("channel_id", channel_id, auth_user_id, start)
 
-    channel = get_channel(channel_id)
+    # Assuming that all members in channel can invite
+    # Checking if the auth_user_id is apart of channel
+    if not is_member(auth_user_id,channel_id) and auth_user_id != 0:
+        raise AccessError("Auth user is not apart of channel")
 
-    # Reversing the list so the start of the list is the latest message
-    channelMessagesId = channel["messages"]
-    channelMessagesId.reverse()
-    
-    # Checking how many messages are in the messages list
-    numOfMessages = len(channel["messages"])
+    return page
 
-    # Checking that start is within the bound of messages
-    if start > numOfMessages:
-        raise InputError("Start is out of bounds of list")
+def channel_history_v1(auth_user_id, channel_id, before_message_id=-1, after_message_id=-1, limit=50):
+    '''
+    This function takes an authorised user which is a part of the channel specified
+    and returns up to limit messages, newest first, older than before_message_id
+    or newer than after_message_id. The cursors returned can be passed back in
+    to page through the channel's history
 
-    # Assuming that all members in channel can invite
-    # Checking if the auth_user_id is apart of channel
+    Arguments:
+    auth_user_id (Integer)    - User who is already part of the channel specified
+    channel_id (Integer)    - Channel whose messages are to be returned
+    before_message_id (Integer)    - Only return messages older than this one, -1 for the newest
+    after_message_id (Integer)    - Only return the messages straight after this one, -1 for none
+    limit (Integer)    - The most messages to return, 1 to 50
+    
+    Exceptions:
+        InputError  - Occurs when 
+                        1. channel_id is not a valid channel
+                        2. limit is not between 1 and 50
+        AccessError - Occurs when 
+                        1. the user associated with auth_user_id is not a member of the channel specified
+
+    Return Value:
+        Returns {
+            'messages': [List of messages],
+            'before_message_id': before_message_id of the next older page, or -1,
+            'after_message_id': after_message_id of the next newer page,
+        }
+    '''
+    if channel_exists(channel_id) is False:
+        raise InputError("Channel does not exist")
     if not is_member(auth_user_id,channel_id) and auth_user_id != 0:
         raise AccessError("Auth user is not apart of channel")
 
-    # Creating the end index
-    end = start + 50
-
-    # Checking that end is not out of bounds
-    # if out of bounds assign end = -1
-    if end >= numOfMessages:
-        end = -1
-
-
-    channelMessages = []
-    for message in range(start, start + 50):
-        if end == -1 and message == numOfMessages:
-            break
-        msg = get_message(channelMessagesId[message])
-        if msg["removed"] and end != -1:
-            end += 1
-            if end >= numOfMessages:
-                end = -1
-            continue
-        channelMessages.append(msg)
-    # Returning the channel messages 
-    # and the start and end index
-    return {
-        'messages': channelMessages,
-        'start': start,
-        'end': end,
-    }
+    return messages_history("channel_id", channel_id, auth_user_id, before_message_id, after_message_id, limit)
 
 #Not required for Iteration 1
+@store.atomic
 def channel_leave_v1(auth_user_id, channel_id):
     '''
     This function takes an authorised user which is a member of a channel, 
@@ -184,20 +178,17 @@ def channel_leave_v1(auth_user_id, channel_id):
     Return Value:
         Returns {}
     '''
-    d.data = load_data()
     if channel_exists(channel_id) == False:
         raise InputError
     ch = get_channel(channel_id)
-    user = get_user(auth_user_id)
-    if user in ch["owner_members"] and len(ch["owner_members"] == 1):
+    if is_owner(auth_user_id, channel_id) and len(ch["owner_members"] == 1):
         raise InputError
-    if user not in ch["all_members"]:
+    if not is_member(auth_user_id, channel_id):
         raise AccessError
 
-    if user in ch["owner_members"]:
-        ch["owner_members"].remove(user)
-    ch["all_members"].remove(user)
-    save_data()
+    if is_owner(auth_user_id, channel_id):
+        store.remove("channels", channel_id, "owner_members", auth_user_id)
+    remove_channel_member(auth_user_id, channel_id)
     return {
     }
 
@@ -205,6 +196,7 @@ def channel_leave_v1(auth_user_id, channel_id):
 # authorised to do so. If the channel is private or does not exist, an error
 # will occur. 
 # Function has no return value
+@store.atomic
 def channel_join_v1(auth_user_id, channel_id):
     '''
     This function takes an authorised user which is not a part of the channel specified
@@ -223,7 +215,6 @@ def channel_join_v1(auth_user_id, channel_id):
     Return Value:
         Returns {}
     '''
-    d.data = load_data()
     # Check if the channel exists, if not InputError
     if channel_exists(channel_id) is False:
         raise InputError("Channel does not exist")
@@ -239,8 +230,8 @@ def channel_join_v1(auth_user_id, channel_id):
     channel = get_channel(channel_id)
 
     #if the user is the global_owner add to both the normal members and the owner members
-    if auth_user_id == d.data["users"][0]["u_id"]:
-        channel["all_members"].append(get_user(auth_user_id))
+    if auth_user_id == store.first("users")["u_id"]:
+        add_channel_member(auth_user_id, channel_id)
         return {
         }
 
@@ -250,12 +241,12 @@ def channel_join_v1(auth_user_id, channel_id):
         raise AccessError("Channel is private")
 
     # Adding the user as a member
-    channel["all_members"].append(get_user(auth_user_id))
-    save_data()
+    add_channel_member(auth_user_id, channel_id)
     return {
     }
 
 #Not required for Iteration 1
+@store.atomic
 def channel_addowner_v1(auth_user_id, channel_id, u_id):
     '''
     This function takes an authorised user which is the owner of a channel, 
@@ -276,23 +267,21 @@ def channel_addowner_v1(auth_user_id, channel_id, u_id):
     Return Value:
         Returns {}
     '''
-    d.data = load_data()
     if channel_exists(channel_id) == False:
         raise InputError
-    ch = get_channel(channel_id)
-    if get_user(u_id) in ch["owner_members"]:
+    if is_owner(u_id, channel_id):
         raise InputError
-    if get_user(auth_user_id) not in ch["owner_members"]:
+    if not is_owner(auth_user_id, channel_id):
         raise AccessError
     if auth_user_id != 0:
         raise AccessError
 
-    ch["owner_members"].append(get_user(u_id))
-    save_data()
+    store.append("channels", channel_id, "owner_members", u_id)
     return {
     }
 
 #Not required for Iteration 1
+@store.atomic
 def channel_removeowner_v1(auth_user_id, channel_id, u_id):
     '''
     This function takes an authorised user which is the owner of a channel, 
@@ -314,20 +303,18 @@ def channel_removeowner_v1(auth_user_id, channel_id, u_id):
     Return Value:
         Returns {}
     '''
-    d.data = load_data()
     if channel_exists(channel_id) == False:
         raise InputError
     ch = get_channel(channel_id)
-    if get_user(u_id) not in ch["owner_members"]:
+    if not is_owner(u_id, channel_id):
         raise InputError
     if len(ch["owner_members"]) == 1:
         raise InputError
     if auth_user_id != 0:
         raise AccessError
-    if get_user(auth_user_id) not in ch["owner_members"]:
+    if not is_owner(auth_user_id, channel_id):
         raise AccessError
 
-    ch["owner_members"].remove(get_user(u_id))
-    save_data()
+    store.remove("channels", channel_id, "owner_members", u_id)
     return {
     }
@@ -2,9 +2,11 @@
 channels.py
 '''
 
-import src.data as d
+import src.store as store
+import src.stats as stats
+import src.ids as ids
 from src.error import InputError, AccessError
-from src.helper import user_exists, get_user, token_decode, load_data, save_data
+from src.helper import user_exists, token_decode, get_channel_listformat
 
 def channels_list_v2(token):
     '''
@@ -31,12 +33,8 @@ def channels_list_v2(token):
     # and add to the list of channel dictionaries
     channels_list = []
 
-    for channel in d.data['channels']:
-        user_channel = {}
-        if get_user(u_id) in channel['all_members']:
-            user_channel.update({"channel_id": channel["channel_id"]})
-            user_channel.update({"name": channel["name"]})
-            channels_list.append(user_channel)
+    for channel_id in sorted(store.get('users', u_id)['channels']):
+        channels_list.append(get_channel_listformat(channel_id))
 
     return {
         'channels': channels_list
@@ -59,7 +57,7 @@ def channels_listall_v2(token):
     # channel dictionaries
     all_channels_list = []
 
-    for channel in d.data['channels']:
+    for channel in store.scan('channels'):
         channels = {}
         channels.update({"channel_id": channel["channel_id"]})
         channels.update({"name": channel['name']})
@@ -69,6 +67,7 @@ def channels_listall_v2(token):
         'channels': all_channels_list
     }
 
+@store.atomic
 def channels_create_v2(token, name, is_public):
     '''
     < Creates a new channel with that name that is either a public or private channel >
@@ -105,25 +104,21 @@ def channels_create_v2(token, name, is_public):
     
     # Channel owner id
     channel.update({"owner_members": []})
-    channel['owner_members'].append(get_user(u_id))  
+    channel['owner_members'].append(u_id)  
     
     # Channel user id
     channel.update({"all_members": []})
-    channel['all_members'].append(get_user(u_id))
-
-    # Adding part for messages
-    channel.update({"messages": []})
+    channel['all_members'].append(u_id)
 
     # Channel id
-    try:                                        
-        channel_id = d.data['channels'][-1]['channel_id'] + 1     # Adds onto the last channel
-    except:
-        channel_id = 1                                          # First channel
+    channel_id = ids.next_id('channels')
     channel.update({"channel_id": channel_id})          
 
     # Update the database
-    d.data['channels'].append(channel)
-    save_data()
+    store.insert("channels", channel)
+    store.append("users", u_id, "channels", channel_id)
+    stats.update_user(u_id, "channels_joined", 1)
+    stats.update_dreams("channels_exist", 1)
 
     return {
         'channel_id': channel_id
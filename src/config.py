@@ -1,3 +1,66 @@
+import os
+
 port = 8080
 
-url = f"http://localhost:{port}/"
\ No newline at end of file
+url = f"http://localhost:{port}/"
+
+# Server processes
+server_processes = int(os.environ.get("DREAMS_SERVER_PROCESSES", 1))  # Worker processes forked to serve requests, more than 1 needs the sqlite engine
+lock_path = "src/data.lock"  # Lock file the worker processes share the store's locks through
+sync_interval = 1.0          # Seconds between checks for what other worker processes have changed while idle
+
+# Persistence of the data store
+storage_engine = os.environ.get("DREAMS_STORAGE_ENGINE", "json")  # "json" or "sqlite"
+sqlite_path = "src/data.db"      # Database used by the sqlite engine
+data_path = "src/data.json"      # Latest full snapshot of the data store
+log_path = "src/data.log"        # Append-only log of changes since the snapshot
+flush_interval = 1.0        # Seconds between background appends to the log
+flush_threshold = 100       # Append straight away once this many changes are queued
+snapshot_threshold = 10000  # Compact the log into a new snapshot after this many records
+lock_stripes = 64           # Locks that channels and dms are spread over, so sends to different ones run at once
+id_block_size = 100         # Ids of each kind a server process leases from the store at a time
+change_log_size = 10000     # Changes kept for worker processes to catch up on record by record, past which they reload whole collections
+
+# Statistics
+stats_history_size = 20  # Newest values of each statistic kept with their time stamps, returned by the stats endpoints
+
+# Login sessions
+session_idle_ttl = 24 * 60 * 60          # Seconds a session lasts without being used
+session_absolute_ttl = 7 * 24 * 60 * 60  # Seconds a session lasts after login, however much it is used
+session_sweep_interval = 60.0            # Seconds between sweeps for expired sessions
+session_touch_interval = 60.0            # Seconds between writes of when a session was last used
+max_sessions_per_user = 100              # The oldest session of a user is ended past this many
+persist_sessions = True                  # Keep sessions in the data store so they survive a restart
+token_cache_size = 10000                 # Tokens whose u_id is cached by token_decode
+
+# Password hashing
+password_executor = "thread"  # "thread" or "process" pool for hashing
+password_workers = None       # Hashes run at once, defaults to the number of cores
+password_queue_depth = 64     # Hashes that may wait for a worker before logins are turned away
+password_scrypt_n = 2 ** 14   # scrypt cost parameters for new hashes
+password_scrypt_r = 8
+password_scrypt_p = 1
+password_salt_bytes = 16
+password_hash_bytes = 32
+
+# Outbound mail
+mail_transport = os.environ.get("DREAMS_MAIL_TRANSPORT", "smtp")  # "smtp" or "memory"
+mail_host = "smtp.gmail.com"
+mail_port = 587
+mail_username = "mysomeemail38@gmail.com"  # Address password reset emails are sent from
+mail_password = "Pineapple1!"
+mail_timeout = 10.0           # Seconds to wait on the mail server before a send fails
+mail_batch_size = 50          # Messages sent over one connection before the outbox is checked again
+mail_retry_backoff = 5.0      # Seconds before the first retry of a failed message, doubling after each
+mail_max_attempts = 6         # A message is dropped after failing this many times
+reset_code_ttl = 60 * 60      # Seconds a password reset code can be used for
+
+# Standups
+standup_tick = 0.1              # Seconds per slot of the standup timer wheel, the most a standup finishes late by
+standup_wheel_slots = 512       # Slots in the standup timer wheel
+standup_max_buffer = 100000     # Characters a standup can buffer before further sends are refused
+
+# Activity streams
+event_buffer_size = 1000    # Newest events kept for streams that reconnect with a Last-Event-ID
+stream_keepalive = 15.0     # Seconds between comments sent on an idle stream, when it also ends if its session has
+stream_retry = 3000         # Milliseconds a client waits before reconnecting a dropped stream
@@ -1,6 +1,15 @@
 data = {
-    "users": [],
-    "channels": [],
-    "dms": [],
-    "messages": []
+    "users": {},
+    "channels": {},
+    "dms": {},
+    "messages": {},
+    "stats": {},
+    "notifications": {},
+    "sessions": {},
+    "outbox": {},
+    "reset_codes": {},
+    "scheduled": {},
+    "standups": {},
+    "standup_lines": {},
+    "sequences": {}
 }
\ No newline at end of file
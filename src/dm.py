@@ -1,8 +1,11 @@
-import src.data as d
-import pytest
-from src.helper import get_user, user_exists, dm_exists, get_dm, get_message, load_data, save_data, gen_dms_list, dm_name_gen, get_handles, add_dm_to_data, dm_remove_invalid_messages, refresh_reacts
+import src.store as store
+import src.stats as stats
+import src.notifications as notifications
+import src.ids as ids
+from src.helper import get_members, is_dm_member, add_dm_member, remove_dm_member, user_exists, dm_exists, get_dm, gen_dms_list, dm_name_gen, get_handles, add_dm_to_data, messages_page, messages_history
 from src.error import AccessError, InputError
 
+@store.atomic
 def dm_create_v1(auth_u_id, uids):
     '''
     This function creates a dm with the auth_u_id as creator and uids as members
@@ -18,14 +21,17 @@ def dm_create_v1(auth_u_id, uids):
         } 
     '''
     handles = get_handles(auth_u_id, uids)
-    dm_id = len(d.data['dms'])
+    dm_id = ids.next_id('dms')
     dm_name = dm_name_gen(handles)
-    add_dm_to_data(auth_u_id, [get_user(user) for user in uids], dm_id, dm_name)
+    add_dm_to_data(auth_u_id, list(uids), dm_id, dm_name)
+    for u_id in dict.fromkeys(uids):
+        notifications.added(u_id, auth_u_id, dm_id=dm_id)
     return { 
      'dm_id': dm_id,
      'dm_name': dm_name
     }
 
+@store.atomic
 def dm_invite_v1(auth_u_id, dm_id, u_id):
     '''
     This invites someone to a dm that the authorized user is a part of
@@ -54,13 +60,11 @@ def dm_invite_v1(auth_u_id, dm_id, u_id):
     dm = get_dm(dm_id)
     if dm['active'] == False:
         raise InputError
-    if get_user(auth_u_id) not in dm['members']:
+    if not is_dm_member(auth_u_id, dm_id):
         raise AccessError
 
-    invitee = get_user(u_id)
-
-    dm['members'].append(invitee)
-    save_data()
+    add_dm_member(u_id, dm_id)
+    notifications.added(u_id, auth_u_id, dm_id=dm_id)
     return {}
 
 def dm_details_v1(auth_u_id, dm_id):
@@ -90,11 +94,11 @@ def dm_details_v1(auth_u_id, dm_id):
     dm = get_dm(dm_id)
     if dm['active'] == False:
         raise InputError("DM has been removed")
-    if get_user(auth_u_id) not in dm['members']:
+    if not is_dm_member(auth_u_id, dm_id):
         raise AccessError("User is not member of DM")
     return {
         "name": dm["name"],
-        "members": dm["members"]
+        "members": get_members(dm["members"])
     }
 
 def dm_list_v1(auth_u_id):
@@ -119,6 +123,7 @@ def dm_list_v1(auth_u_id):
     dms = gen_dms_list(auth_u_id)
     return { 'dms': dms}
 
+@store.atomic
 def dm_leave_v1(auth_u_id, dm_id):
     '''
     This function takes a user that is part of a dm and makes that user leave
@@ -143,13 +148,13 @@ def dm_leave_v1(auth_u_id, dm_id):
     dm = get_dm(dm_id)
     if dm['active'] == False:
         raise InputError
-    if get_user(auth_u_id) not in dm['members']:
+    if not is_dm_member(auth_u_id, dm_id):
         raise AccessError
 
-    dm['members'].remove(get_user(auth_u_id))
-    save_data()
+    remove_dm_member(auth_u_id, dm_id)
     return {}
 
+@store.atomic
 def dm_remove_v1(auth_u_id, dm_id):
     '''
     This function deletes a dm if the creator is the authorized user
@@ -173,13 +178,19 @@ def dm_remove_v1(auth_u_id, dm_id):
     dm = get_dm(dm_id)
     if dm['active'] == False:
         raise InputError
-    if get_user(auth_u_id) not in dm['members']:
+    if not is_dm_member(auth_u_id, dm_id):
         raise AccessError
     if auth_u_id != dm['creator']:
         raise AccessError
 
-    dm.update({'active': False})
-    save_data()
+    store.update("dms", dm_id, {'active': False})
+    for member in dm['members']:
+        store.remove("users", member, "dms", dm_id)
+        stats.update_user(member, "dms_joined", -1)
+    stats.update_dreams("dms_exist", -1)
+    live_messages = store.history_count("dm_id", dm_id)
+    if live_messages:
+        stats.update_dreams("messages_exist", -live_messages)
     return{}
 
 def dm_messages_v1(auth_u_id, dm_id, start):
@@ -208,51 +219,50 @@ def dm_messages_v1(auth_u_id, dm_id, start):
         }
     '''
 
-    # Removing all of the invalid messages from the list
-    dm_remove_invalid_messages(dm_id)
-    save_data()
-    # Update all the reacts for the current session user
-    refresh_reacts(auth_u_id)
-
     if dm_exists(dm_id) is False:
         raise InputError
     dm = get_dm(dm_id)
     if dm['active'] == False:
         raise InputError
-    if get_user(auth_u_id) not in dm['members']:
+    if not is_dm_member(auth_u_id, dm_id):
         raise AccessError
 
-    dmMessageIDs = dm["messages"]
-    dmMessageIDs.reverse()
-    
-    numOfMessages = len(dm["messages"])
-
+    return messages_page("dm_id", dm_id, auth_u_id, start)
 
-    if start > numOfMessages:
-        raise InputError("Start is out of bounds of list")
-
-
-    formal_end = start + 50
-    if formal_end >= numOfMessages:
-        formal_end = -1
+def dm_history_v1(auth_u_id, dm_id, before_message_id=-1, after_message_id=-1, limit=50):
+    '''
+    This function takes an authorised user which is a part of the dm specified
+    and returns up to limit messages, newest first, older than before_message_id
+    or newer than after_message_id. The cursors returned can be passed back in
+    to page through the dm's history
 
-    end = formal_end
+    Arguments:
+    auth_u_id (Integer)    - User who is already part of the dm specified
+    dm_id (Integer)    - dm which the messages are to be returned from
+    before_message_id (Integer)    - Only return messages older than this one, -1 for the newest
+    after_message_id (Integer)    - Only return the messages straight after this one, -1 for none
+    limit (Integer)    - The most messages to return, 1 to 50
+    
+    Exceptions:
+        InputError  - Occurs when 
+                        1. dm is not a valid dm
+                        2. limit is not between 1 and 50
+        AccessError - Occurs when 
+                        1. the user associated with auth_u_id is not a member of the dm specified
 
+    Return Value:
+        Returns {
+            'messages': [List of messages],
+            'before_message_id': before_message_id of the next older page, or -1,
+            'after_message_id': after_message_id of the next newer page,
+        }
+    '''
+    if dm_exists(dm_id) is False:
+        raise InputError
+    dm = get_dm(dm_id)
+    if dm['active'] == False:
+        raise InputError
+    if not is_dm_member(auth_u_id, dm_id):
+        raise AccessError
 
-    dmMessages = []
-    for message in range(start, start + 50):
-        if end == -1 and message == numOfMessages:
-            break
-        msg = get_message(dmMessageIDs[message])
-        if msg["removed"] and end != -1:
-            end += 1
-            if end >= numOfMessages:
-                end = -1
-            continue
-        dmMessages.append(msg)
-    
-    return {
-        'messages' :dmMessages,
-        'start': start,
-        'end': formal_end,
-    }
\ No newline at end of file
+    return messages_history("dm_id", dm_id, auth_u_id, before_message_id, after_message_id, limit)
\ No newline at end of file
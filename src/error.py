@@ -7,3 +7,7 @@ class AccessError(HTTPException):
 class InputError(HTTPException):
     code = 400
     message = 'No message specified'
+
+class ServiceUnavailableError(HTTPException):
+    code = 503
+    message = 'No message specified'
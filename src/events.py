@@ -0,0 +1,127 @@
+'''
+events.py
+
+The hub behind the activity stream, /events/stream/v1, which pushes what
+happens to messages to the clients of the channels and dms it happens in
+rather than having them poll the messages endpoints.
+
+The operations in message.py publish an event for each message sent,
+edited, removed, reacted to or pinned, while they still hold the channel or
+dm, so the events of each conversation are published in the order their
+changes were made. Every stream waits on the hub, wakes when an event is
+published and picks out the events its user can see.
+
+The newest config.event_buffer_size events are kept, so a client that
+reconnects with the Last-Event-ID it was last sent is given everything it
+missed. Each event id is the position just past the event, made of the
+hub's epoch and a count of the events before it. The epoch is new each
+time the hub is reset, so a client that fell further behind than the
+buffer, or whose ids are from before the store was cleared or the server
+restarted, is told to reload instead.
+
+The hub lives in the memory of one process. When the server runs as several
+worker processes, a stream carries the events published by the worker
+serving it.
+'''
+import secrets
+import threading
+from collections import deque
+from src import config
+
+# Event types and the change each one describes
+SENT = "message_sent"
+EDITED = "message_edited"
+REMOVED = "message_removed"
+REACTS = "reacts_changed"
+PIN = "pin_changed"
+
+_cond = threading.Condition()
+# The newest config.event_buffer_size events, oldest first
+_events = deque()
+_epoch = secrets.token_hex(4)
+# The number of events published since the hub was last reset
+_published = 0
+
+def publish(kind, message):
+    '''
+    Publishes a change to a message to every stream
+
+    Arguments:
+    kind (String)        - One of the event types above, eg SENT
+    message (Dictionary) - The message after the change, as stored
+
+    Return Value: None
+    '''
+    global _published
+    with _cond:
+        _published += 1
+        _events.append({
+            "event_id": f"{_epoch}-{_published}",
+            "type": kind,
+            # The engine may change the stored record in place later on, but
+            # every mutation replaces whole fields, so a shallow copy keeps
+            # the message as it was
+            "message": dict(message),
+        })
+        while len(_events) > config.event_buffer_size:
+            _events.popleft()
+        _cond.notify_all()
+
+def position():
+    '''
+    Returns the id of the position past the newest event, to read only the
+    events published from now on
+    '''
+    with _cond:
+        return f"{_epoch}-{_published}"
+
+def wait(after, timeout):
+    '''
+    Waits until there are events past a position
+
+    Arguments:
+    after (String)  - An event id, or a position from position()
+    timeout (Float) - The most seconds to wait
+
+    Return Value:
+        Returns the events past after, oldest first, [] if none were
+        published before the timeout, or None if the events past after are
+        no longer kept
+    '''
+    with _cond:
+        seen = _seen(after)
+        if seen is None:
+            return None
+        _cond.wait_for(lambda: _seen(after) != seen or _published > seen, timeout)
+        if _seen(after) != seen:
+            return None
+        # The buffer holds the events after _published - len(_events)
+        return list(_events)[len(_events) - (_published - seen):]
+
+def reset():
+    '''
+    Drops every event and starts a new epoch, so every stream is told to
+    reload. Called whenever the data store is cleared or reloaded
+    '''
+    global _epoch, _published
+    with _cond:
+        _events.clear()
+        _epoch = secrets.token_hex(4)
+        _published = 0
+        _cond.notify_all()
+
+############################## HELPER FUNCTIONS ###############################
+
+def _seen(event_id):
+    '''
+    Returns how many events of the current epoch an event id is past, or
+    None if it is from another epoch or the events after it are no longer
+    kept
+    '''
+    epoch, _, count = str(event_id).partition("-")
+    if epoch != _epoch or not count.isdigit():
+        return None
+    count = int(count)
+    if not _published - len(_events) <= count <= _published:
+        return None
+    return count
@@ -0,0 +1,91 @@
+'''
+file_lock.py
+
+Locks that also exclude other processes, for running the server as several
+processes over one database.
+
+A FileLock is one byte of a lock file, locked with fcntl, so every process
+that opens the same file agrees on who holds it. Taking a byte of the file
+shared or exclusive blocks until no other process holds it exclusive, or at
+all. fcntl locks belong to the process rather than the thread, so a FileLock
+never excludes the threads of the process holding it; the in-process locks
+wrapped around it do that.
+
+Each process opens a lock file once and every lock on it shares that
+descriptor, as closing any descriptor of a file drops every lock the
+process holds on it. A process forked after the file was opened opens it
+again, as locks are not inherited over a fork.
+'''
+import fcntl
+import os
+import threading
+
+_files_lock = threading.Lock()
+# path -> (pid, descriptor)
+_files = {}
+
+class FileLock:
+    def __init__(self, path, offset):
+        '''
+        Arguments:
+        path (String)    - The lock file, created if it does not exist
+        offset (Integer) - The byte of the file this lock is
+        '''
+        self.path = path
+        self.offset = offset
+
+    def acquire(self, shared=False):
+        '''
+        Locks the byte, waiting until no other process holds it exclusive,
+        or at all when shared is False
+        '''
+        mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        fcntl.lockf(_open(self.path), mode, 1, self.offset, os.SEEK_SET)
+
+    def release(self):
+        fcntl.lockf(_open(self.path), fcntl.LOCK_UN, 1, self.offset, os.SEEK_SET)
+
+class FileRLock:
+    '''
+    A reentrant lock that one thread in one process holds at a time
+    '''
+    def __init__(self, path, offset):
+        self._lock = threading.RLock()
+        self._file = FileLock(path, offset)
+        self._depth = 0
+
+    def acquire(self):
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth == 1:
+            try:
+                self._file.acquire()
+            except BaseException:
+                self._depth -= 1
+                self._lock.release()
+                raise
+
+    def release(self):
+        self._depth -= 1
+        if not self._depth:
+            self._file.release()
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+def _open(path):
+    '''
+    Returns this process's descriptor of a lock file, opening it the first
+    time
+    '''
+    with _files_lock:
+        pid, fd = _files.get(path, (None, None))
+        if pid != os.getpid():
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            _files[path] = (os.getpid(), fd)
+        return fd
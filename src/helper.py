@@ -1,16 +1,52 @@
-import src.data as d
+import src.store as store
+import src.stats as stats
+import src.search as search
+import src.mentions as mentions
+import src.sessions as sessions
+import src.token_cache as token_cache
+import src.mail as mail
+import src.scheduler as scheduler
+import src.ids as ids
+import src.events as events
 import jwt
 from src.error import AccessError, InputError
-import json
 
 def load_data():
-    with open("src/data.json") as f:
-        data = json.load(f)
-        return data
+    '''
+    Reads the persisted data store from the storage engine as one image. Only
+    needed to inspect what has been persisted, every other read goes through
+    the accessors in this file
+
+    Return Value:
+        Returns data - Dictionary containing the users, channels, dms and messages lists
+    '''
+    return store.export()
+
+def init_data():
+    '''
+    Loads the persisted data into the storage engine selected in config.
+    This is called once when the process starts, after which all modules
+    read the data through the helpers in this file and change it through
+    the mutation functions in store.py
+    '''
+    store.load()
+    ids.reset()
+    search.reset()
+    mentions.reset()
+    sessions.reset()
+    token_cache.clear()
+    mail.reset()
+    scheduler.reset()
+    events.reset()
+    _reset_standups()
 
 def save_data():
-    with open("src/data.json", "w") as f:
-        json.dump(d.data, f)
+    '''
+    Makes every change made so far durable. Mutations are logged by store.py
+    on their own, this is only needed when a caller has to wait for the
+    write, eg before reading the data file from another process
+    '''
+    store.flush()
 
 def get_user(u_id):
     '''
@@ -22,15 +58,15 @@ def get_user(u_id):
     Return Value:
         Returns user - Dictionary containing the user's data (first name, last name, user_id, handle, email)
     '''
-    for user in d.data["users"]:
-        if u_id == user["u_id"]:
-            return {
-                "u_id": user["u_id"],
-                "name_first": user["name_first"],
-                "name_last": user["name_last"],
-                "handle_str": user["handle_str"],
-                "email": user["email"],
-            }
+    user = store.get("users", u_id)
+    if user is not None:
+        return {
+            "u_id": user["u_id"],
+            "name_first": user["name_first"],
+            "name_last": user["name_last"],
+            "handle_str": user["handle_str"],
+            "email": user["email"],
+        }
 
 def get_user_wPerms(u_id):
     '''
@@ -42,16 +78,16 @@ def get_user_wPerms(u_id):
     Return Value:
         Returns user - Dictionary containing the user's data (first name, last name, user_id, handle, email)
     '''
-    for user in d.data["users"]:
-        if u_id == user["u_id"]:
-            return {
-                "u_id": user["u_id"],
-                "name_first": user["name_first"],
-                "name_last": user["name_last"],
-                "handle_str": user["handle_str"],
-                "email": user["email"],
-                "permission": user['permission']
-            }
+    user = store.get("users", u_id)
+    if user is not None:
+        return {
+            "u_id": user["u_id"],
+            "name_first": user["name_first"],
+            "name_last": user["name_last"],
+            "handle_str": user["handle_str"],
+            "email": user["email"],
+            "permission": user['permission']
+        }
     
 def get_channel(channel_id):
     '''
@@ -64,9 +100,7 @@ def get_channel(channel_id):
         Returns channel - Dictionary containing the channel's data including name, 
                           channel_id, owner_members, all_members, privacy status etc
     '''
-    for channel in d.data["channels"]:
-        if int(channel_id) == channel["channel_id"]:
-            return channel
+    return store.get("channels", int(channel_id))
 
 def channel_exists(channel_id):
     '''
@@ -79,11 +113,7 @@ def channel_exists(channel_id):
         Returns True - if the channel exists in the data
                 False - if the channel does not exist
     '''
-    d.data = load_data()
-    for channel in d.data["channels"]:
-        if channel_id == channel["channel_id"]:
-            return True
-    return False
+    return store.get("channels", channel_id) is not None
 
 def user_exists(u_id):
     '''
@@ -96,10 +126,7 @@ def user_exists(u_id):
         Returns True - if the user exists in the data
                 False - if the user does not exist
     '''
-    for user in d.data["users"]:
-        if u_id == user["u_id"]:
-            return True
-    return False
+    return store.get("users", u_id) is not None
 
 def is_member(u_id, channel_id):
     '''
@@ -113,22 +140,186 @@ def is_member(u_id, channel_id):
         Returns True - if the user is part of the channel
                 False - if user is not part of the channel
     '''
-    for channel in d.data["channels"]:
-        if channel_id == channel["channel_id"]:
-            if get_user(u_id) in channel["all_members"]:
-                return True
-    return False
+    return store.contains("channels", channel_id, "all_members", u_id)
+
+def is_owner(u_id, channel_id):
+    '''
+    Checks if a user is an owner of a channel
+
+    Arguments:
+    u_id (Integer) - the user to check if they are an owner of a channel
+    channel_id (Integer) - the channel to check the owners of
+
+    Return Value:
+        Returns True - if the user is an owner of the channel
+                False - if user is not an owner of the channel
+    '''
+    return store.contains("channels", channel_id, "owner_members", u_id)
+
+def is_dm_member(u_id, dm_id):
+    '''
+    Checks if a user is a member of a dm
+
+    Arguments:
+    u_id (Integer) - the user to check if they are a member of a dm
+    dm_id (Integer) - the dm to check if the user is part of it
+
+    Return Value:
+        Returns True - if the user is part of the dm
+                False - if user is not part of the dm
+    '''
+    return store.contains("dms", dm_id, "members", u_id)
+
+def add_channel_member(u_id, channel_id):
+    '''
+    Adds a user to the members of a channel, and the channel to the
+    user's list of joined channels
+
+    Arguments:
+    u_id (Integer) - the user joining the channel
+    channel_id (Integer) - the channel being joined
+
+    Return Value: None
+    '''
+    store.append("channels", channel_id, "all_members", u_id)
+    store.append("users", u_id, "channels", channel_id)
+    stats.update_user(u_id, "channels_joined", 1)
+
+def remove_channel_member(u_id, channel_id):
+    '''
+    Removes a user from the members of a channel, and the channel from the
+    user's list of joined channels
+
+    Arguments:
+    u_id (Integer) - the user leaving the channel
+    channel_id (Integer) - the channel being left
+
+    Return Value: None
+    '''
+    store.remove("channels", channel_id, "all_members", u_id)
+    store.remove("users", u_id, "channels", channel_id)
+    stats.update_user(u_id, "channels_joined", -1)
+
+def add_dm_member(u_id, dm_id):
+    '''
+    Adds a user to the members of a dm, and the dm to the user's list of dms
+
+    Arguments:
+    u_id (Integer) - the user joining the dm
+    dm_id (Integer) - the dm being joined
+
+    Return Value: None
+    '''
+    store.append("dms", dm_id, "members", u_id)
+    store.append("users", u_id, "dms", dm_id)
+    stats.update_user(u_id, "dms_joined", 1)
+
+def remove_dm_member(u_id, dm_id):
+    '''
+    Removes a user from the members of a dm, and the dm from the user's list of dms
+
+    Arguments:
+    u_id (Integer) - the user leaving the dm
+    dm_id (Integer) - the dm being left
+
+    Return Value: None
+    '''
+    store.remove("dms", dm_id, "members", u_id)
+    store.remove("users", u_id, "dms", dm_id)
+    stats.update_user(u_id, "dms_joined", -1)
+
+def get_members(u_ids):
+    '''
+    Builds the profiles of a list of members, for the details responses
+
+    Arguments:
+    u_ids (List[int]) - the members of a channel or dm
+
+    Return Value:
+        Returns [{user1}, {user2} ...] in the format of get_user
+    '''
+    return [get_user(u_id) for u_id in u_ids]
 
 def reset_data():
     '''
-    Resets the data in the data file
+    Resets the data in the in-memory store and the data file
     '''
 
-    d.data.update({"users": []})
-    d.data.update({"channels": []})
-    d.data.update({"messages": []})
-    d.data.update({"dms": []})
-    save_data()
+    store.clear()
+    ids.reset()
+    search.reset()
+    mentions.reset()
+    sessions.reset()
+    token_cache.clear()
+    mail.reset()
+    scheduler.reset()
+    events.reset()
+    _reset_standups()
+
+def _sync_caches(changed):
+    '''
+    Brings what this process holds in memory up to date with the records
+    another server process has changed, one record at a time, eg a message
+    is re-indexed for search. A collection is only read again as a whole
+    when which of its records changed is no longer known, and even then it
+    is only rebuilt once it is next needed. Registered with store.on_change
+
+    Arguments:
+    changed (Dictionary) - Each collection changed -> the set of keys
+                           changed in it, or None, eg {"messages": {4, 7}}
+    '''
+    # standup.py imports this file, see _reset_standups
+    import src.standup as standup
+    for table, keys in changed.items():
+        if table == "sequences":
+            ids.sync()
+        elif table == "messages":
+            _sync_records(keys, search.reset, search.sync_message)
+        elif table == "users":
+            _sync_records(keys, _reset_users, _sync_user)
+        elif table == "sessions":
+            _sync_records(keys, _reset_sessions, sessions.sync_session)
+        elif table == "outbox":
+            _sync_records(keys, mail.reset, mail.sync_mail)
+        elif table == "scheduled":
+            _sync_records(keys, scheduler.reset, scheduler.sync_job)
+        elif table == "standups":
+            _sync_records(keys, _reset_standups, standup.sync_standup)
+        elif table == "standup_lines":
+            _sync_records(keys, _reset_standups, standup.sync_line)
+
+def _sync_records(keys, reset, sync):
+    '''
+    Calls sync with each key changed, or reset when they are not known
+    '''
+    if keys is None:
+        reset()
+        return
+    for key in keys:
+        sync(key)
+
+def _sync_user(u_id):
+    mentions.sync_user(u_id)
+    # Their handle, which their first token holds, may have changed
+    token_cache.invalidate_user(u_id)
+
+def _reset_users():
+    mentions.reset()
+    token_cache.clear()
+
+def _reset_sessions():
+    sessions.reset()
+    token_cache.clear()
+
+store.on_change(_sync_caches)
+
+def _reset_standups():
+    '''
+    Reads the active standups from the store again. standup.py imports this
+    file, so it is only imported once it is needed
+    '''
+    import src.standup as standup
+    standup.reset()
 
 def get_channel_listformat(channel_id):
     '''
@@ -143,20 +334,46 @@ def get_channel_listformat(channel_id):
             "name": name
         }
     '''
-    for channel in d.data["channels"]:
-        if int(channel_id) == channel["channel_id"]:
-            return {"channel_id": channel["channel_id"], "name": channel["name"]}
+    channel = store.get("channels", int(channel_id))
+    if channel is not None:
+        return {"channel_id": channel["channel_id"], "name": channel["name"]}
 
 def get_id_and_password(email):
-    for user in d.data['users']:
-        if user['email'] == email:
-            pw = jwt.decode(user['password'], "", algorithms=["HS256"])
+    '''
+    Finds the user with an email and their stored password, to be checked
+    with passwords.verify
 
-            return {'user_id': user['u_id'], 'password': pw['password']}
+    Arguments:
+    email (String) - The email the user registered with
+
+    Return Value:
+        Returns {'user_id': u_id, 'password': stored password}, or None if no
+        user has the email
+    '''
+    user = store.find("users", "email", email)
+    if user is not None:
+        return {'user_id': user['u_id'], 'password': user['password']}
+
+def create_token(handle, u_id=None, session_id=None):
+    '''
+    Creates a token for a user. The token of a user's first session holds
+    just their handle, so it can always be made again from the handle. The
+    tokens of any further sessions also hold the u_id and session_id, which
+    lets token_decode find the user without looking up the handle
+
+    Arguments:
+    handle (String)      - The user's handle_str
+    u_id (Integer)       - The user's u_id, for a further session
+    session_id (Integer) - The id of the further session
 
-def create_token(handle):
+    Return Value:
+        Returns the token
+    '''
     # Login, Register
-    return jwt.encode({'handle': handle}, "", algorithm='HS256')
+    claims = {'handle': handle}
+    if u_id is not None:
+        claims.update({'u_id': u_id, 'session_id': session_id})
+    return jwt.encode(claims, "", algorithm='HS256')
 
 
 '''def is_valid_token(token):
@@ -170,7 +387,8 @@ def create_token(handle):
 
 def token_decode(token):
     '''
-    Finds a u_id from the token
+    Finds a u_id from the token. Tokens seen recently are answered from
+    token_cache without being decoded
 
     Arguments:
     token - The token that we want to get u_id from
@@ -178,14 +396,23 @@ def token_decode(token):
     Return Value:
         Returns u_id
     '''
-    SECRET = ""
-    handle = jwt.decode(token, SECRET, algorithms=["HS256"])
-
-    u_id = ''
+    u_id = token_cache.get(token)
+    if u_id is not None:
+        return u_id
 
-    for user in d.data["users"]:
-        if user["handle_str"] == handle['handle']:
-            u_id = user["u_id"]
+    SECRET = ""
+    claims = jwt.decode(token, SECRET, algorithms=["HS256"])
+
+    if 'u_id' in claims:
+        # The token is only valid while the user still has the handle it was made for
+        user = store.get("users", claims['u_id'])
+        if user is not None and user["handle_str"] != claims['handle']:
+            user = None
+    else:
+        user = store.find("users", "handle_str", claims['handle'])
+    u_id = user["u_id"] if user is not None else ''
+    if user is not None:
+        token_cache.put(token, u_id)
 
     return int(u_id)
 
@@ -198,10 +425,19 @@ def dm_exists(dm_id):
     
     Return Value: dm_exists ? True : False
     '''
-    for dm in d.data['dms']:
-        if dm['dm_id'] == dm_id:
-            return True
-    return False
+    return store.get("dms", dm_id) is not None
+
+def dm_active(dm_id):
+    '''
+    Checks to see if a dm exists and has not been removed
+
+    Arguments:
+    dm_id (Integer) - the id of the dm to check
+
+    Return Value: dm_active ? True : False
+    '''
+    dm = store.get("dms", dm_id)
+    return dm is not None and dm["active"] == True
 
 def get_dm(dm_id):
     '''
@@ -213,15 +449,12 @@ def get_dm(dm_id):
     Return Value: {
         "dm_id": Integer,
         "name": String,
-        "members": [List of users that make up the members],
-        "messages": [List of message IDs],
+        "members": [List of u_ids of the members],
         "creator": Integer (u_id of creator),
         "active": Boolean
     }
     '''
-    for dm in d.data['dms']:
-        if dm['dm_id'] == dm_id:
-            return dm
+    return store.get("dms", dm_id)
 
 def get_message(message_id):
     '''
@@ -238,10 +471,26 @@ def get_message(message_id):
             False
         }
     '''
-    for message in d.data["messages"]:
-        if message_id == message["message_id"]:
-            return message
-    return False
+    message = store.get("messages", message_id)
+    return message if message is not None else False
+
+def message_conversation(message_id):
+    '''
+    Finds the channel or dm a message was sent to, which never changes once
+    it is sent
+
+    Arguments:
+    message_id (Integer) - The id of the message
+
+    Return Value:
+        Returns ("channel_id", channel_id) or ("dm_id", dm_id), or None if
+        there is no such message
+    '''
+    message = store.get("messages", message_id)
+    if message is None:
+        return None
+    field = "channel_id" if "channel_id" in message else "dm_id"
+    return field, message[field]
 
 def remove_message(message_id):
     '''
@@ -255,14 +504,16 @@ def remove_message(message_id):
 
         }
     '''
-    for message in d.data["messages"]:
-        if message_id == message["message_id"]:
-            message["removed"] = True
+    store.update("messages", message_id, {"removed": True})
+    search.unindex_message(message_id)
+    stats.update_dreams("messages_exist", -1)
+    events.publish(events.REMOVED, store.get("messages", message_id))
 
 def valid_message(message_id):
     '''
     Checks if a message has been deleted or not, returns true if it hasn't 
-    and false if it has
+    and false if it has. The messages of a removed dm count as deleted, as
+    they stopped counting towards num_messages_exist when it was removed
 
     Arguments:
     message_id (Integer) - the message to check
@@ -275,49 +526,38 @@ def valid_message(message_id):
             False
         }
     '''
-    for message in d.data["messages"]:
-        if message_id == message["message_id"] and message["removed"] == False:
-            return True
-    return False
+    message = store.get("messages", message_id)
+    if message is None or message["removed"] == True:
+        return False
+    return "dm_id" not in message or dm_active(message["dm_id"])
 
-def remove_invalid_messages(channel_id):
+def get_message_text(message_id):
     '''
-    Removes all invalid messages from the list of messages in the channel_id
+    Gets the text of the message with message_id
 
     Arguments:
-    channel_id (Integer) - The channel to remove invalid messages from
+    message_id (Integer) - the message to get text from
 
     Return Value:
         Returns {
-
+            message
         }
     '''
-    for channel in d.data["channels"]:
-        if channel_id == channel["channel_id"]:
-            for message in channel["messages"]:
-                if not valid_message(message):
-                    channel["messages"].remove(message)
+    message = store.get("messages", message_id)
+    if message is not None:
+        return message["message"]
 
-def get_message_text(message_id):
+def token_active(token):
     '''
-    Gets the text of the message with message_id
+    Checks if a token belongs to a live login session
 
     Arguments:
-    message_id (Integer) - the message to get text from
+    token (String) - The token sent with the request
 
     Return Value:
-        Returns {
-            message
-        }
+        Returns True if the session has not ended or expired, False otherwise
     '''
-    for message in d.data["messages"]:
-        if message_id == message["message_id"]:
-            return message["message"]
-
-def token_active(active_tokens, token):
-    if token in active_tokens:
-        return True
-    return False
+    return sessions.is_active(token)
 
 def gen_dms_list(auth_u_id):
     '''
@@ -331,9 +571,9 @@ def gen_dms_list(auth_u_id):
         Returns dms : -> [{dm1}, {dm2} ...] 
     '''
     dms = []
-    user = get_user(auth_u_id)
-    for dm in d.data['dms']:
-        if user in dm['members'] and dm['active'] == True:
+    for dm_id in sorted(store.get('users', auth_u_id)['dms']):
+        dm = get_dm(dm_id)
+        if dm['active'] == True:
             dm = {
                 "dm_id": dm['dm_id'],
                 "name": dm['name']
@@ -390,23 +630,25 @@ def add_dm_to_data(creator, members, dm_id, name):
 
     Arguments:
     creator (Integer)    - User who's dms are being returned
-    members (List(Int))  - List of members
+    members (List(Int))  - List of members' u_ids
     dm_id (Integer)      - ID of the dm
     name (String)        - The name of the dm
 
     Return Value: None 
     '''
-    d.data = load_data()
     dm = {}
-    members.append(get_user(creator))
+    members.append(creator)
+    members = list(dict.fromkeys(members))
     dm.update({'dm_id': dm_id})
     dm.update({"creator": creator})
     dm.update({"members": members})
     dm.update({"name": name})
     dm.update({"active": True})
-    dm.update({"messages": []})
-    d.data['dms'].append(dm)
-    save_data()
+    store.insert("dms", dm)
+    for u_id in members:
+        store.append("users", u_id, "dms", dm_id)
+        stats.update_user(u_id, "dms_joined", 1)
+    stats.update_dreams("dms_exist", 1)
 
 def check_is_pinned(message_id):
     '''
@@ -417,49 +659,108 @@ def check_is_pinned(message_id):
 
     Return Value: None
     '''
-    for message in d.data['messages']:
-        if message_id == message['message_id'] and message['is_pinned'] == True:
-            return True
-    return False
+    message = store.get("messages", message_id)
+    return message is not None and message['is_pinned'] == True
 
-def refresh_reacts(u_id):
+def format_message(message, u_id):
     '''
-    This function takes in the u_id of the current session user, and checks 
-    all uids in every message react, and if u_id is there, update the 
-    is_this_user_reacted_value
+    This function takes a stored message and formats it for the user viewing
+    it, turning its reacts into the list returned by the messages endpoints
+    and working out is_this_user_reacted for that user
 
     Arguments:
-    u_id (Integer)    - The u_id of the current user
+    message (Dictionary) - The message as it is stored
+    u_id (Integer)       - The u_id of the user viewing the message
+
+    Return Value:
+        Returns the message, with 'reacts': [{
+            'react_id': Integer,
+            'u_ids': [List of u_ids],
+            'is_this_user_reacted': Boolean
+        }]
+    '''
+    reacts = [
+        {
+            'react_id': int(react_id),
+            'u_ids': list(u_ids),
+            'is_this_user_reacted': u_id in u_ids
+        }
+        for react_id, u_ids in message['reacts'].items()
+    ]
+    return dict(message, reacts=reacts)
 
-    Return Value: True if message exists and is pinned, 
-                  False otherwise 
+def messages_page(field, key, u_id, start):
     '''
-    d.data = load_data()
+    Gets a page of up to 50 live messages of a channel or dm, newest first,
+    beginning start messages back from the newest one. Only the page itself
+    is read, however many messages the channel or dm holds
 
-    for message in d.data['messages']:
-        for react in message['reacts']:
-            if u_id in react['u_ids']:
-                react['is_this_user_reacted'] = True
-            else:
-                react['is_this_user_reacted'] = False
+    Arguments:
+    field (String)   - "channel_id" or "dm_id"
+    key (Integer)    - The id of the channel or dm
+    u_id (Integer)   - The user viewing the messages
+    start (Integer)  - The number of newest messages to skip
+
+    Exceptions:
+        InputError  - Occurs when start is greater than the number of messages
 
-    save_data()
+    Return Value:
+        Returns {
+            'messages': [List of formatted messages],
+            'start': start,
+            'end': start + 50, or -1 if the page holds the oldest message,
+        }
+    '''
+    num_messages = store.history_count(field, key)
+    if start > num_messages:
+        raise InputError("Start is out of bounds of list")
+    end = start + 50
+    if end >= num_messages:
+        end = -1
+    return {
+        'messages': [format_message(message, u_id) for message in store.history(field, key, 50, offset=start)],
+        'start': start,
+        'end': end,
+    }
 
-def dm_remove_invalid_messages(dm_id):
+def messages_history(field, key, u_id, before_message_id, after_message_id, limit):
     '''
-    Removes all invalid messages from the list of messages in the dm_id
+    Gets a page of up to limit live messages of a channel or dm, newest
+    first, around the given message_id cursors. Without after_message_id the
+    page is the newest messages before before_message_id (or the newest
+    messages of all), with it the page is the messages straight after
+    after_message_id
 
     Arguments:
-    dm_id (Integer) - The dm to remove invalid messages from
+    field (String)              - "channel_id" or "dm_id"
+    key (Integer)               - The id of the channel or dm
+    u_id (Integer)              - The user viewing the messages
+    before_message_id (Integer) - Only messages older than this one, or -1
+    after_message_id (Integer)  - Only messages newer than this one, or -1
+    limit (Integer)             - The most messages to return, 1 to 50
+
+    Exceptions:
+        InputError  - Occurs when limit is not between 1 and 50
 
     Return Value:
         Returns {
-
+            'messages': [List of formatted messages],
+            'before_message_id': The cursor for the next older page, or -1 if there are no older messages,
+            'after_message_id': The cursor for the next newer page,
         }
     '''
-    dm = get_dm(dm_id)
-    if dm is None:
-        return
-    for message in dm['messages']:
-        if not valid_message(message):
-            dm["messages"].remove(message)
\ No newline at end of file
+    if limit < 1 or limit > 50:
+        raise InputError("Limit must be between 1 and 50")
+    before = None if before_message_id == -1 else before_message_id
+    after = None if after_message_id == -1 else after_message_id
+    messages = store.history(field, key, limit, before=before, after=after)
+
+    older = -1
+    if messages and store.history(field, key, 1, before=messages[-1]['message_id']):
+        older = messages[-1]['message_id']
+    newer = messages[0]['message_id'] if messages else after_message_id
+    return {
+        'messages': [format_message(message, u_id) for message in messages],
+        'before_message_id': older,
+        'after_message_id': newer,
+    }
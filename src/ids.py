@@ -0,0 +1,99 @@
+'''
+ids.py
+
+The ids of new users, channels, dms and messages, and of the records
+behind sessions, standups and statistics that server processes add without
+holding the whole store.
+
+The next id of each kind that no server process has been given yet, its
+high-water mark, is kept in the "sequences" collection of the store. A
+process never asks the store for one id at a time: it leases a block of
+config.id_block_size ids by moving the high-water mark up with
+store.increment, in one step no other process can come between, and hands
+ids out of the block until it runs out. Handing out an id is one next() on
+an itertools.count, which the interpreter does without a lock, so threads
+only ever wait for each other when a block runs out and a new one is
+leased. Ids never collide across threads or processes, and are increasing
+within each process, but ids from different processes interleave and the
+ids left in a block when a process stops are never used.
+
+The first time a kind is needed the high-water mark starts past every id
+already in the store, so data from before there was a sequences collection
+keeps its ids.
+'''
+import itertools
+import threading
+from src import config
+import src.store as store
+
+# Each kind of id, its sequence_id in the "sequences" collection, the id
+# the first record gets and the collections whose keys it must stay past
+SEQUENCES = {
+    "users": (0, 0, ("users",)),
+    "channels": (1, 1, ("channels",)),
+    "dms": (2, 0, ("dms",)),
+    "messages": (3, 0, ("messages", "scheduled")),
+    "sessions": (4, 0, ("sessions",)),
+    "standup_lines": (5, 0, ("standup_lines",)),
+}
+
+_lock = threading.Lock()
+# kind -> (itertools.count over the block, the end of the block)
+_blocks = {}
+
+def next_id(kind):
+    '''
+    Returns a new id, never given out before by any process
+
+    Arguments:
+    kind (String) - One of SEQUENCES, eg "messages"
+
+    Return Value:
+        Returns the id as an Integer
+    '''
+    while True:
+        block = _blocks.get(kind)
+        if block is not None:
+            new_id = next(block[0])
+            if new_id < block[1]:
+                return new_id
+        _lease(kind, block)
+
+def reset():
+    '''
+    Drops the blocks this process has leased. Called whenever the data
+    store is cleared or reloaded, as the high-water marks may have moved
+    '''
+    with _lock:
+        _blocks.clear()
+
+def sync():
+    '''
+    Drops the blocks whose high-water mark has since gone back, which
+    happens when another server process clears the store
+    '''
+    with _lock:
+        for kind, block in list(_blocks.items()):
+            record = store.get("sequences", SEQUENCES[kind][0])
+            if record is None or record["high_water"] < block[1]:
+                del _blocks[kind]
+
+############################## HELPER FUNCTIONS ###############################
+
+def _lease(kind, spent):
+    '''
+    Leases the next block of ids of a kind from the store, unless another
+    thread already replaced the spent block while this one waited
+    '''
+    with _lock:
+        if _blocks.get(kind) is not spent:
+            return
+        sequence_id, first, tables = SEQUENCES[kind]
+        keys = [key for key in (store.max_key(table) for table in tables) if key is not None]
+        initial = {
+            "sequence_id": sequence_id,
+            "kind": kind,
+            "high_water": max(keys) + 1 if keys else first,
+        }
+        end = store.increment("sequences", sequence_id, "high_water", config.id_block_size, initial)
+        _blocks[kind] = (itertools.count(end - config.id_block_size), end)
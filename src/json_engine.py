@@ -0,0 +1,605 @@
+'''
+json_engine.py
+
+The default storage engine. The whole data store lives in memory in d.data
+and is persisted as a snapshot in config.data_path (src/data.json) plus an
+append-only log of changes in config.log_path.
+
+Every change is applied to d.data and queued as one small JSON record for
+the log. A background flusher appends every queued record to the log in
+one write and fsyncs it, either every config.flush_interval seconds or as
+soon as config.flush_threshold records are queued. Once the log holds
+config.snapshot_threshold records, the flusher compacts it by writing a
+new snapshot and truncating the log. The new snapshot is built by replaying
+the log on top of the old one, so it is never serialised from d.data while
+writers wait on it.
+
+On start up load() reads the latest snapshot and replays the log tail on
+top of it. Records are idempotent (inserts replace a record with the same
+key, appends skip values that are already present, deletes skip records
+that are already gone), so replaying records
+that a snapshot already contains is harmless. A crash while the log is
+being appended to can at worst lose the last, partially written record.
+
+In memory each collection of d.data is a dict from each record's id to the
+record, in the order the records were inserted, so point lookups, replaces
+and deletes never scan a collection. The data file keeps the data.json
+format of one list per collection, and an image of that format assigned to
+d.data as a whole, eg by a test, is keyed again on its next use. The other
+indexes are kept in step by apply(), which every change goes through, and
+are rebuilt if d.data is replaced as a whole, eg by load(). The member fields listed in
+UNIQUE_FIELDS are indexed as a dict from each value to its record, the
+member fields listed in MEMBER_FIELDS as a set of u_ids per record, and
+the live messages of each channel and dm as a list of
+(store.position, message_id) in ascending order, so a page of history is a
+bisect and a slice.
+'''
+import json
+import os
+from bisect import bisect_left
+import threading
+import src.data as d
+from src import config
+from src.store import TABLE_KEYS, MEMBER_FIELDS, UNIQUE_FIELDS, HISTORY_FIELDS, write_file, position
+from src.upgrade import upgrade
+
+class JSONEngine:
+    # d.data is only in the memory of this process
+    shareable = False
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._queued = []
+        self._log_records = 0
+        self._flusher = None
+        self._running = False
+        self._indexed = None
+        self._max = {}
+        self._members = {}
+        self._unique = {}
+        self._history = {}
+
+    ################################# READS ###################################
+
+    def get(self, table, key):
+        '''
+        Returns the record in table with the given key, or None
+        '''
+        return self._index()[table].get(key)
+
+    def scan(self, table):
+        '''
+        Returns every record in table, in the order they were inserted
+        '''
+        return list(self._index()[table].values())
+
+    def find(self, table, field, value):
+        '''
+        Returns the first record in table whose field equals value, or None
+        '''
+        if field in UNIQUE_FIELDS.get(table, ()):
+            self._index()
+            return self._unique[(table, field)].get(value)
+        for record in self._index()[table].values():
+            if record.get(field) == value:
+                return record
+        return None
+
+    def find_all(self, table, field, value):
+        '''
+        Returns every record in table whose field equals value
+        '''
+        return [record for record in self._index()[table].values() if record.get(field) == value]
+
+    def contains(self, table, key, field, u_id):
+        '''
+        Checks if u_id is in a member field of the record with the given key
+        '''
+        self._index()
+        return u_id in self._members[(table, field)].get(key, ())
+
+    def first(self, table):
+        '''
+        Returns the first record inserted into table, or None if it is empty
+        '''
+        return next(iter(self._index()[table].values()), None)
+
+    def count(self, table):
+        return len(self._index()[table])
+
+    def max_key(self, table):
+        '''
+        Returns the largest key in table, or None if it is empty
+        '''
+        self._index()
+        return self._max[table]
+
+    def history(self, field, key, limit, before=None, after=None, offset=0):
+        '''
+        Returns a page of the live messages of a channel or dm, newest first
+        '''
+        self._index()
+        entries = self._history.get((field, key), [])
+        # Positions are unique Integers, so (p,) sorts before every entry at p
+        lo = 0 if after is None else bisect_left(entries, (self._position(after) + 1,))
+        hi = len(entries) if before is None else bisect_left(entries, (self._position(before),))
+        if after is not None:
+            page = entries[lo:min(lo + limit, hi)]
+        else:
+            end = max(lo, hi - offset)
+            page = entries[max(lo, end - limit):end]
+        return [d.data["messages"][message_id] for _, message_id in reversed(page)]
+
+    def history_count(self, field, key):
+        '''
+        Returns the number of live messages of a channel or dm
+        '''
+        self._index()
+        return len(self._history.get((field, key), ()))
+
+    ############################### MUTATIONS #################################
+
+    def commit(self, entry):
+        '''
+        Applies a change record to d.data and queues it for the log
+        '''
+        line = json.dumps(entry) + "\n"
+        with self._cond:
+            self.apply(entry)
+            self._queued.append(line)
+            self._start_flusher()
+            if len(self._queued) >= config.flush_threshold:
+                self._cond.notify()
+
+    def increment(self, table, key, field, amount, initial, fields=None, series=None):
+        '''
+        Adds amount to a field of a record, sets any other fields given and
+        appends to a series, inserting initial first if there is no such
+        record, and returns the new value. Committed as an insert and an
+        update, so the log records the values they were set to
+        '''
+        with self._cond:
+            if self.get(table, key) is None:
+                self.commit({"op": "insert", "table": table, "value": initial})
+            record = self.get(table, key)
+            value = record[field] + amount
+            changes = dict(fields or {}, **{field: value})
+            if series is not None:
+                series_field, size, time_stamp = series
+                changes[series_field] = (record.get(series_field, []) + [[value, time_stamp]])[-size:]
+            self.commit({"op": "update", "table": table, "key": key, "fields": changes})
+            return value
+
+    def clear(self):
+        '''
+        Empties every collection, written through to disk straight away as a
+        fresh snapshot with an empty log
+        '''
+        with self._write_lock:
+            with self._cond:
+                self.apply({"op": "clear"})
+                self._queued.clear()
+            self._write_snapshot({table: {} for table in TABLE_KEYS})
+
+    def apply(self, entry, data=None):
+        '''
+        Applies a change record to data, d.data by default
+
+        Arguments:
+        entry (Dictionary) - A record made by one of the mutations in store.py
+        data (Dictionary)  - The image to apply it to, with every collection
+                             keyed as by _keyed
+
+        Return Value: None
+        '''
+        if data is None:
+            data = self._index()
+        op = entry["op"]
+        if op == "clear":
+            for table in TABLE_KEYS:
+                data[table] = {}
+            if data is d.data:
+                self._max = {table: None for table in TABLE_KEYS}
+                self._members = _build_member_index(data)
+                self._unique = _build_unique_index(data)
+                self._history = {}
+            return
+
+        index = data[entry["table"]]
+        if op in ("delete", "delete_many"):
+            for key in entry["keys"] if op == "delete_many" else (entry["key"],):
+                self._delete(data, entry["table"], key)
+            return
+        if op == "insert":
+            record = entry["value"]
+            key = record[TABLE_KEYS[entry["table"]]]
+            existing = index.get(key)
+            # A replaced record keeps its place in the insertion order
+            index[key] = record
+            if data is d.data:
+                current = self._max[entry["table"]]
+                self._max[entry["table"]] = key if current is None else max(current, key)
+                self._index_members(entry["table"], record)
+                self._index_unique(entry["table"], existing, record)
+                if entry["table"] == "messages":
+                    self._index_history(_history_place(existing), _history_place(record))
+            return
+
+        record = index.get(entry["key"])
+        if record is None:
+            return
+        members = None
+        if data is d.data and entry.get("field") in MEMBER_FIELDS.get(entry["table"], ()):
+            members = self._members[(entry["table"], entry["field"])].setdefault(entry["key"], set())
+        if op == "update":
+            before = _history_place(record) if entry["table"] == "messages" else None
+            previous = dict(record) if entry["table"] in UNIQUE_FIELDS else None
+            record.update(entry["fields"])
+            if data is d.data:
+                self._index_members(entry["table"], record)
+                self._index_unique(entry["table"], previous, record)
+                if entry["table"] == "messages":
+                    self._index_history(before, _history_place(record))
+        elif op == "append":
+            if members is not None:
+                if entry["value"] not in members:
+                    members.add(entry["value"])
+                    record[entry["field"]].append(entry["value"])
+            elif entry["value"] not in record[entry["field"]]:
+                record[entry["field"]].append(entry["value"])
+        elif op == "remove":
+            if members is not None:
+                if entry["value"] in members:
+                    members.discard(entry["value"])
+                    record[entry["field"]].remove(entry["value"])
+            elif entry["value"] in record[entry["field"]]:
+                record[entry["field"]].remove(entry["value"])
+
+    ############################## PERSISTENCE ################################
+
+    def load(self):
+        '''
+        Loads the latest snapshot into d.data and replays the log tail on top of it
+
+        Return Value:
+            Returns the number of log records that were replayed
+        '''
+        with self._write_lock:
+            d.data, replayed, end = self._read()
+            # Cut off a torn final record, so the records appended from now
+            # on follow the last whole one rather than the broken line
+            if os.path.exists(config.log_path) and os.path.getsize(config.log_path) > end:
+                with open(config.log_path, "r+b") as f:
+                    f.truncate(end)
+                    f.flush()
+                    os.fsync(f.fileno())
+        with self._cond:
+            self._log_records = replayed
+        return replayed
+
+    def changes(self):
+        '''
+        No other process can change d.data, so there is never anything new
+        '''
+        return {}
+
+    def export(self):
+        '''
+        Returns the persisted image (snapshot plus log) without touching d.data
+        '''
+        return _as_lists(self._read()[0])
+
+    def flush(self):
+        '''
+        Appends every queued record to the log and fsyncs it, compacting the
+        log into a new snapshot if it has grown past config.snapshot_threshold
+
+        Return Value:
+            Returns the number of records that were written
+        '''
+        with self._write_lock:
+            with self._cond:
+                lines = list(self._queued)
+                self._queued.clear()
+                self._log_records += len(lines)
+                compact = self._log_records >= config.snapshot_threshold
+            if lines:
+                with open(config.log_path, "a") as f:
+                    f.write("".join(lines))
+                    f.flush()
+                    os.fsync(f.fileno())
+            if compact:
+                self._write_snapshot()
+            return len(lines)
+
+    def snapshot(self):
+        '''
+        Forces the log to be compacted into a new snapshot of the data file
+        '''
+        self.flush()
+        with self._write_lock:
+            self._write_snapshot()
+
+    def queued_records(self):
+        '''
+        Returns the number of records waiting to be written to the log
+        '''
+        with self._cond:
+            return len(self._queued)
+
+    def log_records(self):
+        '''
+        Returns the number of records in the log since the last snapshot
+        '''
+        with self._cond:
+            return self._log_records + len(self._queued)
+
+    def shutdown(self):
+        '''
+        Stops the background flusher and writes out anything still queued
+        '''
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+
+    ############################ HELPER FUNCTIONS #############################
+
+    def _read(self):
+        '''
+        Reads the snapshot and replays the log on top of it
+
+        Return Value:
+            Returns (image with every collection keyed, number of log records
+            replayed, byte offset of the end of the last whole record)
+        '''
+        with open(config.data_path) as f:
+            snapshot = upgrade(json.load(f))
+        # Collections the store no longer has are dropped
+        data = {table: _keyed(table, snapshot.get(table, [])) for table in TABLE_KEYS}
+        replayed = 0
+        end = 0
+        if os.path.exists(config.log_path):
+            with open(config.log_path, "rb") as f:
+                for line in f:
+                    # A torn final record from a crash mid-append, which
+                    # may be missing no more than its newline
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break
+                    self.apply(entry, data)
+                    replayed += 1
+                    end += len(line)
+        return data, replayed, end
+
+    def _index(self):
+        '''
+        Returns d.data, first keying its collections and rebuilding the other
+        indexes if d.data has been replaced since they were built
+        '''
+        if self._indexed is not d.data:
+            for table in TABLE_KEYS:
+                d.data[table] = _keyed(table, d.data.get(table, []))
+            self._max = {table: max(d.data[table], default=None) for table in TABLE_KEYS}
+            self._members = _build_member_index(d.data)
+            self._unique = _build_unique_index(d.data)
+            self._history = _build_history_index(d.data)
+            self._indexed = d.data
+        return d.data
+
+    def _delete(self, data, table, key):
+        '''
+        Deletes a record from an image, if it exists, along with everything
+        the indexes of d.data hold for it
+        '''
+        index = data[table]
+        record = index.pop(key, None)
+        if record is None or data is not d.data:
+            return
+        if self._max[table] == key:
+            self._max[table] = max(index, default=None)
+        for field in MEMBER_FIELDS.get(table, ()):
+            self._members[(table, field)].pop(key, None)
+        self._index_unique(table, record, None)
+        if table == "messages":
+            self._index_history(_history_place(record), _history_place(None))
+
+    def _index_members(self, table, record):
+        '''
+        Rebuilds the member sets of one record of d.data
+        '''
+        key = record[TABLE_KEYS[table]]
+        for field in MEMBER_FIELDS.get(table, ()):
+            self._members[(table, field)][key] = set(record.get(field, ()))
+
+    def _index_unique(self, table, before, after):
+        '''
+        Moves a record of d.data between the values of its unique fields
+        before a change and after it. Either may be None, for an insert or a
+        delete
+        '''
+        key_field = TABLE_KEYS[table]
+        for field in UNIQUE_FIELDS.get(table, ()):
+            index = self._unique[(table, field)]
+            if before is not None and field in before:
+                current = index.get(before[field])
+                if current is not None and current[key_field] == before[key_field]:
+                    del index[before[field]]
+            if after is not None and field in after:
+                index[after[field]] = after
+
+    def _index_history(self, before, after):
+        '''
+        Moves a message of d.data between the history lists it was in (before)
+        and the ones it is in now (after), see _history_place
+        '''
+        if before == after:
+            return
+        entry, history_keys = before
+        for history_key in history_keys:
+            entries = self._history.get(history_key, [])
+            i = bisect_left(entries, entry)
+            if i < len(entries) and entries[i] == entry:
+                del entries[i]
+        entry, history_keys = after
+        for history_key in history_keys:
+            entries = self._history.setdefault(history_key, [])
+            if not entries or entries[-1] < entry:
+                # New messages have the largest position so far, so this is the usual case
+                entries.append(entry)
+                continue
+            i = bisect_left(entries, entry)
+            if i == len(entries) or entries[i] != entry:
+                entries.insert(i, entry)
+
+    def _position(self, message_id):
+        '''
+        Returns the position of a message of d.data, or message_id itself if
+        there is no such message
+        '''
+        message = d.data["messages"].get(message_id)
+        return message_id if message is None else position(message)
+
+    def _write_snapshot(self, image=None):
+        '''
+        Writes a full image to the data file and truncates the log. Must be
+        called with _write_lock held
+
+        Arguments:
+        image (Dictionary) - The image to write, by default the old snapshot
+                             with the log replayed on top of it. Holding
+                             _write_lock keeps the log from growing meanwhile,
+                             and records committed since the last flush stay
+                             queued for the fresh log, so d.data and _cond are
+                             left alone and writers carry on
+
+        Return Value: None
+        '''
+        if image is None:
+            image = self._read()[0]
+        write_file(config.data_path, json.dumps(_as_lists(image)))
+        with open(config.log_path, "w") as f:
+            f.flush()
+            os.fsync(f.fileno())
+        with self._cond:
+            self._log_records = 0
+
+    def _start_flusher(self):
+        '''
+        Starts the background flusher thread the first time a record is queued.
+        Must be called with _cond held
+        '''
+        if self._running:
+            return
+        self._running = True
+        self._flusher = threading.Thread(target=self._flush_loop, name="store-flusher", daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        '''
+        Body of the flusher thread, appends queued records to the log every
+        flush_interval seconds, or sooner once flush_threshold records are queued
+        '''
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: not self._running or len(self._queued) >= config.flush_threshold,
+                    timeout=config.flush_interval
+                )
+                if not self._running:
+                    return
+            self.flush()
+
+def _keyed(table, records):
+    '''
+    Keys a collection of an image of the data store by its primary key
+
+    Arguments:
+    table (String)         - The collection, eg "messages"
+    records (List or Dict) - Its records as a list, in the data.json format,
+                             or already keyed
+
+    Return Value:
+        Returns {key: record} in the order of records
+    '''
+    if isinstance(records, dict):
+        return records
+    key_field = TABLE_KEYS[table]
+    return {record[key_field]: record for record in records}
+
+def _as_lists(data):
+    '''
+    Returns an image with keyed collections in the data.json format, one list
+    of records per collection
+    '''
+    return {table: list(records.values()) for table, records in data.items()}
+
+def _build_member_index(data):
+    '''
+    Builds the member sets of an image of the data store
+
+    Return Value:
+        Returns {(table, field): {key: set of u_ids}} for every field in MEMBER_FIELDS
+    '''
+    return {
+        (table, field): {
+            record[TABLE_KEYS[table]]: set(record.get(field, ())) for record in data[table].values()
+        }
+        for table, fields in MEMBER_FIELDS.items()
+        for field in fields
+    }
+
+def _build_unique_index(data):
+    '''
+    Builds the unique field indexes of an image of the data store
+
+    Return Value:
+        Returns {(table, field): {value: record}} for every field in UNIQUE_FIELDS
+    '''
+    return {
+        (table, field): {record[field]: record for record in data[table].values() if field in record}
+        for table, fields in UNIQUE_FIELDS.items()
+        for field in fields
+    }
+
+def _build_history_index(data):
+    '''
+    Builds the history lists of an image of the data store
+
+    Return Value:
+        Returns {(field, key): [(position, message_id) in ascending order]}
+        for every channel and dm with live messages
+    '''
+    history = {}
+    for record in data["messages"].values():
+        entry, history_keys = _history_place(record)
+        for history_key in history_keys:
+            history.setdefault(history_key, []).append(entry)
+    for entries in history.values():
+        entries.sort()
+    return history
+
+def _history_place(message):
+    '''
+    Returns the (position, message_id) entry of a message in the history
+    lists and the (field, key) of every list it belongs in, or (None, ())
+    for no message
+    '''
+    if message is None:
+        return None, ()
+    return (position(message), message["message_id"]), _history_keys(message)
+
+def _history_keys(message):
+    '''
+    Returns the (field, key) of every history list a message belongs in, none
+    once it has been removed
+    '''
+    if message.get("removed"):
+        return ()
+    return tuple((field, message[field]) for field in HISTORY_FIELDS if field in message)
@@ -0,0 +1,408 @@
+'''
+mail.py
+
+Outbound mail, sent in the background so no request waits on a mail server.
+
+send() only adds the message to the "outbox" collection of the store, so
+it survives a restart, and wakes the sender thread. The sender takes up to
+config.mail_batch_size messages that are due and sends them over one
+connection of the transport, which is kept open while there is more to
+send and closed once the outbox is empty. A message that fails is retried
+after config.mail_retry_backoff seconds, doubling with each attempt, and
+is dropped after config.mail_max_attempts attempts.
+
+The transport is picked by config.mail_transport:
+
+    "smtp"   - SMTPTransport, the SMTP server in config.mail_host
+    "memory" - MemoryTransport, which keeps what it is sent in a list, for
+               tests and for running without a mail server
+
+set_transport() replaces it with any object with the same open, send and
+close methods.
+
+When the store is shared by several server processes, each of them has a
+sender working through the same outbox. Before sending a message a sender
+claims it, by putting its next attempt config.mail_timeout seconds off
+while holding the whole store, so no other sender takes it up unless this
+one dies part way through.
+
+If the transport can't be created, or the store can't be read, the error is
+logged and the rest of the batch is put off config.mail_retry_backoff
+seconds, without counting as an attempt, so the sender keeps running.
+'''
+import heapq
+import logging
+import smtplib
+import threading
+import time
+from src import config
+import src.store as store
+
+_log = logging.getLogger(__name__)
+_cond = threading.Condition()
+_built = False
+_running = False
+_sender = None
+_transport = None
+# (next_attempt, mail_id) of every message in the outbox
+_due = []
+_sending = 0
+_counts = {"sent": 0, "retried": 0, "dropped": 0}
+
+class SMTPTransport:
+    '''
+    Sends mail through an SMTP server with STARTTLS, reusing one logged in
+    connection for as many messages as it is given before close()
+    '''
+    def __init__(self, host, port, username, password):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self._smtp = None
+
+    def open(self):
+        if self._smtp is not None:
+            return
+        smtp = smtplib.SMTP(self.host, self.port, timeout=config.mail_timeout)
+        try:
+            smtp.ehlo() #become identified as a connection
+            smtp.starttls() #info becomes encrypted
+            smtp.ehlo() #connection now encrypted
+            smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+
+    def send(self, message):
+        self.open()
+        try:
+            self._smtp.sendmail(self.username, message["to"], f"{message['subject']}\n\n{message['body']}")
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # Drop the broken connection so the next message opens a new one
+            self.close()
+            raise
+
+    def close(self):
+        if self._smtp is None:
+            return
+        smtp, self._smtp = self._smtp, None
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+class MemoryTransport:
+    '''
+    Keeps every message it is sent in sent, instead of sending it. Raises
+    ConnectionError for the next `failures` messages, to test retries
+    '''
+    def __init__(self):
+        self.sent = []
+        self.failures = 0
+        self.connections = 0
+        self._open = False
+
+    def open(self):
+        if not self._open:
+            self._open = True
+            self.connections += 1
+
+    def send(self, message):
+        self.open()
+        if self.failures > 0:
+            self.failures -= 1
+            self._open = False
+            raise ConnectionError("Mail server unavailable")
+        self.sent.append({field: message[field] for field in ("to", "subject", "body")})
+
+    def close(self):
+        self._open = False
+
+def send(to, subject, body):
+    '''
+    Queues a message to be sent by the background sender
+
+    Arguments:
+    to (String)      - The address to send to
+    subject (String) - The subject line
+    body (String)    - The text of the message
+
+    Return Value:
+        Returns the mail_id of the queued message
+    '''
+    with _cond:
+        _build()
+        last = store.max_key("outbox")
+        mail_id = 0 if last is None else last + 1
+        now = time.time()
+        store.insert("outbox", {
+            "mail_id": mail_id,
+            "to": to,
+            "subject": subject,
+            "body": body,
+            "attempts": 0,
+            "next_attempt": now,
+        })
+        heapq.heappush(_due, (now, mail_id))
+        _start_sender()
+        _cond.notify_all()
+        return mail_id
+
+def transport():
+    '''
+    Returns the transport mail is sent with, creating the one named in
+    config.mail_transport the first time it is needed
+    '''
+    global _transport
+    with _cond:
+        if _transport is None:
+            _transport = make_transport(config.mail_transport)
+        return _transport
+
+def make_transport(name):
+    '''
+    Creates a transport
+
+    Arguments:
+    name (String) - "smtp" or "memory"
+
+    Exceptions:
+        ValueError - When name is not a known transport
+
+    Return Value:
+        Returns the new transport
+    '''
+    if name == "smtp":
+        return SMTPTransport(config.mail_host, config.mail_port, config.mail_username, config.mail_password)
+    if name == "memory":
+        return MemoryTransport()
+    raise ValueError(f"Unknown mail transport {name}")
+
+def set_transport(new_transport):
+    '''
+    Replaces the transport, closing the old one
+
+    Return Value:
+        Returns the new transport
+    '''
+    global _transport
+    with _cond:
+        old, _transport = _transport, new_transport
+    if old is not None:
+        old.close()
+    return new_transport
+
+def pending():
+    '''
+    Returns the number of messages in the outbox
+    '''
+    with _cond:
+        _build()
+        return len(_due) + _sending
+
+def wait_until_sent(timeout=None):
+    '''
+    Waits until every message that is due has been sent or put off for a
+    retry
+
+    Return Value:
+        Returns True if nothing is due, False if timeout ran out first
+    '''
+    with _cond:
+        _build()
+        return _cond.wait_for(lambda: not _sending and not _ready(time.time()), timeout=timeout)
+
+def counts():
+    '''
+    Returns how many messages have been sent, retried and dropped
+    '''
+    with _cond:
+        return dict(_counts)
+
+def sync_mail(mail_id):
+    '''
+    Queues a message another server process has added to the outbox, or put
+    off for a retry. Messages it has sent or dropped are skipped once they
+    come up, as they are gone from the outbox
+
+    Arguments:
+    mail_id (Integer) - The message
+
+    Return Value: None
+    '''
+    with _cond:
+        if not _built:
+            return
+        message = store.get("outbox", mail_id)
+        if message is not None:
+            heapq.heappush(_due, (message["next_attempt"], mail_id))
+            _start_sender()
+            _cond.notify_all()
+
+def reset():
+    '''
+    Reads the outbox from the store again. Called whenever the data store is
+    cleared or reloaded, so that messages still waiting from before a
+    restart are sent
+    '''
+    global _built
+    with _cond:
+        _built = False
+        _counts.update({"sent": 0, "retried": 0, "dropped": 0})
+        _build()
+        _cond.notify_all()
+
+def shutdown():
+    '''
+    Stops the sender thread and closes the transport. Messages still in the
+    outbox are sent once the sender starts again
+    '''
+    global _running
+    with _cond:
+        _running = False
+        _cond.notify_all()
+        sender = _sender
+    if sender is not None:
+        sender.join()
+    if _transport is not None:
+        _transport.close()
+
+############################## HELPER FUNCTIONS ###############################
+
+def _build():
+    '''
+    Reads the outbox from the store the first time it is needed, starting
+    the sender if anything is waiting in it. Must be called with _cond held
+    '''
+    global _built
+    if _built:
+        return
+    _built = True
+    _due.clear()
+    for message in store.scan("outbox"):
+        _due.append((message["next_attempt"], message["mail_id"]))
+    heapq.heapify(_due)
+    if _due:
+        _start_sender()
+
+def _ready(now):
+    '''
+    Checks if the earliest message in the outbox is due. Must be called with
+    _cond held
+    '''
+    return bool(_due) and _due[0][0] <= now
+
+def _start_sender():
+    '''
+    Starts the sender thread if it isn't running. Must be called with _cond held
+    '''
+    global _running, _sender
+    if _running:
+        return
+    _running = True
+    _sender = threading.Thread(target=_send_loop, name="mail-sender", daemon=True)
+    _sender.start()
+
+def _send_loop():
+    '''
+    Body of the sender thread, sends each batch of due messages and then
+    sleeps until the next one is due or a new message is queued
+    '''
+    global _running
+    try:
+        _send_batches()
+    finally:
+        with _cond:
+            # So the next send starts a new sender if this one died
+            if _sender is threading.current_thread():
+                _running = False
+            _cond.notify_all()
+
+def _send_batches():
+    '''
+    Sends batches of due messages until the sender is stopped
+    '''
+    global _sending
+    while True:
+        with _cond:
+            while _running and not _ready(time.time()):
+                _cond.wait(timeout=_due[0][0] - time.time() if _due else None)
+            if not _running:
+                return
+            now = time.time()
+            batch = []
+            while _ready(now) and len(batch) < config.mail_batch_size:
+                batch.append(heapq.heappop(_due)[1])
+            _sending = len(batch)
+
+        sender = None
+        done = 0
+        try:
+            sender = transport()
+            for mail_id in batch:
+                _deliver(sender, mail_id)
+                done += 1
+        except Exception:
+            _log.exception("Mail sender failed, putting off %d messages", len(batch) - done)
+            _put_off(batch[done:])
+        finally:
+            with _cond:
+                _sending = 0
+                idle = not _due
+                _cond.notify_all()
+        if idle and sender is not None:
+            sender.close()
+
+def _put_off(mail_ids):
+    '''
+    Queues messages again config.mail_retry_backoff seconds from now, without
+    counting an attempt, after the sender failed before sending them
+    '''
+    next_attempt = time.time() + config.mail_retry_backoff
+    with _cond:
+        for mail_id in mail_ids:
+            _counts["retried"] += 1
+            heapq.heappush(_due, (next_attempt, mail_id))
+
+def _deliver(sender, mail_id):
+    '''
+    Sends one message from the outbox, deleting it once sent or putting it
+    off for a retry if sending fails
+    '''
+    message = _claim(mail_id) if store.shared() else store.get("outbox", mail_id)
+    if message is None:
+        return
+    try:
+        sender.send(message)
+    except Exception:
+        attempts = message["attempts"] + 1
+        with _cond:
+            if attempts >= config.mail_max_attempts:
+                _counts["dropped"] += 1
+                store.delete("outbox", mail_id)
+                return
+            _counts["retried"] += 1
+            next_attempt = time.time() + config.mail_retry_backoff * 2 ** (attempts - 1)
+            store.update("outbox", mail_id, {"attempts": attempts, "next_attempt": next_attempt})
+            heapq.heappush(_due, (next_attempt, mail_id))
+        return
+    with _cond:
+        _counts["sent"] += 1
+        store.delete("outbox", mail_id)
+
+def _claim(mail_id):
+    '''
+    Claims a message in the outbox for this process's sender
+
+    Return Value:
+        Returns the message, or None if it has been sent, or claimed by the
+        sender of another server process, since this one read the outbox
+    '''
+    with store.writing():
+        message = store.get("outbox", mail_id)
+        if message is None or message["next_attempt"] > time.time():
+            return None
+        store.update("outbox", mail_id, {"next_attempt": time.time() + config.mail_timeout})
+        return message
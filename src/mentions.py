@@ -0,0 +1,165 @@
+'''
+mentions.py
+
+Finds the users tagged in a message with @handle_str.
+
+Every handle is kept in a trie, one node per character. To find the tags
+in a message, the trie is walked from the character after each "@" for as
+long as the message follows one of its branches, and the longest handle
+ended on that walk is the one tagged, provided the character after it
+cannot continue a handle (it is not a letter or digit, or the message
+ends). No walk is longer than the longest handle, so finding the tags in a
+message costs O(message length) however many users there are.
+
+The trie is built from the store the first time it is needed, then patched
+by auth_register_v2 and user_profile_sethandle_v1 through add_handle and
+remove_handle, and by sync_user for the users other server processes
+change. It is dropped by reset whenever the data store is cleared or
+reloaded.
+'''
+import threading
+import src.store as store
+
+# Key of a trie node holding the u_id of the handle that ends there. Handles
+# are strings, so it can never clash with a character
+_END = None
+
+_lock = threading.RLock()
+_built = False
+_root = {}
+# u_id -> the handle of theirs in the trie
+_handles = {}
+
+def extract(text):
+    '''
+    Finds the users tagged in text
+
+    Arguments:
+    text (String) - The message text
+
+    Return Value:
+        Returns a list of u_ids, in the order they are first tagged
+    '''
+    u_ids = {}
+    with _lock:
+        _build()
+        at = text.find("@")
+        while at != -1:
+            u_id = _longest_handle(text, at + 1)
+            if u_id is not None:
+                u_ids[u_id] = True
+            at = text.find("@", at + 1)
+    return list(u_ids)
+
+def add_handle(handle, u_id):
+    '''
+    Adds a user's handle to the trie
+
+    Arguments:
+    handle (String) - The handle_str
+    u_id (Integer)  - The user it belongs to
+
+    Return Value: None
+    '''
+    with _lock:
+        if _built:
+            _add(handle, u_id)
+
+def remove_handle(handle):
+    '''
+    Takes a handle out of the trie, eg once its user has changed it
+
+    Arguments:
+    handle (String) - The handle_str
+
+    Return Value: None
+    '''
+    with _lock:
+        if not _built:
+            return
+        path = [_root]
+        for char in handle:
+            node = path[-1].get(char)
+            if node is None:
+                return
+            path.append(node)
+        u_id = path[-1].pop(_END, None)
+        if _handles.get(u_id) == handle:
+            del _handles[u_id]
+        # Prune the branch back to the last node still in use
+        for i in range(len(handle) - 1, -1, -1):
+            if path[i + 1]:
+                break
+            del path[i][handle[i]]
+
+def sync_user(u_id):
+    '''
+    Brings a user's handle in the trie up to date with the store, eg once
+    another server process has changed it
+
+    Arguments:
+    u_id (Integer) - The user
+
+    Return Value: None
+    '''
+    with _lock:
+        if not _built:
+            return
+        user = store.get("users", u_id)
+        handle = user["handle_str"] if user is not None else None
+        if _handles.get(u_id) == handle:
+            return
+        if u_id in _handles:
+            remove_handle(_handles[u_id])
+        if handle is not None:
+            _add(handle, u_id)
+
+def reset():
+    '''
+    Drops the trie, so that it is rebuilt from the store the next time it is
+    needed. Called whenever the data store is cleared or reloaded
+    '''
+    global _built
+    with _lock:
+        _root.clear()
+        _handles.clear()
+        _built = False
+
+############################## HELPER FUNCTIONS ###############################
+
+def _build():
+    '''
+    Builds the trie from every user in the store, if it is not built already.
+    Must be called with _lock held
+    '''
+    global _built
+    if _built:
+        return
+    for user in store.scan("users"):
+        _add(user["handle_str"], user["u_id"])
+    _built = True
+
+def _add(handle, u_id):
+    '''
+    Adds a handle to the trie, one node per character
+    '''
+    node = _root
+    for char in handle:
+        node = node.setdefault(char, {})
+    node[_END] = u_id
+    _handles[u_id] = handle
+
+def _longest_handle(text, start):
+    '''
+    Walks the trie along text from start, returning the u_id of the longest
+    handle that ends on a boundary, or None
+    '''
+    node = _root
+    found = None
+    for i in range(start, len(text)):
+        node = node.get(text[i])
+        if node is None:
+            return found
+        if _END in node and (i + 1 == len(text) or not text[i + 1].isalnum()):
+            found = node[_END]
+    return found
@@ -1,10 +1,16 @@
 from src.error import AccessError, InputError
-import src.data as d
-from src.helper import is_member, token_decode, get_channel, get_message, remove_message, get_dm, get_user, save_data, load_data, check_is_pinned, valid_message, channel_exists, dm_exists
+import src.store as store
+import src.stats as stats
+import src.search as search
+import src.notifications as notifications
+import src.mentions as mentions
+import src.scheduler as scheduler
+import src.ids as ids
+import src.events as events
+from src.helper import is_member, is_owner, is_dm_member, token_decode, get_message, remove_message, get_dm, check_is_pinned, valid_message, channel_exists, dm_active, message_conversation
 import time
-import threading
-import queue
 
+@store.per_conversation(lambda u_id, channel_id, *_: ("channel_id", channel_id))
 def message_send_v1(u_id, channel_id, message):
     '''
     This function takes an authorised user which is a part of the channel specified
@@ -26,39 +32,19 @@ def message_send_v1(u_id, channel_id, message):
             "message_id" : message_id
         } upon valid input
     '''
-    d.data = load_data()
     if len(message) > 1000:
         raise InputError("Message is more than 1000 characters")
 
     if not is_member(u_id, channel_id):
         raise AccessError("User is not apart of channel")
 
-    if len(d.data["messages"]) == 0:
-        message_id = 0
-    else:
-        message_id = d.data["messages"][-1]["message_id"] + 1
-
-    new_message= {
-        "message_id": message_id,
-        "u_id": u_id,
-        "message": message,
-        "time_created": time.time(),
-        "channel_id": channel_id,
-        "removed": False,
-        "reacts" : [],
-        "is_pinned": False
-
-    }
-    d.data["messages"].append(new_message)
-    
-    for channel in d.data["channels"]:
-        if channel_id == channel["channel_id"]:
-            channel["messages"].append(message_id)
-    save_data()
+    message_id = ids.next_id("messages")
+    post_message(u_id, "channel_id", channel_id, message, message_id, time.time())
     return {
         "message_id": message_id
     }
 
+@store.per_conversation(lambda u_id, message_id, *_: message_conversation(message_id))
 def message_remove_v1(u_id, message_id):
     '''
     This function takes an authorised user and a message id
@@ -78,30 +64,26 @@ def message_remove_v1(u_id, message_id):
         Returns {
         } upon valid input
     '''
-    d.data = load_data()
-    message = get_message(message_id)
-
-    if message == False or message["removed"] == True:
+    if not valid_message(message_id):
         raise InputError("Message no longer exists")
+    message = get_message(message_id)
     
     if "channel_id" in message:
 
-        channel = get_channel(message["channel_id"])
-
-        if u_id != message["u_id"] and u_id not in channel["owner_members"] and u_id != d.data["users"][0]:
+        if u_id != message["u_id"] and not is_owner(u_id, message["channel_id"]) and u_id != store.first("users"):
             raise AccessError("User is not authorised to delete message")
     elif "dm_id" in message:
 
         dm = get_dm(message["dm_id"])
 
-        if u_id != message["u_id"] and u_id not in dm["creator"] and u_id != d.data["users"][0]:
+        if u_id != message["u_id"] and u_id not in dm["creator"] and u_id != store.first("users"):
             raise AccessError("User is not authorised to delete message")    
     
     remove_message(message_id)
-    save_data()
     return {
     }
 
+@store.per_conversation(lambda u_id, message_id, *_: message_conversation(message_id))
 def message_edit_v1(u_id, message_id, message):
     '''
     This function takes an authorised user, a message_id and text to 
@@ -125,40 +107,45 @@ def message_edit_v1(u_id, message_id, message):
         Returns {
         } upon valid input
     '''
-    d.data = load_data()
     if len(message) > 1000:
         raise InputError("Message is too long")
     
-    actual_message = get_message(message_id)
-
-    if actual_message == False or actual_message["removed"] == True:
+    if not valid_message(message_id):
         raise InputError("Message no longer exists")
+    actual_message = get_message(message_id)
     
     if "channel_id" in actual_message:
 
-        channel = get_channel(actual_message["channel_id"])
-
-        if u_id != actual_message["u_id"] and get_user(u_id) not in channel["owner_members"] and u_id != d.data["users"][0]:
+        if u_id != actual_message["u_id"] and not is_owner(u_id, actual_message["channel_id"]) and u_id != store.first("users"):
             raise AccessError("User is not authorised to edit message")
 
     elif "dm_id" in actual_message:
 
         dm = get_dm(actual_message["dm_id"])
 
-        if u_id != actual_message["u_id"] and u_id not in dm["creator"] and u_id != d.data["users"][0]:
+        if u_id != actual_message["u_id"] and u_id not in dm["creator"] and u_id != store.first("users"):
             raise AccessError("User is not authorised to edit message")
 
     if len(message) == 0:
         remove_message(message_id)
 
     else:
-        for temp_message in d.data["messages"]:
-            if message_id == temp_message["message_id"]:
-                temp_message["message"] = message
-    save_data()
+        # Only users tagged by the edit are notified
+        already_tagged = mentions.extract(actual_message["message"])
+        store.update("messages", message_id, {"message": message})
+        edited_message = get_message(message_id)
+        search.index_message(edited_message)
+        events.publish(events.EDITED, edited_message)
+
+        newly_tagged = [tagged for tagged in mentions.extract(message) if tagged not in already_tagged]
+        if "channel_id" in edited_message:
+            notifications.tagged(edited_message, newly_tagged, lambda member: is_member(member, edited_message["channel_id"]))
+        else:
+            notifications.tagged(edited_message, newly_tagged, lambda member: is_dm_member(member, edited_message["dm_id"]))
     return {
     }
 
+@store.atomic
 def message_share_v1(u_id, og_message_id, message, channel_id, dm_id):
     '''
     This function takes an authorised user, the message_id of the message to send, 
@@ -182,14 +169,12 @@ def message_share_v1(u_id, og_message_id, message, channel_id, dm_id):
             "shared_message_id": shared_message_id
         } upon valid input
     '''
-    d.data = load_data()
     
     if dm_id == -1:
         if not is_member(u_id, channel_id):
             raise AccessError("User is not apart of channel")
     elif channel_id == -1:
-        dm_data = get_dm(dm_id)
-        if get_user(u_id) not in dm_data["members"]:
+        if not is_dm_member(u_id, dm_id):
             raise AccessError("User is not apart of DM")
 
     og_message = get_message(og_message_id)
@@ -210,12 +195,12 @@ def message_share_v1(u_id, og_message_id, message, channel_id, dm_id):
         shared_message_id = message_send_v1(u_id, channel_id, new_text)
     elif channel_id == -1:
         shared_message_id = message_senddm_v1(u_id, dm_id, new_text)
-    save_data()
     return {
         "shared_message_id": shared_message_id["message_id"]
     }
 
 
+@store.per_conversation(lambda u_id, dm_id, *_: ("dm_id", dm_id))
 def message_senddm_v1(u_id, dm_id, message):
     '''
     This function takes an authorised user, the id of the dm to send the message to,
@@ -229,6 +214,7 @@ def message_senddm_v1(u_id, dm_id, message):
     Exceptions:
         InputError  - Occurs when 
                         1. Length of the message is over 1000 characters
+                        2. The dm has been removed
         AccessError - Occurs when 
                         1. If the user is not apart of the Dm they are trying to send to
 
@@ -237,43 +223,22 @@ def message_senddm_v1(u_id, dm_id, message):
             "message_id": message_id
         } upon valid input
     '''
-    d.data = load_data()
     if len(message) > 1000:
         raise InputError("Message is more than 1000 characters")
 
-    dm = get_dm(dm_id)
+    if not dm_active(dm_id):
+        raise InputError("DM has been removed")
 
-    if get_user(u_id) not in dm["members"]:
+    if not is_dm_member(u_id, dm_id):
         raise AccessError("User is not apart of the dm")
     
-    #turn this into a helper function
-
-    if len(d.data["messages"]) == 0:
-        message_id = 0
-    else:
-        message_id = d.data["messages"][-1]["message_id"] + 1   
-
-    new_message= {
-        "message_id": message_id,
-        "u_id": u_id,
-        "message": message,
-        "time_created": time.time(),
-        "dm_id": dm_id,
-        "removed": False,
-        "reacts" : [],
-        "is_pinned": False
-    }
-
-    d.data["messages"].append(new_message)
-
-    for dm in d.data["dms"]:
-        if dm_id == dm["dm_id"]:
-            dm["messages"].append(message_id)
-    save_data()
+    message_id = ids.next_id("messages")
+    post_message(u_id, "dm_id", dm_id, message, message_id, time.time())
     return {
         "message_id": message_id
     }
 
+@store.per_conversation(lambda u_id, message_id, *_: message_conversation(message_id))
 def message_react_v1(u_id, message_id, react_id):
     '''
     This function takes an authorised user, the id of a message and a react_id
@@ -296,7 +261,6 @@ def message_react_v1(u_id, message_id, react_id):
         Returns {
         }
     '''
-    d.data = load_data()
 
     # Checking if the message is valid
     if valid_message(message_id) is False:
@@ -307,46 +271,30 @@ def message_react_v1(u_id, message_id, react_id):
     
     message = get_message(message_id)
     
-    temp_reacts = message['reacts']
+    reacts = message['reacts']
+    reacted = reacts.get(str(react_id), [])
 
-    for react in temp_reacts:
-        if react['react_id'] == react_id and u_id in react['u_ids']:
-            raise InputError("User has already reacted with react: react_id")
+    if u_id in reacted:
+        raise InputError("User has already reacted with react: react_id")
     
     if 'channel_id' in message:
         if is_member(u_id, message['channel_id']) is False:
             raise AccessError("User is not apart of the channel the message is in")
     elif 'dm_id' in message:
-        dm = get_dm(message['dm_id'])
-        if get_user(u_id) not in dm['members']:
+        if not is_dm_member(u_id, message['dm_id']):
             raise AccessError("User is not apart of the DM the message is in")
     
-    # If a dictionary react exists, append user_id to the list, and update the seen value
-    for react in temp_reacts:
-        if react['react_id'] == react_id:
-            react['u_ids'].append(u_id)
-            react['is_this_user_reacted'] = True
-            save_data()
-            return
-    
-    # If we have not found a react of react_id in the message, we create a new react
-    # dictionary
-
-    new_react = {
-        'react_id': react_id,
-        'u_ids': [u_id],
-        'is_this_user_reacted': True
-    }
-
-    message['reacts'].append(new_react)
-    
-    save_data()
+    # Add the user to the users who reacted with react_id, creating the react
+    # if this is its first user
+    store.update("messages", message_id, {'reacts': dict(reacts, **{str(react_id): reacted + [u_id]})})
+    events.publish(events.REACTS, get_message(message_id))
 
     return {
 
     }
 
 
+@store.per_conversation(lambda u_id, message_id, *_: message_conversation(message_id))
 def message_unreact_v1(u_id, message_id, react_id):
     '''
     This function takes an authorised user, the id of a message and a react_id
@@ -369,7 +317,6 @@ def message_unreact_v1(u_id, message_id, react_id):
         Returns {
         }
     '''
-    d.data = load_data()
 
     # Checking if the message is valid
     if valid_message(message_id) is False:
@@ -380,33 +327,27 @@ def message_unreact_v1(u_id, message_id, react_id):
     
     message = get_message(message_id)
     
-    temp_reacts = message['reacts']
+    reacts = message['reacts']
+    reacted = reacts.get(str(react_id), [])
     
     if 'channel_id' in message:
         if is_member(u_id, message['channel_id']) is False:
             raise AccessError("User is not apart of the channel the message is in")
     elif 'dm_id' in message:
-        dm = get_dm(message['dm_id'])
-        if get_user(u_id) not in dm['members']:
+        if not is_dm_member(u_id, message['dm_id']):
             raise AccessError("User is not apart of the DM the message is in")
 
-    if len(temp_reacts) == 0:
+    if u_id not in reacted:
         raise InputError("User has not reacted to message with react: react_id")
 
-    for react in temp_reacts:
-        if react['react_id'] == react_id and u_id not in react['u_ids']:
-            raise InputError("User has not reacted to message with react: react_id")
-
-    for react in temp_reacts:
-        if react['react_id'] == react_id:
-            react['u_ids'].remove(u_id)
-            react['is_this_user_reacted'] = False
-
-    save_data()
+    reacted = [uid for uid in reacted if uid != u_id]
+    store.update("messages", message_id, {'reacts': dict(reacts, **{str(react_id): reacted})})
+    events.publish(events.REACTS, get_message(message_id))
 
     return
 
 
+@store.per_conversation(lambda u_id, message_id, *_: message_conversation(message_id))
 def message_pin_v1(u_id, message_id):
     '''
     This function takes an authorised user, and a message_id and marks it as pinned
@@ -427,7 +368,6 @@ def message_pin_v1(u_id, message_id):
         Returns {
         }
     '''
-    d.data = load_data()
 
     # Checking if the message is valid
     if valid_message(message_id) is False:
@@ -439,35 +379,30 @@ def message_pin_v1(u_id, message_id):
     # Checking if the user is not apart of the dm
     message = get_message(message_id)
     # If the user is the global owner, then skip access error checking
-    if u_id == d.data['users'][0]: 
+    if u_id == store.first('users'): 
         pass
     elif 'channel_id' in message:
-        channel = get_channel(message['channel_id'])
-
-        if get_user(u_id) not in channel["owner_members"]:
+        if not is_owner(u_id, message['channel_id']):
             raise AccessError("User is not owner of the channel")
         
         elif is_member(u_id, message['channel_id']) is False:
             raise AccessError("User is not apart of the channel the message is in")
     elif 'dm_id' in message:
         dm = get_dm(message['dm_id'])
-        if get_user(u_id) not in dm['members']:
+        if not is_dm_member(u_id, message['dm_id']):
             raise AccessError("User is not apart of the DM the message is in")
 
         if u_id != dm['creator']:
             raise AccessError("User is not the creator of the dm")
     
-    for message in d.data["messages"]:
-        if message_id == message['message_id']:
-            message["is_pinned"] = True
-            break
-
-    save_data()
+    store.update("messages", message_id, {"is_pinned": True})
+    events.publish(events.PIN, get_message(message_id))
 
     return {
 
     }
 
+@store.per_conversation(lambda u_id, message_id, *_: message_conversation(message_id))
 def message_unpin_v1(u_id, message_id):
     '''
     This function takes an authorised user, and a message_id and unpins it
@@ -488,7 +423,6 @@ def message_unpin_v1(u_id, message_id):
         Returns {
         }
     '''
-    d.data = load_data()
 
     # Checking if the message is valid
     if valid_message(message_id) is False:
@@ -501,12 +435,10 @@ def message_unpin_v1(u_id, message_id):
     # Checking if the user is not apart of the dm
     message = get_message(message_id)
     # If the user is the global owner, then skip access error checking
-    if u_id == d.data['users'][0]: 
+    if u_id == store.first('users'): 
         pass
     elif 'channel_id' in message:
-        channel = get_channel(message['channel_id'])
-
-        if get_user(u_id) not in channel["owner_members"]:
+        if not is_owner(u_id, message['channel_id']):
             raise AccessError("User is not owner of the channel")
             
 
@@ -514,27 +446,25 @@ def message_unpin_v1(u_id, message_id):
             raise AccessError("User is not apart of the channel the message is in")
     elif 'dm_id' in message:
         dm = get_dm(message['dm_id'])
-        if get_user(u_id) not in dm['members']:
+        if not is_dm_member(u_id, message['dm_id']):
             raise AccessError("User is not apart of the DM the message is in")
         if u_id != dm['creator']:
             raise AccessError("User is not the creator of the dm")
     
-    for message in d.data["messages"]:
-        if message_id == message['message_id']:
-            message["is_pinned"] = False
-            break
-            
-    save_data()
+    store.update("messages", message_id, {"is_pinned": False})
+    events.publish(events.PIN, get_message(message_id))
 
     return {
 
     }
 
+@store.per_conversation(lambda u_id, channel_id, *_: ("channel_id", channel_id))
 def message_sendlater_v1(u_id, channel_id, message, time_sent):
     '''
     This function takes an authorised user, a channel_id, a message and a time 
-    to send the message. The function then creates a thread that waits till that 
-    time to execute sending the message
+    to send the message. The message is given its message_id straight away
+    and handed to the scheduler, which sends it once that time comes. It is
+    placed in the history as of when it is sent, see store.position
 
     Arguments:
     u_id (Integer)    - User who is sending
@@ -555,7 +485,6 @@ def message_sendlater_v1(u_id, channel_id, message, time_sent):
             'message_id': message_id
         }
     '''
-    d.data = load_data()
 
     if channel_exists(channel_id) is False:
         raise InputError("Channel ID is not a valid channel")
@@ -570,25 +499,26 @@ def message_sendlater_v1(u_id, channel_id, message, time_sent):
 
     if is_member(u_id, channel_id) is False:
         raise AccessError("User is not apart of channel")
-    
-    wait = time_sent - current_time
-
-    my_queue = queue.Queue()
-
-    t = threading.Timer(wait, message_send_thread, [u_id, channel_id, message, my_queue])
-    t.start()
-
-    return_value = my_queue.get()
 
-    save_data()
-
-    return return_value
+    message_id = ids.next_id("messages")
+    scheduler.schedule({
+        "message_id": message_id,
+        "u_id": u_id,
+        "channel_id": channel_id,
+        "message": message,
+        "time_sent": time_sent,
+    })
+    return {
+        'message_id': message_id
+    }
 
+@store.per_conversation(lambda u_id, dm_id, *_: ("dm_id", dm_id))
 def message_sendlaterdm_v1(u_id, dm_id, message, time_sent):
     '''
-    This function takes an authorised user, a channel_id, a message and a time 
-    to send the message. The function then creates a thread that waits till that 
-    time to execute sending the message
+    This function takes an authorised user, a dm_id, a message and a time 
+    to send the message. The message is given its message_id straight away
+    and handed to the scheduler, which sends it once that time comes. It is
+    placed in the history as of when it is sent, see store.position
 
     Arguments:
     u_id (Integer)    - User who is sending
@@ -609,9 +539,8 @@ def message_sendlaterdm_v1(u_id, dm_id, message, time_sent):
             'message_id': message_id
         }
     '''
-    d.data = load_data()
 
-    if dm_exists(dm_id) is False:
+    if dm_active(dm_id) is False:
         raise InputError("DM is not a valid dm")
 
     if len(message) > 1000:
@@ -622,54 +551,139 @@ def message_sendlaterdm_v1(u_id, dm_id, message, time_sent):
     if (time_sent - current_time) < 0:
         raise InputError("Time is a time in the past")
 
-    dm = get_dm(dm_id)
-    if get_user(u_id) not in dm['members']:
+    if not is_dm_member(u_id, dm_id):
         raise AccessError("User is not apart of the DM the message is in")
 
-    wait = time_sent - current_time
+    message_id = ids.next_id("messages")
+    scheduler.schedule({
+        "message_id": message_id,
+        "u_id": u_id,
+        "dm_id": dm_id,
+        "message": message,
+        "time_sent": time_sent,
+    })
+    return {
+        'message_id': message_id
+    }
 
-    my_queue = queue.Queue()
+def message_sendlater_list_v1(u_id):
+    '''
+    Lists the messages a user has scheduled with message_sendlater_v1 or
+    message_sendlaterdm_v1 that have not been sent yet
 
-    t = threading.Timer(wait, message_senddm_thread, [u_id, dm_id, message, my_queue])
-    t.start()
+    Arguments:
+    u_id (Integer)    - User who scheduled them
 
-    return_value = my_queue.get()
+    Return Value:
+        Returns {
+            'messages': [{'message_id', 'channel_id' or 'dm_id', 'message', 'time_sent'}], soonest first
+        }
+    '''
+    messages = []
+    for job in scheduler.pending(u_id):
+        field = "channel_id" if "channel_id" in job else "dm_id"
+        messages.append({
+            'message_id': job['message_id'],
+            field: job[field],
+            'message': job['message'],
+            'time_sent': job['time_sent'],
+        })
+    return {
+        'messages': messages
+    }
 
-    save_data()
+@store.atomic
+def message_sendlater_cancel_v1(u_id, message_id):
+    '''
+    Cancels a message the user scheduled, before it is sent
 
-    return return_value
+    Arguments:
+    u_id (Integer)    - User who scheduled it
+    message_id (Integer) - The message_id it was given when it was scheduled
 
+    Exceptions:
+        InputError  - Occurs when 
+                        1. The user has no message with that id waiting to be sent
+
+    Return Value:
+        Returns {}
+    '''
+    if not scheduler.cancel(u_id, message_id):
+        raise InputError("No scheduled message with that id")
+    return {}
 
-def message_send_thread(u_id, channel_id, message, out_queue):
+@store.per_conversation(lambda job: ("channel_id", job["channel_id"]) if "channel_id" in job else ("dm_id", job["dm_id"]))
+def deliver_scheduled(job):
     '''
-    This function is a wrapper function for message_send_v1, however, 
-    it saves the return value of the function in the supplied queue, so 
-    we can access it in a seperate thread
+    Sends a message scheduled with message_sendlater_v1 or
+    message_sendlaterdm_v1, with the message_id it was given then but
+    placed after every message already sent. Called by the scheduler once
+    it is due
 
     Arguments:
-    u_id (Integer)    - User who is sending
-    channel_id (Integer) - The channel to send the message to
-    message (String)   - The message to be sent
-    out_queue (Queue)  - The queue where we will store the return of message_send
+    job (Dictionary) - The job, see scheduler.schedule
 
-    return None
-    '''
-    return_value = message_send_v1(u_id, channel_id, message)
-    out_queue.put(return_value)
+    Exceptions:
+        InputError  - Occurs when 
+                        1. The dm has been removed since
+        AccessError - Occurs when 
+                        1. The user is no longer a member of the channel or dm
 
-def message_senddm_thread(u_id, dm_id, message, out_queue):
+    Return Value: None
+    '''
+    scheduled = store.get("scheduled", job["message_id"])
+    if scheduled is None or scheduled["time_sent"] != job["time_sent"]:
+        # Cancelled, or delivered by another server process
+        return
+    store.delete("scheduled", job["message_id"])
+
+    field = "channel_id" if "channel_id" in job else "dm_id"
+    key = job[field]
+    if field == "dm_id" and not dm_active(key):
+        raise InputError("DM has been removed")
+    member = is_member(job["u_id"], key) if field == "channel_id" else is_dm_member(job["u_id"], key)
+    if not member:
+        raise AccessError("User is no longer apart of the channel or dm")
+    # Placed by an id reserved now, so it comes after every message sent
+    # since it was scheduled and pages asked for with after_message_id see it
+    post_message(job["u_id"], field, key, job["message"], job["message_id"], job["time_sent"], ids.next_id("messages"))
+
+def post_message(u_id, field, key, message, message_id, time_created, position=None):
     '''
-    This function is a wrapper function for message_senddm_v1, however, 
-    it saves the return value of the function in the supplied queue, so 
-    we can access it in a seperate thread
+    Adds a new message to a channel or dm, and updates the search index,
+    notifications, statistics and activity streams that follow it
 
     Arguments:
-    u_id (Integer)    - User who is sending
-    dm_id (Integer) - The dm to send the message to
-    message (String)   - The message to be sent
-    out_queue (Queue)  - The queue where we will store the return of message_senddm
-
-    return None
+    u_id (Integer)       - User who is sending
+    field (String)       - "channel_id" or "dm_id"
+    key (Integer)        - The id of the channel or dm
+    message (String)     - The text of the message
+    message_id (Integer) - The id to give it, from ids.next_id
+    time_created (Float) - The unix timestamp it was sent at
+    position (Integer)   - Where it is placed in the history, see
+                           store.position, by default its message_id
+
+    Return Value: None
     '''
-    return_value = message_senddm_v1(u_id, dm_id, message)
-    out_queue.put(return_value)
\ No newline at end of file
+    new_message= {
+        "message_id": message_id,
+        "position": message_id if position is None else position,
+        "u_id": u_id,
+        "message": message,
+        "time_created": time_created,
+        field: key,
+        "removed": False,
+        "reacts" : {},
+        "is_pinned": False
+    }
+    if field == "channel_id":
+        can_see = lambda member: is_member(member, key)
+    else:
+        can_see = lambda member: is_dm_member(member, key)
+
+    store.insert("messages", new_message)
+    search.index_message(new_message)
+    notifications.tagged(new_message, mentions.extract(message), can_see)
+    stats.update_user(u_id, "messages_sent", 1)
+    stats.update_dreams("messages_exist", 1)
+    events.publish(events.SENT, new_message)
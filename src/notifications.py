@@ -0,0 +1,120 @@
+'''
+notifications.py
+
+The notification inboxes behind notification_v1.
+
+Notifications are made as the events happen, when a user is added to a
+channel or dm by someone else and when a message tags them with
+@handle_str, as found by mentions.py. Each user has one record in the
+"notifications" collection, keyed by their u_id, holding a ring buffer of
+their CAPACITY newest notifications: once the buffer is full each new
+notification overwrites the oldest one, at the position given by "head".
+Adding a notification and reading a user's notifications both cost
+O(CAPACITY), however much has happened in Dreams.
+'''
+import src.store as store
+
+# The number of notifications kept for each user
+CAPACITY = 20
+
+# The longest part of a message quoted in a tag notification
+QUOTE_LENGTH = 20
+
+def added(u_id, auth_user_id, channel_id=-1, dm_id=-1):
+    '''
+    Notifies a user that they have been added to a channel or dm. Nothing is
+    sent when the user added themselves
+
+    Arguments:
+    u_id (Integer)         - The user who was added
+    auth_user_id (Integer) - The user who added them
+    channel_id (Integer)   - The channel they were added to, or -1
+    dm_id (Integer)        - The dm they were added to, or -1
+
+    Return Value: None
+    '''
+    if u_id == auth_user_id:
+        return
+    handle = store.get("users", auth_user_id)["handle_str"]
+    notify(u_id, channel_id, dm_id, f"{handle} added you to {_name(channel_id, dm_id)}")
+
+def tagged(message, u_ids, is_member):
+    '''
+    Notifies the members of the message's channel or dm among the users
+    tagged in it
+
+    Arguments:
+    message (Dictionary)  - The message, as stored in the messages collection
+    u_ids (List)          - The users tagged, found by mentions.extract
+    is_member (Function)  - is_member(u_id) checks if a user is a member of
+                            the message's channel or dm
+
+    Return Value: None
+    '''
+    if not u_ids:
+        return
+    channel_id = message.get("channel_id", -1)
+    dm_id = message.get("dm_id", -1)
+    handle = store.get("users", message["u_id"])["handle_str"]
+    text = f"{handle} tagged you in {_name(channel_id, dm_id)}: {message['message'][:QUOTE_LENGTH]}"
+    for u_id in u_ids:
+        if is_member(u_id):
+            notify(u_id, channel_id, dm_id, text)
+
+def notify(u_id, channel_id, dm_id, notification_message):
+    '''
+    Adds a notification to a user's ring buffer, overwriting their oldest
+    notification once it holds CAPACITY of them
+
+    Arguments:
+    u_id (Integer)                - The user to notify
+    channel_id (Integer)          - The channel it is about, or -1
+    dm_id (Integer)               - The dm it is about, or -1
+    notification_message (String) - The text of the notification
+
+    Return Value: None
+    '''
+    notification = {
+        "channel_id": channel_id,
+        "dm_id": dm_id,
+        "notification_message": notification_message,
+    }
+    # Held while the user's ring buffer is read and changed, as a user can
+    # be tagged in different channels and dms at once. Each user has their
+    # own, so notifying one user never waits on notifying another
+    with store.exclusive(f"notifications:{u_id}"):
+        record = store.get("notifications", u_id)
+        if record is None:
+            store.insert("notifications", {"u_id": u_id, "buffer": [notification], "head": 1 % CAPACITY})
+            return
+        buffer = list(record["buffer"])
+        head = record["head"]
+        if len(buffer) < CAPACITY:
+            buffer.append(notification)
+        else:
+            buffer[head] = notification
+        store.update("notifications", u_id, {"buffer": buffer, "head": (head + 1) % CAPACITY})
+
+def get(u_id):
+    '''
+    Returns a user's notifications, newest first
+
+    Return Value:
+        Returns [{"channel_id": Integer, "dm_id": Integer, "notification_message": String}, ...]
+    '''
+    record = store.get("notifications", u_id)
+    if record is None:
+        return []
+    buffer, head = record["buffer"], record["head"]
+    # The oldest notification is at head once the buffer has wrapped around
+    return (buffer[head:] + buffer[:head])[::-1]
+
+############################## HELPER FUNCTIONS ###############################
+
+def _name(channel_id, dm_id):
+    '''
+    Returns the name of the channel or dm a notification is about
+    '''
+    if channel_id != -1:
+        return store.get("channels", channel_id)["name"]
+    return store.get("dms", dm_id)["name"]
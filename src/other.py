@@ -1,101 +1,151 @@
-from src.helper import reset_data, load_data, get_channel, get_dm, get_user, channel_exists, dm_exists
-import src.data as d
+from json import dumps
+from src.helper import reset_data, is_member, is_dm_member, dm_active, format_message, token_active
+from src import config
+import src.store as store
+import src.search as search
+import src.notifications as notifications
+import src.events as events
+from src.error import InputError
 
+@store.atomic
 def clear_v1():
     '''
     Clears all the data in the data file
     '''
     reset_data()
 
-def search_v1(auth_user_id, query_str):
-    d.data = load_data()
+def search_v1(auth_user_id, query_str, limit=50, mode="words"):
+    '''
+    Searches the messages of every channel and dm the user is a member of,
+    using the indexes in search.py. In "words" mode a message matches if it
+    contains every word of query_str, in "substring" mode if query_str
+    appears anywhere in its text. Both are case insensitive
+
+    Arguments:
+    auth_user_id (Integer) - The user searching
+    query_str (String)     - The words or text to search for
+    limit (Integer)        - The most messages to return
+    mode (String)          - "words" or "substring"
+
+    Exceptions:
+        InputError  - Occurs when 
+                        1. limit is less than 1
+                        2. mode is not "words" or "substring"
+
+    Return Value:
+        Returns {
+            'messages': [List of messages, newest first]
+        } in "words" mode, or {
+            'messages': [List of messages, newest first],
+            'candidates_checked': Number of messages the trigram index had to check
+        } in "substring" mode
+    '''
+    if limit < 1:
+        raise InputError("Limit must be at least 1")
+
+    if mode == "words":
+        message_ids = search.query(auth_user_id, query_str, limit, can_view)
+        return {
+            'messages': [format_message(store.get('messages', message_id), auth_user_id) for message_id in message_ids]
+        }
+    if mode == "substring":
+        message_ids, checked = search.substring_query(auth_user_id, query_str, limit, can_view)
+        return {
+            'messages': [format_message(store.get('messages', message_id), auth_user_id) for message_id in message_ids],
+            'candidates_checked': checked,
+        }
+    raise InputError("Invalid search mode")
 
-    user = get_user(auth_user_id)
-    msgs = []
+def can_view(u_id, field, key):
+    '''
+    Checks if a user can see the messages of a channel or dm
+
+    Arguments:
+    u_id (Integer)  - The user
+    field (String)  - "channel_id" or "dm_id"
+    key (Integer)   - The id of the channel or dm
 
-    for message in d.data['messages']:
-        if message['message'] == query_str:
-            if user in get_channel(message["channel_id"])['all_members'] or user in get_dm(message['dm_id'])['members']:
-                msgs.append(message)
-    return {
-        'messages': msgs
-    }
+    Return Value:
+        Returns True if the user is a member, and the dm has not been
+        removed, False otherwise
+    '''
+    if field == "channel_id":
+        return is_member(u_id, key)
+    return dm_active(key) and is_dm_member(u_id, key)
 
 def notification_v1(auth_user_id):
-    d.data = load_data()
-    activities = []
-    for activity in d.data['activity']:
-        if activity['invitee'] == auth_user_id:
-            activities.append(activity)
-    activities.reverse()
-
-    messages = []
-    for message in d.data['messages']:
-        if message['u_id'] != auth_user_id:
-            if channel_exists(message['channel_id']) and get_user(auth_user_id) in get_channel(message['channel_id'])['all_members']:
-                messages.append(message)
-            if dm_exists(message['dm_id']) and get_user(auth_user_id) in get_dm(message['dm_id'])['members']:
-                messages.append(message)
- 
-    notifications = []
-    while len(notifications) < 20:
-        if len(messages) > 0 and len(activities) > 0:
-            if messages[0]['time_created'] < activities[0]['time']:
-                message = messages[0]
-                sender = get_user(message['u_id'])
-                if message['channel_id'] > message['dm_id']:
-                    name = get_channel(message['channel_id'])['name']
-                else:
-                    name = get_dm(message['dm_id'])['name']
-                if len(message['message']) > 20:
-                    messagestr = message['message'][:20]
-                else:
-                    messagestr = message['message']
-                print(message)
-                notifications.append({
-                    'channel_id': message['channel_id'],
-                    'dm_id': message['dm_id'],
-                    'notification_message': f"{sender['handle_str']} tagged you in {name}: {messagestr}"
-                })
-                messages.remove(message)
-            elif len(activities) > 0:
-                activity = activities[0]
-                print(activity)
-                notifications.append({
-                    'channel_id': activity['channel_id'],
-                    'dm_id': activity['dm_id'],
-                    'notification_message': f"{activity['handle_str']} added you to {activity['name']}"
-                })
-                activities.remove(activity)
+    '''
+    Returns the user's 20 most recent notifications, from the inbox kept
+    up to date in notifications.py as they are added to channels and dms
+    and tagged in messages
+
+    Arguments:
+    auth_user_id (Integer) - The user
+
+    Return Value:
+        Returns {
+            'notifications': [List of {channel_id, dm_id, notification_message}, newest first]
+        }
+    '''
+    return {'notifications': notifications.get(auth_user_id)}
+
+def events_stream_v1(auth_user_id, token, last_event_id=None):
+    '''
+    Streams the activity of every channel and dm the user is a member of as
+    Server-Sent Events: each message sent, edited or removed and each change
+    to its reacts or whether it is pinned, as published to events.py. A
+    client that reconnects with the id of the last event it was sent is
+    first given the events it missed, or a "reset" event when they are no
+    longer kept, after which it should reload the messages it shows. The
+    stream ends once the token's session does
+
+    Arguments:
+    auth_user_id (Integer) - The user streaming
+    token (String)         - The token the stream was opened with
+    last_event_id (String) - The id of the last event the client was sent,
+                             or None to stream only what happens from now on
+
+    Return Value:
+        Returns a generator of the text of the stream, one chunk of events
+        at a time. Each event is "id: <event_id>", "event: <type>" and
+        "data: <JSON>" lines, the data being {'message': message} as the
+        messages endpoints return it, or {'message_id', 'channel_id' or
+        'dm_id'} for "message_removed"
+    '''
+    after = events.position() if last_event_id is None else last_event_id
+    yield f"retry: {config.stream_retry}\n\n"
+    while True:
+        batch = events.wait(after, config.stream_keepalive)
+        if batch is None:
+            after = events.position()
+            yield f"id: {after}\nevent: reset\ndata: {{}}\n\n"
+        elif not batch:
+            if not token_active(token):
+                return
+            yield ": keepalive\n\n"
         else:
-            if len(messages) > 0:
-                message = messages[0]
-                sender = get_user(message['u_id'])
-                if message['channel_id'] > message['dm_id']:
-                    name = get_channel(message['channel_id'])['name']
-                else:
-                    name = get_dm(message['dm_id'])['name']
-                if len(message['message']) > 20:
-                    messagestr = message['message'][:20]
-                else:
-                    messagestr = message['message']
-                print(message)
-                notifications.append({
-                    'channel_id': message['channel_id'],
-                    'dm_id': message['dm_id'],
-                    'notification_message': f"{sender['handle_str']} tagged you in {name}: {messagestr}"
-                })
-                messages.remove(message)
-            if len(activities) > 0:
-                activity = activities[0]
-                print(activity)
-                notifications.append({
-                    'channel_id': activity['channel_id'],
-                    'dm_id': activity['dm_id'],
-                    'notification_message': f"{activity['handle_str']} added you to {activity['name']}"
-                })
-                activities.remove(activity)
-        if len(messages) == 0 and len(activities) == 0:
-            break
-    notifications.reverse()
-    return {'notifications': notifications}
+            after = batch[-1]["event_id"]
+            with store.reading():
+                chunk = "".join(_event_text(event, auth_user_id) for event in batch if _can_see(auth_user_id, event["message"]))
+            if chunk:
+                yield chunk
+
+def _can_see(u_id, message):
+    '''
+    Checks if a user can see a message, as a member of its channel or dm
+    '''
+    if "channel_id" in message:
+        return can_view(u_id, "channel_id", message["channel_id"])
+    return can_view(u_id, "dm_id", message["dm_id"])
+
+def _event_text(event, u_id):
+    '''
+    Formats an event as the lines of a Server-Sent Event for the user
+    '''
+    message = event["message"]
+    if event["type"] == events.REMOVED:
+        field = "channel_id" if "channel_id" in message else "dm_id"
+        data = {"message_id": message["message_id"], field: message[field]}
+    else:
+        data = {"message": format_message(message, u_id)}
+    return f"id: {event['event_id']}\nevent: {event['type']}\ndata: {dumps(data)}\n\n"
@@ -0,0 +1,203 @@
+'''
+passwords.py
+
+Hashing and checking of passwords, off the request thread.
+
+Passwords are stored as the output of a slow key derivation function,
+hashlib.scrypt, along with the salt and the parameters it was run with, eg
+{"kdf": "scrypt", "n": 16384, "r": 8, "p": 1, "salt": "...", "hash": "..."}.
+Since the parameters are kept with each user, raising them in config only
+affects new hashes, and needs_rehash tells login which stored hashes are
+out of date so they can be replaced once the password is known. Passwords
+stored by older versions of Dreams as a JWT are still accepted and are
+always out of date.
+
+The work runs in a pool of config.password_workers threads (or processes,
+if config.password_executor is "process"), which caps how many hashes run
+at once however many logins arrive. scrypt releases the GIL, so a login
+storm keeps those workers busy without holding up the threads serving
+messages. At most config.password_queue_depth more requests wait for a
+worker, past which ServiceUnavailableError is raised straight away rather
+than letting requests pile up. How long each hash spent waiting and
+running is recorded and returned by metrics().
+'''
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import jwt
+from src import config
+from src.error import ServiceUnavailableError
+
+_lock = threading.Lock()
+_pool = None
+_slots = None
+_metrics = {}
+
+def hash_password(password):
+    '''
+    Hashes a password with the current KDF parameters
+
+    Arguments:
+    password (String) - The password in plain text
+
+    Exceptions:
+    ServiceUnavailableError - Occurs when the queue of waiting hashes is full
+
+    Return Value:
+        Returns the record to store, {"kdf", "n", "r", "p", "salt", "hash"}
+    '''
+    params = current_params()
+    salt = os.urandom(config.password_salt_bytes)
+    derived = _run("hash", _derive, password, salt, params)
+    return dict(params, salt=salt.hex(), hash=derived.hex())
+
+def verify(password, stored):
+    '''
+    Checks a password against what is stored for a user
+
+    Arguments:
+    password (String)      - The password in plain text
+    stored (Dict / String) - The user's stored password, either a record made
+                             by hash_password or a JWT from an older version
+
+    Exceptions:
+    ServiceUnavailableError - Occurs when the queue of waiting hashes is full
+
+    Return Value:
+        Returns True if the password is correct, otherwise False
+    '''
+    if not isinstance(stored, dict):
+        legacy = jwt.decode(stored, "", algorithms=["HS256"])
+        return hmac.compare_digest(password.encode(), legacy['password'].encode())
+
+    params = {field: stored[field] for field in ("kdf", "n", "r", "p")}
+    derived = _run("verify", _derive, password, bytes.fromhex(stored["salt"]), params)
+    return hmac.compare_digest(derived, bytes.fromhex(stored["hash"]))
+
+def needs_rehash(stored):
+    '''
+    Checks if a stored password was hashed with anything other than the
+    current KDF parameters
+    '''
+    if not isinstance(stored, dict):
+        return True
+    return any(stored.get(field) != value for field, value in current_params().items())
+
+def current_params():
+    '''
+    Returns the KDF parameters new hashes are made with
+    '''
+    return {
+        "kdf": "scrypt",
+        "n": config.password_scrypt_n,
+        "r": config.password_scrypt_r,
+        "p": config.password_scrypt_p,
+    }
+
+def metrics():
+    '''
+    Returns timing metrics of the hashes run so far
+
+    Return Value:
+        Returns {
+            "hash": {"count", "wait_seconds", "run_seconds", "max_run_seconds"},
+            "verify": {...},
+            "in_flight": Number of hashes running or waiting for a worker,
+            "rejected": Number turned away because the queue was full,
+        }
+    '''
+    with _lock:
+        result = {op: dict(_metrics.get(op, _empty_timing())) for op in ("hash", "verify")}
+        result["in_flight"] = _metrics.get("in_flight", 0)
+        result["rejected"] = _metrics.get("rejected", 0)
+        return result
+
+def shutdown():
+    '''
+    Stops the worker pool, waiting for running hashes to finish. A new pool
+    is started by the next hash
+    '''
+    global _pool, _slots
+    with _lock:
+        pool, _pool, _slots = _pool, None, None
+        _metrics.clear()
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+############################## HELPER FUNCTIONS ###############################
+
+def _derive(password, salt, params):
+    '''
+    Runs the KDF. Runs in a worker, so it must stay a module level function
+    for the process pool to pickle it
+
+    Return Value:
+        Returns (derived key, seconds it took)
+    '''
+    start = time.perf_counter()
+    derived = hashlib.scrypt(
+        password.encode(), salt=salt, n=params["n"], r=params["r"], p=params["p"],
+        maxmem=_maxmem(params), dklen=config.password_hash_bytes
+    )
+    return derived, time.perf_counter() - start
+
+def _maxmem(params):
+    '''
+    Returns enough memory for scrypt with the given parameters, as the
+    default limit of 32MiB is too low for some of them
+    '''
+    return 128 * params["r"] * (params["n"] + params["p"] + 2) + 1024 * 1024
+
+def _run(op, fn, *args):
+    '''
+    Runs fn in the pool and waits for its result, recording how long it
+    waited for a worker and how long it ran
+    '''
+    pool, slots = _start()
+    if not slots.acquire(blocking=False):
+        with _lock:
+            _metrics["rejected"] = _metrics.get("rejected", 0) + 1
+        raise ServiceUnavailableError("Too many logins at once, try again shortly")
+
+    submitted = time.perf_counter()
+    with _lock:
+        _metrics["in_flight"] = _metrics.get("in_flight", 0) + 1
+    try:
+        result, run_seconds = pool.submit(fn, *args).result()
+    finally:
+        slots.release()
+        with _lock:
+            _metrics["in_flight"] = _metrics.get("in_flight", 1) - 1
+
+    total = time.perf_counter() - submitted
+    with _lock:
+        timing = _metrics.setdefault(op, _empty_timing())
+        timing["count"] += 1
+        timing["wait_seconds"] += max(total - run_seconds, 0)
+        timing["run_seconds"] += run_seconds
+        timing["max_run_seconds"] = max(timing["max_run_seconds"], run_seconds)
+    return result
+
+def _start():
+    '''
+    Starts the worker pool if it isn't running
+
+    Return Value:
+        Returns (pool, semaphore of the slots left for running and waiting hashes)
+    '''
+    global _pool, _slots
+    with _lock:
+        if _pool is None:
+            workers = config.password_workers or os.cpu_count() or 1
+            if config.password_executor == "process":
+                _pool = ProcessPoolExecutor(max_workers=workers)
+            else:
+                _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="passwords")
+            _slots = threading.BoundedSemaphore(workers + config.password_queue_depth)
+        return _pool, _slots
+
+def _empty_timing():
+    return {"count": 0, "wait_seconds": 0.0, "run_seconds": 0.0, "max_run_seconds": 0.0}
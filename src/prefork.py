@@ -0,0 +1,97 @@
+'''
+prefork.py
+
+Runs the server as several worker processes accepting connections on one
+port, so requests are served on every core instead of in one process.
+
+The parent binds the port and forks config.server_processes workers, each
+serving requests from the shared socket on threads of its own. The workers
+share the data store through the SQLite engine and store.share(), see
+store.py. The parent only waits, forking a new worker whenever one dies,
+and stops them all when it is stopped.
+'''
+import os
+import signal
+import socket
+import traceback
+from werkzeug.serving import make_server
+
+def serve(app, host, port, processes, before_fork, in_worker):
+    '''
+    Serves app from processes worker processes until stopped
+
+    Arguments:
+    app (Flask)            - The WSGI application
+    host (String)          - The address to listen on, eg "localhost"
+    port (Integer)         - The port to listen on
+    processes (Integer)    - The number of worker processes
+    before_fork (Function) - Called once in the parent before the first
+                             fork, to stop any threads and close anything
+                             that can't be carried over a fork
+    in_worker (Function)   - Called in each worker once it is forked, to
+                             open what before_fork closed
+
+    Return Value: None
+    '''
+    listener = socket.create_server((host, port), backlog=128)
+    listener.set_inheritable(True)
+    before_fork()
+
+    workers = set()
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            _kill(pid)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        while True:
+            while not stopping and len(workers) < processes:
+                workers.add(_fork(app, listener, in_worker))
+            if not workers:
+                return
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                return
+            except InterruptedError:
+                continue
+            workers.discard(pid)
+    finally:
+        listener.close()
+
+############################## HELPER FUNCTIONS ###############################
+
+def _fork(app, listener, in_worker):
+    '''
+    Forks a worker serving app from listener
+
+    Return Value:
+        Returns the pid of the worker, in the parent
+    '''
+    pid = os.fork()
+    if pid:
+        return pid
+    # In the worker, which must never return into the parent's loop
+    status = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        in_worker()
+        host, port = listener.getsockname()[:2]
+        make_server(host, port, app, threaded=True, fd=listener.fileno()).serve_forever()
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        os._exit(status)
+
+def _kill(pid):
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
@@ -0,0 +1,80 @@
+'''
+rwlock.py
+
+A reader-writer lock. Any number of threads can hold it for reading at
+once, or one thread for writing. Writers are preferred: once a writer is
+waiting no new readers are let in, so a steady stream of reads can't hold
+writes off forever.
+
+Both sides are reentrant. A thread holding the write lock can take it
+again, or take the read lock, without blocking, and a thread already
+reading can read again even while a writer waits. A reader can't upgrade
+to a writer, as two readers doing so at once would deadlock.
+
+Given a FileLock (file_lock.py), it also excludes other processes: the
+process holds the byte shared while any of its threads reads and exclusive
+while one of them writes.
+'''
+import threading
+
+class RWLock:
+    def __init__(self, file_lock=None):
+        self._file_lock = file_lock
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._writers_waiting = 0
+        self._local = threading.local()
+
+    def acquire_read(self):
+        me = threading.get_ident()
+        depth = getattr(self._local, "reads", 0)
+        with self._cond:
+            if self._writer != me and depth == 0:
+                self._cond.wait_for(lambda: self._writer is None and not self._writers_waiting)
+            if self._writer != me:
+                if not self._readers and self._file_lock is not None:
+                    # The first reader takes the file for the whole process.
+                    # The others wait here for it, as they would need it too
+                    self._file_lock.acquire(shared=True)
+                self._readers += 1
+        self._local.reads = depth + 1
+
+    def release_read(self):
+        me = threading.get_ident()
+        self._local.reads -= 1
+        with self._cond:
+            if self._writer != me:
+                self._readers -= 1
+                if not self._readers:
+                    if self._file_lock is not None:
+                        self._file_lock.release()
+                    self._cond.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return
+            if getattr(self._local, "reads", 0):
+                raise RuntimeError("Cannot take the write lock while holding the read lock")
+            self._writers_waiting += 1
+            try:
+                self._cond.wait_for(lambda: self._writer is None and not self._readers)
+            finally:
+                self._writers_waiting -= 1
+            if self._file_lock is not None:
+                self._file_lock.acquire()
+            self._writer = me
+            self._writer_depth = 1
+
+    def release_write(self):
+        with self._cond:
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                if self._file_lock is not None:
+                    self._file_lock.release()
+                self._writer = None
+                self._cond.notify_all()
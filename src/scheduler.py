@@ -0,0 +1,241 @@
+'''
+scheduler.py
+
+Delivery of messages sent with message_sendlater_v1 and
+message_sendlaterdm_v1.
+
+Each scheduled message is kept in the "scheduled" collection of the store
+until it is delivered, keyed by the message_id it was given when it was
+scheduled, so jobs survive a restart. One dispatcher thread sleeps until
+the earliest job is due, using a min-heap of (time_sent, message_id), so
+however many messages are waiting there is only ever one thread. Jobs that
+came due while the server was down are delivered as soon as it is back.
+
+The scheduled messages of each user are also kept as a set of message_ids,
+so listing or cancelling them never scans the collection.
+
+A scheduled message is given its message_id by ids.next_id when it is
+scheduled, which sendlater returns and which listing and cancelling it go
+by. It is placed in the history of its channel or dm by a second id,
+reserved when it is delivered (see store.position), so a client paging on
+with after_message_id sees it once it arrives, however many messages were
+sent while it waited.
+'''
+import heapq
+import threading
+import time
+import src.store as store
+
+_cond = threading.Condition()
+_built = False
+_running = False
+_dispatcher = None
+# (time_sent, message_id) of every scheduled message
+_due = []
+# u_id -> {message_ids}
+_by_user = {}
+# message_id -> u_id
+_owners = {}
+_delivering = 0
+
+def schedule(job):
+    '''
+    Schedules a message to be delivered
+
+    Arguments:
+    job (Dictionary) - {"message_id", "u_id", "channel_id" or "dm_id",
+                        "message", "time_sent"}, where message_id was
+                       reserved with ids.next_id
+
+    Return Value: None
+    '''
+    with _cond:
+        _build()
+        store.insert("scheduled", job)
+        _add(job)
+        _start_dispatcher()
+        _cond.notify_all()
+
+def pending(u_id):
+    '''
+    Returns the messages a user has scheduled that are still to be
+    delivered, soonest first
+
+    Arguments:
+    u_id (Integer) - The user who scheduled them
+    '''
+    with _cond:
+        _build()
+        jobs = [store.get("scheduled", message_id) for message_id in _by_user.get(u_id, ())]
+        return sorted((job for job in jobs if job is not None), key=lambda job: (job["time_sent"], job["message_id"]))
+
+def cancel(u_id, message_id):
+    '''
+    Cancels a scheduled message before it is delivered
+
+    Arguments:
+    u_id (Integer)       - The user who scheduled it
+    message_id (Integer) - The message_id it was given
+
+    Return Value:
+        Returns True if it was cancelled, False if the user has no such
+        message waiting
+    '''
+    with _cond:
+        _build()
+        if message_id not in _by_user.get(u_id, ()):
+            return False
+        _remove(u_id, message_id)
+        # Its heap entry is skipped once it comes up, as the job is gone
+        store.delete("scheduled", message_id)
+        return True
+
+def wait_until_delivered(timeout=None):
+    '''
+    Waits until every job that is due has been delivered
+
+    Return Value:
+        Returns True if nothing is due, False if timeout ran out first
+    '''
+    with _cond:
+        _build()
+        return _cond.wait_for(lambda: not _delivering and not _ready(time.time()), timeout=timeout)
+
+def sync_job(message_id):
+    '''
+    Brings a scheduled message up to date with the store, eg once another
+    server process has scheduled, cancelled or delivered it
+
+    Arguments:
+    message_id (Integer) - The message_id of the job
+
+    Return Value: None
+    '''
+    with _cond:
+        if not _built:
+            return
+        job = store.get("scheduled", message_id)
+        if job is None:
+            if message_id in _owners:
+                _remove(_owners[message_id], message_id)
+        elif message_id not in _owners:
+            _add(job)
+            _start_dispatcher()
+            _cond.notify_all()
+
+def reset():
+    '''
+    Reads the scheduled messages from the store again. Called whenever the
+    data store is cleared or reloaded, so jobs from before a restart are
+    delivered
+    '''
+    global _built
+    with _cond:
+        _built = False
+        _build()
+        _cond.notify_all()
+
+def shutdown():
+    '''
+    Stops the dispatcher thread. Jobs stay in the store and are delivered
+    once it starts again
+    '''
+    global _running
+    with _cond:
+        _running = False
+        _cond.notify_all()
+        dispatcher = _dispatcher
+    if dispatcher is not None:
+        dispatcher.join()
+
+############################## HELPER FUNCTIONS ###############################
+
+def _build():
+    '''
+    Reads the scheduled messages from the store the first time they are
+    needed. Must be called with _cond held
+    '''
+    global _built
+    if _built:
+        return
+    _built = True
+    _due.clear()
+    _by_user.clear()
+    _owners.clear()
+    for job in store.scan("scheduled"):
+        _add(job)
+    if _due:
+        _start_dispatcher()
+
+def _add(job):
+    '''
+    Adds a job to the heap and the user's set. Must be called with _cond held
+    '''
+    heapq.heappush(_due, (job["time_sent"], job["message_id"]))
+    _by_user.setdefault(job["u_id"], set()).add(job["message_id"])
+    _owners[job["message_id"]] = job["u_id"]
+
+def _remove(u_id, message_id):
+    '''
+    Removes a job from the user's set. Must be called with _cond held
+    '''
+    _owners.pop(message_id, None)
+    jobs = _by_user.get(u_id)
+    if jobs is not None:
+        jobs.discard(message_id)
+        if not jobs:
+            del _by_user[u_id]
+
+def _ready(now):
+    '''
+    Checks if the earliest job is due. Must be called with _cond held
+    '''
+    return bool(_due) and _due[0][0] <= now
+
+def _start_dispatcher():
+    '''
+    Starts the dispatcher thread if it isn't running. Must be called with
+    _cond held
+    '''
+    global _running, _dispatcher
+    if _running:
+        return
+    _running = True
+    _dispatcher = threading.Thread(target=_dispatch_loop, name="scheduler", daemon=True)
+    _dispatcher.start()
+
+def _dispatch_loop():
+    '''
+    Body of the dispatcher thread, delivers every job that is due and then
+    sleeps until the next one is due or a new one is scheduled
+    '''
+    global _delivering
+    from src.message import deliver_scheduled
+    while True:
+        with _cond:
+            while _running and not _ready(time.time()):
+                _cond.wait(timeout=_due[0][0] - time.time() if _due else None)
+            if not _running:
+                return
+            time_sent, message_id = heapq.heappop(_due)
+            job = store.get("scheduled", message_id)
+            if job is None or job["time_sent"] != time_sent:
+                # Cancelled, and maybe its message_id given to another job since
+                continue
+            # From here on it can no longer be cancelled
+            _remove(job["u_id"], message_id)
+            _delivering += 1
+
+        try:
+            deliver_scheduled(job)
+        except Exception:
+            # The sender may have left, or the dm been removed, since it
+            # was scheduled, in which case it is never delivered
+            pass
+        finally:
+            with _cond:
+                # Dropped if deliver_scheduled failed before deleting it
+                if store.get("scheduled", message_id) is not None:
+                    store.delete("scheduled", message_id)
+                _delivering -= 1
+                _cond.notify_all()
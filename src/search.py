@@ -0,0 +1,262 @@
+'''
+search.py
+
+The indexes behind search_v1.
+
+Message text is split into terms (runs of letters, digits and underscores,
+lower cased) and every term has a posting list, the message_ids of the
+live messages containing it in ascending order. A query is the messages
+containing every one of its terms: the shortest posting list is walked
+from its newest message backwards, each candidate is checked against the
+other lists with a bisect and against the caller's memberships, and the
+walk stops as soon as limit results are found.
+
+Substring queries are served by a second index from each trigram (three
+character sequence) of the lower cased text to the messages containing it.
+The candidates for a query are the messages holding every trigram of the
+query, and only those are checked for the query as a substring, newest
+first, so the work done depends on how selective the query is rather than
+on how much text there is. Queries shorter than three characters have no
+trigrams and check every message.
+
+Both indexes are derived from the messages collection. They are built from
+the store the first time they are needed, then kept current by the modules
+that change message text, which call index_message and unindex_message,
+and are dropped by reset whenever the data store is cleared or reloaded.
+'''
+import re
+import threading
+from bisect import bisect_left
+import src.store as store
+
+_lock = threading.RLock()
+_built = False
+# term -> [message_ids in ascending order]
+_postings = {}
+# message_id -> the terms it was indexed under
+_terms = {}
+# message_id -> ("channel_id", channel_id) or ("dm_id", dm_id)
+_conversations = {}
+# trigram -> {message_ids}
+_trigrams = {}
+# message_id -> the lower cased text it was indexed with
+_texts = {}
+
+def tokenize(text):
+    '''
+    Splits text into its distinct search terms
+
+    Arguments:
+    text (String) - The message text or query
+
+    Return Value:
+        Returns a set of lower cased terms, eg {"hello", "world"}
+    '''
+    return set(re.findall(r"\w+", text.lower()))
+
+def index_message(message):
+    '''
+    Adds a message to the index, or re-indexes it if its text has changed.
+    Removed messages are taken out of the index instead
+
+    Arguments:
+    message (Dictionary) - The message, as stored in the messages collection
+
+    Return Value: None
+    '''
+    with _lock:
+        if not _built:
+            return
+        _unindex(message["message_id"])
+        if message.get("removed"):
+            return
+        _index(message)
+
+def unindex_message(message_id):
+    '''
+    Takes a message out of the index, eg once it has been removed
+
+    Arguments:
+    message_id (Integer) - The message
+
+    Return Value: None
+    '''
+    with _lock:
+        if _built:
+            _unindex(message_id)
+
+def sync_message(message_id):
+    '''
+    Brings a message in the index up to date with the store, eg once another
+    server process has changed it
+
+    Arguments:
+    message_id (Integer) - The message
+
+    Return Value: None
+    '''
+    message = store.get("messages", message_id)
+    if message is None:
+        unindex_message(message_id)
+    else:
+        index_message(message)
+
+def query(u_id, query_str, limit, is_allowed):
+    '''
+    Finds the newest messages containing every term of query_str
+
+    Arguments:
+    u_id (Integer)        - The user searching
+    query_str (String)    - The terms to search for
+    limit (Integer)       - The most message_ids to return
+    is_allowed (Function) - is_allowed(u_id, field, key) checks if the user
+                            can see the messages of a channel or dm
+
+    Return Value:
+        Returns a list of message_ids, largest (newest) first
+    '''
+    terms = tokenize(query_str)
+    if not terms:
+        return []
+    with _lock:
+        _build()
+        lists = sorted((_postings.get(term, []) for term in terms), key=len)
+        shortest, others = lists[0], lists[1:]
+        allowed = {}
+        results = []
+        for message_id in reversed(shortest):
+            if not all(_contains(ids, message_id) for ids in others):
+                continue
+            conversation = _conversations[message_id]
+            if conversation not in allowed:
+                allowed[conversation] = is_allowed(u_id, *conversation)
+            if allowed[conversation]:
+                results.append(message_id)
+                if len(results) == limit:
+                    break
+        return results
+
+def substring_query(u_id, query_str, limit, is_allowed):
+    '''
+    Finds the newest messages containing query_str, case insensitively,
+    anywhere in their text
+
+    Arguments:
+    u_id (Integer)        - The user searching
+    query_str (String)    - The text to search for
+    limit (Integer)       - The most message_ids to return
+    is_allowed (Function) - As for query
+
+    Return Value:
+        Returns (list of message_ids largest first, number of candidates checked)
+    '''
+    needle = query_str.lower()
+    if not needle:
+        return [], 0
+    with _lock:
+        _build()
+        grams = trigrams(needle)
+        if grams:
+            sets = sorted((_trigrams.get(gram, set()) for gram in grams), key=len)
+            candidates = set(sets[0]).intersection(*sets[1:])
+        else:
+            candidates = _texts.keys()
+        allowed = {}
+        results = []
+        checked = 0
+        for message_id in sorted(candidates, reverse=True):
+            checked += 1
+            if needle not in _texts[message_id]:
+                continue
+            conversation = _conversations[message_id]
+            if conversation not in allowed:
+                allowed[conversation] = is_allowed(u_id, *conversation)
+            if allowed[conversation]:
+                results.append(message_id)
+                if len(results) == limit:
+                    break
+        return results, checked
+
+def trigrams(text):
+    '''
+    Returns the set of three character sequences in text, eg "abcd" gives
+    {"abc", "bcd"}
+    '''
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def reset():
+    '''
+    Drops the indexes, so that they are rebuilt from the store the next time
+    they are needed. Called whenever the data store is cleared or reloaded
+    '''
+    global _built
+    with _lock:
+        _postings.clear()
+        _terms.clear()
+        _conversations.clear()
+        _trigrams.clear()
+        _texts.clear()
+        _built = False
+
+############################## HELPER FUNCTIONS ###############################
+
+def _build():
+    '''
+    Builds the indexes from every live message in the store, if they are not
+    built already. Must be called with _lock held
+    '''
+    global _built
+    if _built:
+        return
+    for message in store.scan("messages"):
+        if not message.get("removed"):
+            _index(message)
+    _built = True
+
+def _index(message):
+    '''
+    Adds a message to the posting list of each of its terms and trigrams
+    '''
+    message_id = message["message_id"]
+    terms = tokenize(message["message"])
+    for term in terms:
+        ids = _postings.setdefault(term, [])
+        if not ids or ids[-1] < message_id:
+            # New messages have the largest id so far, so this is the usual case
+            ids.append(message_id)
+        elif not _contains(ids, message_id):
+            ids.insert(bisect_left(ids, message_id), message_id)
+    _terms[message_id] = terms
+    text = message["message"].lower()
+    for gram in trigrams(text):
+        _trigrams.setdefault(gram, set()).add(message_id)
+    _texts[message_id] = text
+    _conversations[message_id] = (
+        ("channel_id", message["channel_id"]) if "channel_id" in message else ("dm_id", message["dm_id"])
+    )
+
+def _unindex(message_id):
+    '''
+    Removes a message from the posting list of each term and trigram it was
+    indexed under
+    '''
+    for term in _terms.pop(message_id, ()):
+        ids = _postings[term]
+        del ids[bisect_left(ids, message_id)]
+        if not ids:
+            del _postings[term]
+    _conversations.pop(message_id, None)
+    text = _texts.pop(message_id, None)
+    if text is not None:
+        for gram in trigrams(text):
+            ids = _trigrams[gram]
+            ids.discard(message_id)
+            if not ids:
+                del _trigrams[gram]
+
+def _contains(ids, message_id):
+    '''
+    Checks if a sorted posting list holds message_id
+    '''
+    i = bisect_left(ids, message_id)
+    return i < len(ids) and ids[i] == message_id
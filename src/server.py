@@ -4,13 +4,12 @@ provides HTTP routes for all modules
 '''
 import re
 import sys
-import jwt
 from json import dumps
-from flask import Flask, request
+from flask import Flask, Response, request, g
 from flask_cors import CORS
 from src.error import InputError, AccessError
 from src import config
-from src.helper import token_decode, token_active, load_data, save_data, get_id_and_password, user_exists, get_user, dm_exists, get_dm, get_channel, channel_exists
+from src.helper import create_token, token_decode, token_active, init_data, save_data, get_id_and_password, user_exists, get_user, is_member, is_dm_member, dm_exists, get_dm, channel_exists
 
 # Import paths for implementation
 import src.admin as ad
@@ -20,12 +19,16 @@ import src.dm as d
 import src.auth as a
 import src.channel as c
 import src.message as m
-import src.data as dt
+import src.store as store
+import src.sessions as sessions
 import src.other as o
 import src.standup as su
+import src.scheduler as scheduler
+import src.mail as mail
+import src.passwords as passwords
+import src.prefork as prefork
 
-dt.data = load_data()
-active_tokens = []
+init_data()
 
 def defaultHandler(err):
     response = err.get_response()
@@ -44,6 +47,27 @@ CORS(APP)
 APP.config['TRAP_HTTP_EXCEPTIONS'] = True
 APP.register_error_handler(Exception, defaultHandler)
 
+# GET routes only read, so they hold the store for reading and run alongside
+# each other, each seeing a consistent snapshot. Routes that change the store
+# are serialized by the @store.atomic operations they call. With several
+# worker processes every request first picks up what the others changed, so
+# eg a token from a login served by another worker is known. The lock is let
+# go once a route returns, so the activity stream holds it only for each
+# batch of events it sends
+@APP.before_request
+def read_lock_store():
+    if request.method == 'GET':
+        g.store_reading = store.reading()
+        g.store_reading.__enter__()
+    else:
+        store.sync()
+
+@APP.teardown_request
+def read_unlock_store(exc):
+    reading = g.pop('store_reading', None)
+    if reading is not None:
+        reading.__exit__(None, None, None)
+
 # Example
 @APP.route("/echo", methods=['GET'])
 def echo():
@@ -58,7 +82,6 @@ def echo():
 # AUTH ROUTES
 @APP.route("/auth/login/v2", methods=['POST'])
 def auth_login_v1():
-    dt.data = load_data()
     data = request.get_json()
     email = data['email']
 
@@ -72,18 +95,15 @@ def auth_login_v1():
         raise InputError("Email not Found")
 
     password = data['password']
-    if password != details['password']:
-        raise InputError("Incorrect Password")
-
     login_details = a.auth_login_v2(email, password)
 
-    session_id = 0
-
-    while login_details['token'] in active_tokens:
-        session_id += 1
-        login_details['token'] = jwt.encode({'handle': get_user(details['user_id'])['handle_str'], "session_id": session_id}, "", algorithm='HS256')
+    # A user already logged in gets a token of their own for each new session
+    session_id = None
+    if token_active(login_details['token']):
+        session_id = sessions.next_session_id()
+        login_details['token'] = create_token(get_user(details['user_id'])['handle_str'], details['user_id'], session_id)
 
-    active_tokens.append(login_details['token'])
+    sessions.start(login_details['token'], login_details['auth_user_id'], session_id)
 
     return dumps(
         login_details
@@ -91,7 +111,6 @@ def auth_login_v1():
 
 @APP.route("/auth/register/v2", methods=['POST'])
 def auth_register_v1():
-    dt.data = load_data()
     data = request.get_json()
     email = data['email']
     password = data['password']
@@ -103,9 +122,8 @@ def auth_register_v1():
     if not re.search(regex, email):
         raise InputError("Invalid Email")
 
-    for user in dt.data['users']:
-        if user['email'] == email:
-            raise InputError("Email already taken")
+    if store.find('users', 'email', email) is not None:
+        raise InputError("Email already taken")
 
     if len(password) < 6:
         raise InputError("Password too short")
@@ -118,7 +136,7 @@ def auth_register_v1():
 
     login_details = a.auth_register_v2(email, password, name_first, name_last)
 
-    active_tokens.append(login_details['token'])
+    sessions.start(login_details['token'], login_details['auth_user_id'])
 
     return dumps(
         login_details
@@ -128,10 +146,7 @@ def auth_register_v1():
 def auth_logout_server_v1():
     data = request.get_json()
     token = data['token']
-    is_success = False
-    if token_active(active_tokens, token):
-        active_tokens.remove(token)
-        is_success = True
+    is_success = sessions.end(token)
     return dumps({"is_success": is_success})
 
 @APP.route("/auth/passwordreset/request/v1", methods=['POST'])
@@ -184,13 +199,12 @@ def channel_invite():
 
 @APP.route('/channel/details/v2', methods=['GET'])
 def channel_details():
-    d.data = load_data()
     token = request.args.get('token')
     auth_uid = token_decode(token)
     c_id = int(request.args.get('channel_id'))
     if channel_exists(c_id) == False:
         raise InputError
-    if get_user(auth_uid) not in get_channel(c_id)['all_members']:
+    if not is_member(auth_uid, c_id):
         raise AccessError
     return dumps(
         c.channel_details_v1(auth_uid, c_id)
@@ -207,6 +221,19 @@ def channel_messages():
         c.channel_messages_v1(auth_uid, c_id, start)
     )
 
+@APP.route('/channel/history/v1', methods=['GET'])
+def channel_history():
+    token = request.args.get('token')
+    auth_uid = token_decode(token)
+    c_id = int(request.args.get('channel_id'))
+    before_message_id = int(request.args.get('before_message_id', -1))
+    after_message_id = int(request.args.get('after_message_id', -1))
+    limit = int(request.args.get('limit', 50))
+
+    return dumps(
+        c.channel_history_v1(auth_uid, c_id, before_message_id, after_message_id, limit)
+    )
+
 @APP.route('/channel/join/v2', methods=['POST'])
 def channel_join():
     data = request.get_json()
@@ -255,7 +282,7 @@ def channel_leave():
 @APP.route('/channels/list/v2', methods=['GET'])
 def channels_list_flask():
     token = request.args.get('token')
-    if token_active(active_tokens, token) == False:
+    if token_active(token) == False:
         raise AccessError
     
     return dumps(
@@ -265,7 +292,7 @@ def channels_list_flask():
 @APP.route('/channels/listall/v2', methods=['GET'])
 def channels_listall_flask():
     token = request.args.get('token')
-    if token_active(active_tokens, token) == False:
+    if token_active(token) == False:
         raise AccessError
 
     return dumps(
@@ -276,7 +303,7 @@ def channels_listall_flask():
 def channels_create_flask(): 
     data = request.get_json()
     token = data['token']
-    if token_active(active_tokens, token) == False:
+    if token_active(token) == False:
         raise AccessError
     name = data['name']
     is_public = data['is_public']
@@ -291,7 +318,7 @@ def channels_create_flask():
 @APP.route('/user/profile/v2', methods=['GET'])
 def user_profile_flask():
     token = request.args.get('token')
-    if token_active(active_tokens, token) == False:
+    if token_active(token) == False:
         raise AccessError
     u_id = int(request.args.get('u_id'))
     if user_exists(u_id) == False:
@@ -304,7 +331,7 @@ def user_profile_flask():
 @APP.route('/user/profile/setname/v2', methods=['POST'])
 def user_profile_setname_flask():
     data = request.get_json()
-    if token_active(active_tokens, data['token']) == False:
+    if token_active(data['token']) == False:
         raise AccessError
     token = data['token']
     name_first = data['name_first']
@@ -321,7 +348,7 @@ def user_profile_setname_flask():
 @APP.route('/user/profile/setemail/v2', methods=['POST'])
 def user_profile_setemail_flask():
     data = request.get_json()
-    if token_active(active_tokens, data['token']) == False:
+    if token_active(data['token']) == False:
         raise AccessError
     token = data['token']
     email = data['email']
@@ -339,17 +366,15 @@ def user_profile_setemail_flask():
 
 @APP.route('/user/profile/sethandle/v1', methods=['POST'])
 def user_profile_sethandle_flask():
-    dt.data = load_data()
     data = request.get_json()
     token = data['token']
-    if token_active(active_tokens, data['token']) == False:
+    if token_active(data['token']) == False:
         raise AccessError
     handle_str = data['handle_str']
     if len(handle_str) > 20 or len(handle_str) < 3:
         raise InputError    
-    for user in dt.data['users']:
-        if user['handle_str'] == handle_str:
-            raise InputError
+    if store.find('users', 'handle_str', handle_str) is not None:
+        raise InputError
 
     return dumps(
         u.user_profile_sethandle_v1(token, handle_str)
@@ -358,7 +383,7 @@ def user_profile_sethandle_flask():
 @APP.route('/users/all/v1', methods=["GET"])
 def users_all_flask():
     token = request.args.get('token')
-    if token_active(active_tokens, token) == False:
+    if token_active(token) == False:
         raise AccessError
 
     return dumps(
@@ -461,6 +486,24 @@ def message_sendlaterdm():
         m.message_sendlaterdm_v1(auth_uid, dm_id, msg, time)
     )
 
+@APP.route('/message/sendlater/list/v1', methods=['GET'])
+def message_sendlater_list():
+    auth_uid = token_decode(request.args.get('token'))
+
+    return dumps(
+        m.message_sendlater_list_v1(auth_uid)
+    )
+
+@APP.route('/message/sendlater/cancel/v1', methods=['POST'])
+def message_sendlater_cancel():
+    data = request.get_json()
+    auth_uid = token_decode(data['token'])
+    m_id = data['message_id']
+
+    return dumps(
+        m.message_sendlater_cancel_v1(auth_uid, m_id)
+    )
+
 @APP.route('/message/react/v1', methods=['POST'])
 def message_react():
     data = request.get_json()
@@ -509,14 +552,14 @@ def message_unpin():
 @APP.route('/dm/details/v1', methods=['GET'])
 def dm_details():
     token = request.args.get('token')
-    if token_active(active_tokens, token) == False:
+    if token_active(token) == False:
         raise AccessError
     dm_id = int(request.args.get('dm_id'))
     u_id = token_decode(token)
 
     if dm_exists(dm_id) == False:
         raise InputError
-    if get_user(u_id) not in get_dm(dm_id)['members']:
+    if not is_dm_member(u_id, dm_id):
         raise AccessError
 
     return dumps(
@@ -527,7 +570,7 @@ def dm_details():
 def dm_list():
     token = request.args.get('token')
 
-    if token_active(active_tokens, token) == False:
+    if token_active(token) == False:
         raise AccessError
 
     u_id = token_decode(token)
@@ -542,7 +585,7 @@ def dm_list():
 def dm_create():
     data = request.get_json()
     uids = data['uids']
-    if token_active(active_tokens, data['token']) == False:
+    if token_active(data['token']) == False:
         raise AccessError
     u_id = token_decode(data['token'])
     if user_exists(u_id) == False:
@@ -558,7 +601,7 @@ def dm_create():
 def dm_remove():
     data = request.get_json()
     dm_id = data['dm_id']
-    if token_active(active_tokens, data['token']) == False:
+    if token_active(data['token']) == False:
         raise AccessError
     u_id = token_decode(data['token'])
     if dm_exists(dm_id) == False:
@@ -566,7 +609,7 @@ def dm_remove():
     dm = get_dm(dm_id)
     if dm['active'] == False:
         raise InputError
-    if get_user(u_id) not in dm['members']:
+    if not is_dm_member(u_id, dm_id):
         raise AccessError
     if u_id != dm['creator']:
         raise AccessError
@@ -577,7 +620,7 @@ def dm_remove():
 @APP.route('/dm/invite/v1', methods=['POST'])
 def dm_invite():
     data = request.get_json()
-    if token_active(active_tokens, data['token']) == False:
+    if token_active(data['token']) == False:
         raise AccessError
     a_u_id = token_decode(data['token'])
     u_id = data['u_id']
@@ -589,7 +632,7 @@ def dm_invite():
     dm = get_dm(dm_id)
     if dm['active'] == False:
         raise InputError
-    if get_user(a_u_id) not in dm['members']:
+    if not is_dm_member(a_u_id, dm_id):
         raise AccessError
     return dumps(
         d.dm_invite_v1(a_u_id, dm_id, u_id)
@@ -598,7 +641,7 @@ def dm_invite():
 @APP.route('/dm/leave/v1', methods=['POST'])
 def dm_leave():
     data = request.get_json()
-    if token_active(active_tokens, data['token']) == False:
+    if token_active(data['token']) == False:
         raise AccessError
     a_u_id = token_decode(data['token'])
     dm_id = data['dm_id']
@@ -607,7 +650,7 @@ def dm_leave():
     dm = get_dm(dm_id)
     if dm['active'] == False:
         raise InputError
-    if get_user(a_u_id) not in dm['members']:
+    if not is_dm_member(a_u_id, dm_id):
         raise AccessError
     return dumps(
         d.dm_leave_v1(a_u_id, dm_id)
@@ -617,7 +660,7 @@ def dm_leave():
 @APP.route('/dm/messages/v1', methods=['GET'])
 def dm_messages():
     token = request.args.get('token')
-    if token_active(active_tokens, token) == False:
+    if token_active(token) == False:
         raise AccessError
     dm_id = int(request.args.get('dm_id'))
     start = int(request.args.get('start'))
@@ -627,25 +670,57 @@ def dm_messages():
     dm = get_dm(dm_id)
     if dm['active'] == False:
         raise InputError
-    if get_user(u_id) not in dm['members']:
+    if not is_dm_member(u_id, dm_id):
         raise AccessError
-    if start > len(dm['messages']):
-        raise InputError
     return dumps(
         d.dm_messages_v1(u_id, dm_id, start)
     )
+
+@APP.route('/dm/history/v1', methods=['GET'])
+def dm_history():
+    token = request.args.get('token')
+    if token_active(token) == False:
+        raise AccessError
+    u_id = token_decode(token)
+    dm_id = int(request.args.get('dm_id'))
+    before_message_id = int(request.args.get('before_message_id', -1))
+    after_message_id = int(request.args.get('after_message_id', -1))
+    limit = int(request.args.get('limit', 50))
+    return dumps(
+        d.dm_history_v1(u_id, dm_id, before_message_id, after_message_id, limit)
+    )
     
 #############################################################
 # Notifications
 
 @APP.route('/notifications/get/v1', methods=['GET'])
 def notifications_flask():
-    # a dummy notification as to stop errors on front end
-    return dumps({
-        "notifications": ["none"]
-    })
+    token = request.args.get('token')
+    if token_active(token) == False:
+        raise AccessError
+    u_id = token_decode(token)
+    return dumps(
+        o.notification_v1(u_id)
+    )
 
 
+#############################################################
+# Activity stream
+
+@APP.route('/events/stream/v1', methods=['GET'])
+def events_stream():
+    token = request.args.get('token')
+    if token_active(token) == False:
+        raise AccessError
+    u_id = token_decode(token)
+    # Browsers send the Last-Event-ID header themselves when they reconnect
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id'))
+    return Response(
+        o.events_stream_v1(u_id, token, last_event_id),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
 #############################################################
 # OTHER ROUTES
 @APP.route('/clear/v1', methods=['DELETE'])
@@ -657,16 +732,18 @@ def clear_data():
 @APP.route('/search/v2', methods=['GET'])
 def search_messages():
     token = request.args.get('token')
-    if token_active(active_tokens, token) == False:
+    if token_active(token) == False:
         raise AccessError
     u_id = token_decode(token)
     str_query = request.args.get('query_str')
+    limit = int(request.args.get('limit', 50))
+    mode = request.args.get('mode', 'words')
 
     if len(str_query) > 1000:
         raise InputError
 
     return dumps(
-        o.search_v1(u_id, str_query)
+        o.search_v1(u_id, str_query, limit, mode)
     )
 
 #################################################################################
@@ -701,6 +778,28 @@ def standup_send():
         su.standup_send_v1(token, channel_id, message)
     )
 
+def stop_for_fork():
+    '''
+    Shares the store between the worker processes, then stops every thread
+    and closes the database, none of which can be carried over a fork
+    '''
+    store.share(config.lock_path)
+    scheduler.shutdown()
+    mail.shutdown()
+    su.shutdown()
+    passwords.shutdown()
+    store.shutdown()
+
+def start_worker():
+    '''
+    Opens the database again in a newly forked worker process
+    '''
+    store.use(config.storage_engine)
+    init_data()
+
 if __name__ == "__main__":
-    APP.debug = True
-    APP.run(port=config.port) # Do not edit this port
+    if config.server_processes > 1:
+        prefork.serve(APP, "localhost", config.port, config.server_processes, stop_for_fork, start_worker)
+    else:
+        APP.debug = True
+        APP.run(port=config.port) # Do not edit this port
@@ -0,0 +1,288 @@
+'''
+sessions.py
+
+The login sessions behind token_active.
+
+Every token handed out by login or register starts a session, kept in a
+dict from the token to the session so checking a token is one lookup. A
+session expires once it has not been used for config.session_idle_ttl
+seconds, or config.session_absolute_ttl seconds after it started,
+whichever comes first.
+
+Expiry is both lazy and periodic. A token is checked against both limits
+whenever it is used, and at most every config.session_sweep_interval
+seconds a sweep drops every expired session. The sweep is cheap because
+the sessions are also kept in two OrderedDicts, one in the order they were
+last used and one in the order they started, so the expired ones are
+always at the front and the sweep stops at the first live session. A user
+can have at most config.max_sessions_per_user sessions, past which their
+oldest one is ended, so memory stays bounded however often users log in.
+
+When config.persist_sessions is set, sessions are also kept in the
+"sessions" collection of the store, so they survive a restart. How
+recently a session was used is only written back once it has moved on by
+config.session_touch_interval seconds, so checking a token rarely writes.
+'''
+import threading
+import time
+from collections import OrderedDict
+from src import config
+import src.store as store
+import src.ids as ids
+import src.token_cache as token_cache
+
+_lock = threading.RLock()
+_built = False
+_last_sweep = 0
+# token -> session
+_sessions = {}
+# u_id -> {session_id: token}, oldest first
+_by_user = {}
+# session_id -> token
+_by_id = {}
+# token -> None, least recently used first
+_idle = OrderedDict()
+# token -> None, oldest first
+_started = OrderedDict()
+
+def start(token, u_id, session_id=None):
+    '''
+    Starts a session for a newly issued token
+
+    Arguments:
+    token (String)       - The token the user will send with each request
+    u_id (Integer)       - The user who logged in
+    session_id (Integer) - The id of the session, if one was reserved with
+                           next_session_id to build the token
+
+    Return Value:
+        Returns the session, {"session_id", "token", "u_id", "created", "last_seen"}
+    '''
+    with _lock:
+        _build()
+        _sweep()
+        if token in _sessions:
+            _end(token)
+        if session_id is None:
+            session_id = next_session_id()
+        now = time.time()
+        session = {
+            "session_id": session_id,
+            "token": token,
+            "u_id": u_id,
+            "created": now,
+            "last_seen": now,
+        }
+        _add(session)
+        if config.persist_sessions:
+            store.insert("sessions", session)
+
+        user_sessions = _by_user[u_id]
+        while len(user_sessions) > config.max_sessions_per_user:
+            _end(next(iter(user_sessions.values())))
+        return session
+
+def next_session_id():
+    '''
+    Reserves the id of a new session, for tokens that have to include it
+    '''
+    return ids.next_id("sessions")
+
+def is_active(token):
+    '''
+    Checks if a token belongs to a live session, and marks the session as used
+
+    Arguments:
+    token (String) - The token sent with a request
+
+    Return Value:
+        Returns True if the session exists and has not expired, False otherwise
+    '''
+    with _lock:
+        _build()
+        _sweep()
+        session = _sessions.get(token)
+        if session is None:
+            return False
+        now = time.time()
+        if _expired(session, now):
+            _end(token)
+            return False
+        _idle.move_to_end(token)
+        if config.persist_sessions and now - session["last_seen"] >= config.session_touch_interval:
+            store.update("sessions", session["session_id"], {"last_seen": now})
+        session["last_seen"] = now
+        return True
+
+def end(token):
+    '''
+    Ends the session of a token, eg on logout
+
+    Return Value:
+        Returns True if the token had a live session, False otherwise
+    '''
+    with _lock:
+        _build()
+        session = _sessions.get(token)
+        if session is None:
+            return False
+        live = not _expired(session, time.time())
+        _end(token)
+        return live
+
+def end_user(u_id):
+    '''
+    Ends every session of a user, eg once they have been removed from Dreams
+    '''
+    with _lock:
+        _build()
+        for token in list(_by_user.get(u_id, {}).values()):
+            _end(token)
+
+def user_sessions(u_id):
+    '''
+    Lists the live sessions of a user
+
+    Return Value:
+        Returns [{"session_id", "token", "u_id", "created", "last_seen"}, ...], oldest first
+    '''
+    with _lock:
+        _build()
+        now = time.time()
+        return [
+            dict(_sessions[token]) for token in _by_user.get(u_id, {}).values()
+            if not _expired(_sessions[token], now)
+        ]
+
+def sync_session(session_id):
+    '''
+    Brings a session held in memory up to date with the store, eg once
+    another server process has started it, used it or ended it
+
+    Arguments:
+    session_id (Integer) - The session
+
+    Return Value: None
+    '''
+    with _lock:
+        if not _built:
+            return
+        session = store.get("sessions", session_id)
+        token = _by_id.get(session_id)
+        if session is None:
+            if token is not None:
+                _forget(token)
+        elif token is None:
+            if session["token"] in _sessions:
+                # Started again under a new session_id
+                _forget(session["token"])
+            _add(dict(session))
+        elif session["last_seen"] > _sessions[token]["last_seen"]:
+            _sessions[token]["last_seen"] = session["last_seen"]
+            _idle.move_to_end(token)
+
+def count():
+    '''
+    Returns the number of sessions held, including expired ones not yet swept
+    '''
+    with _lock:
+        return len(_sessions)
+
+def reset():
+    '''
+    Forgets every session held in memory, so that they are loaded from the
+    store again the next time they are needed. Called whenever the data
+    store is cleared or reloaded
+    '''
+    global _built
+    with _lock:
+        _sessions.clear()
+        _by_user.clear()
+        _by_id.clear()
+        _idle.clear()
+        _started.clear()
+        _built = False
+
+############################## HELPER FUNCTIONS ###############################
+
+def _build():
+    '''
+    Loads the persisted sessions that have not expired, if they are not
+    loaded already. Must be called with _lock held
+    '''
+    global _built, _last_sweep
+    if _built:
+        return
+    _built = True
+    _last_sweep = time.time()
+    if config.persist_sessions:
+        now = time.time()
+        for session in sorted(store.scan("sessions"), key=lambda session: session["created"]):
+            if _expired(session, now):
+                store.delete("sessions", session["session_id"])
+            else:
+                _add(dict(session))
+
+def _add(session):
+    '''
+    Adds a session to the dict and the orderings
+    '''
+    token = session["token"]
+    _sessions[token] = session
+    _by_user.setdefault(session["u_id"], {})[session["session_id"]] = token
+    _by_id[session["session_id"]] = token
+    _idle[token] = None
+    _idle.move_to_end(token)
+    _started[token] = None
+
+def _end(token):
+    '''
+    Drops a session from memory and the store
+    '''
+    session = _forget(token)
+    if config.persist_sessions:
+        store.delete("sessions", session["session_id"])
+
+def _forget(token):
+    '''
+    Drops a session from memory, and its token from the token cache
+
+    Return Value:
+        Returns the session
+    '''
+    session = _sessions.pop(token)
+    del _by_id[session["session_id"]]
+    user_sessions = _by_user[session["u_id"]]
+    del user_sessions[session["session_id"]]
+    if not user_sessions:
+        del _by_user[session["u_id"]]
+    del _idle[token]
+    del _started[token]
+    token_cache.invalidate(token)
+    return session
+
+def _expired(session, now):
+    '''
+    Checks a session against the idle and absolute time to live
+    '''
+    return (
+        now - session["last_seen"] > config.session_idle_ttl or
+        now - session["created"] > config.session_absolute_ttl
+    )
+
+def _sweep():
+    '''
+    Ends every expired session, at most once every session_sweep_interval
+    seconds. Must be called with _lock held
+    '''
+    global _last_sweep
+    now = time.time()
+    if now - _last_sweep < config.session_sweep_interval:
+        return
+    _last_sweep = now
+    for order in (_idle, _started):
+        while order:
+            token = next(iter(order))
+            if not _expired(_sessions[token], now):
+                break
+            _end(token)
@@ -0,0 +1,444 @@
+'''
+sqlite_engine.py
+
+A storage engine that keeps the data store in a SQLite database at
+config.sqlite_path instead of in memory.
+
+Each collection is a table keyed by its id, with the record stored as a
+JSON body. The fields that are looked up by value (email and handle_str
+for users, and u_id, channel_id and dm_id for messages) are also kept in
+their own indexed columns, so point lookups never scan a table. The u_ids
+in the member fields of channels and dms (MEMBER_FIELDS) are also kept as
+rows of a members table, so membership tests are an index lookup, and
+each conversation field of messages (HISTORY_FIELDS) has an index ordered
+by removed and message_id, so a page of history is one range scan. The
+database runs in WAL mode, so every change is a small incremental write
+and readers in other connections are never blocked by a writer.
+
+Several server processes can share one database. Every commit also appends
+the key of the record it changed to a changes table, so a process can tell
+what the others have changed: PRAGMA data_version only moves when another
+connection commits, and then the rows of the changes table past the last
+one this connection read show which records it was. Only the newest
+config.change_log_size rows are kept.
+'''
+import json
+import os
+import sqlite3
+import threading
+from src import config
+from src.store import TABLE_KEYS, MEMBER_FIELDS, HISTORY_FIELDS
+from src.upgrade import upgrade
+
+# Fields kept in their own indexed column as well as in the JSON body
+INDEXED = {
+    "users": ("email", "handle_str"),
+    "channels": (),
+    "dms": (),
+    "messages": ("u_id", "channel_id", "dm_id", "removed", "position"),
+    "stats": (),
+    "notifications": (),
+    "sessions": ("u_id",),
+    "outbox": (),
+    "reset_codes": ("code", "u_id"),
+    "scheduled": ("u_id",),
+    "standups": (),
+    "standup_lines": ("channel_id",),
+    "sequences": (),
+}
+
+class SQLiteEngine:
+    # Other processes can open the same database
+    shareable = True
+
+    def __init__(self, path=None):
+        self.path = path or config.sqlite_path
+        is_new = not os.path.exists(self.path)
+        self._lock = threading.RLock()
+        self._closed = False
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+        if is_new:
+            self._import_snapshot()
+        with self._lock:
+            self._data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+            # The last row of the changes table this connection has read
+            self._last_change = self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+            # Rows past _last_change that this connection appended itself
+            self._own_changes = set()
+
+    ################################# READS ###################################
+
+    def get(self, table, key):
+        '''
+        Returns the record in table with the given key, or None
+        '''
+        return self._one(f"SELECT body FROM {table} WHERE {TABLE_KEYS[table]} = ?", (key,))
+
+    def scan(self, table):
+        '''
+        Returns every record in table, in key order
+        '''
+        return self._all(f"SELECT body FROM {table} ORDER BY {TABLE_KEYS[table]}")
+
+    def find(self, table, field, value):
+        '''
+        Returns the first record in table whose field equals value, or None
+        '''
+        if field in INDEXED[table] or field == TABLE_KEYS[table]:
+            return self._one(
+                f"SELECT body FROM {table} WHERE {field} = ? ORDER BY {TABLE_KEYS[table]} LIMIT 1",
+                (value,)
+            )
+        for record in self.scan(table):
+            if record.get(field) == value:
+                return record
+        return None
+
+    def find_all(self, table, field, value):
+        '''
+        Returns every record in table whose field equals value
+        '''
+        if field in INDEXED[table] or field == TABLE_KEYS[table]:
+            return self._all(
+                f"SELECT body FROM {table} WHERE {field} = ? ORDER BY {TABLE_KEYS[table]}",
+                (value,)
+            )
+        return [record for record in self.scan(table) if record.get(field) == value]
+
+    def contains(self, table, key, field, u_id):
+        '''
+        Checks if u_id is in a member field of the record with the given key
+        '''
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM members WHERE tbl = ? AND id = ? AND field = ? AND u_id = ?",
+                (table, key, field, u_id)
+            ).fetchone()
+        return row is not None
+
+    def first(self, table):
+        '''
+        Returns the record with the smallest key in table, or None if it is empty
+        '''
+        return self._one(f"SELECT body FROM {table} ORDER BY {TABLE_KEYS[table]} LIMIT 1")
+
+    def count(self, table):
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def max_key(self, table):
+        '''
+        Returns the largest key in table, or None if it is empty
+        '''
+        with self._lock:
+            return self._db.execute(f"SELECT MAX({TABLE_KEYS[table]}) FROM {table}").fetchone()[0]
+
+    def history(self, field, key, limit, before=None, after=None, offset=0):
+        '''
+        Returns a page of the live messages of a channel or dm, newest first
+        '''
+        # The position of the message a cursor names, or the cursor itself
+        # if there is no such message
+        cursor = "COALESCE((SELECT position FROM messages WHERE message_id = ?), ?)"
+        conditions = [f"{field} = ?", "removed = 0"]
+        params = [key]
+        if before is not None:
+            conditions.append(f"position < {cursor}")
+            params += [before, before]
+        if after is not None:
+            conditions.append(f"position > {cursor}")
+            params += [after, after]
+        query = f"SELECT body FROM messages WHERE {' AND '.join(conditions)}"
+        if after is not None:
+            return self._all(f"{query} ORDER BY position LIMIT ?", params + [limit])[::-1]
+        return self._all(f"{query} ORDER BY position DESC LIMIT ? OFFSET ?", params + [limit, offset])
+
+    def history_count(self, field, key):
+        '''
+        Returns the number of live messages of a channel or dm
+        '''
+        with self._lock:
+            return self._db.execute(
+                f"SELECT COUNT(*) FROM messages WHERE {field} = ? AND removed = 0", (key,)
+            ).fetchone()[0]
+
+    ############################### MUTATIONS #################################
+
+    def commit(self, entry):
+        '''
+        Applies a change record made by one of the mutations in store.py as
+        one transaction
+        '''
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self.apply(entry)
+                seqs = self._log_change(entry)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            for seq in seqs:
+                self._saw_change(seq)
+
+    def increment(self, table, key, field, amount, initial, fields=None, series=None):
+        '''
+        Adds amount to a field of a record, sets any other fields given and
+        appends to a series, inserting initial first if there is no such
+        record, and returns the new value. The read and the write
+        are one IMMEDIATE transaction, so other processes using the same
+        database wait for it
+        '''
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                record = self.get(table, key) or initial
+                record = dict(record, **(fields or {}))
+                record[field] += amount
+                if series is not None:
+                    series_field, size, time_stamp = series
+                    record[series_field] = (record.get(series_field, []) + [[record[field], time_stamp]])[-size:]
+                self._put(table, record)
+                seqs = self._log_change({"op": "update", "table": table, "key": key})
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            for seq in seqs:
+                self._saw_change(seq)
+        return record[field]
+
+    def clear(self):
+        self.commit({"op": "clear"})
+
+    def apply(self, entry):
+        '''
+        Applies a change record to the database. Must be called inside a transaction
+        '''
+        op = entry["op"]
+        if op == "clear":
+            for table in TABLE_KEYS:
+                self._db.execute(f"DELETE FROM {table}")
+            self._db.execute("DELETE FROM members")
+            return
+
+        table = entry["table"]
+        if op == "insert":
+            self._put(table, entry["value"])
+            return
+        if op in ("delete", "delete_many"):
+            keys = entry["keys"] if op == "delete_many" else [entry["key"]]
+            self._db.executemany(f"DELETE FROM {table} WHERE {TABLE_KEYS[table]} = ?", [(key,) for key in keys])
+            self._db.executemany("DELETE FROM members WHERE tbl = ? AND id = ?", [(table, key) for key in keys])
+            return
+
+        record = self.get(table, entry["key"])
+        if record is None:
+            return
+        if op == "update":
+            record.update(entry["fields"])
+        elif op == "append":
+            if entry["value"] not in record[entry["field"]]:
+                record[entry["field"]].append(entry["value"])
+        elif op == "remove":
+            if entry["value"] in record[entry["field"]]:
+                record[entry["field"]].remove(entry["value"])
+        self._put(table, record)
+
+    def changes(self):
+        '''
+        Returns the records other connections have committed changes to since
+        the last call, or since the database was opened, as a dict from each
+        collection changed to the set of keys changed in it. The keys are
+        None when they are no longer known, as the rows reaching back that
+        far have been dropped or another connection cleared the store
+        '''
+        with self._lock:
+            data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return {}
+            self._data_version = data_version
+            rows = self._db.execute(
+                "SELECT seq, tbl, id FROM changes WHERE seq > ? ORDER BY seq", (self._last_change,)
+            ).fetchall()
+            if not rows:
+                return {}
+            changed = {}
+            if rows[0][0] != self._last_change + 1:
+                changed = dict.fromkeys(TABLE_KEYS)
+            for seq, table, key in rows:
+                if seq in self._own_changes:
+                    continue
+                if table is None:
+                    changed = dict.fromkeys(TABLE_KEYS)
+                elif changed.get(table, ()) is not None:
+                    changed.setdefault(table, set()).add(key)
+            self._last_change = rows[-1][0]
+            self._own_changes = {seq for seq in self._own_changes if seq > self._last_change}
+        return changed
+
+    ############################## PERSISTENCE ################################
+
+    def load(self):
+        '''
+        The database is always current, so there is nothing to replay
+        '''
+        return 0
+
+    def export(self):
+        '''
+        Returns the whole data store as one image, in the data.json format
+        '''
+        return {table: self.scan(table) for table in TABLE_KEYS}
+
+    def flush(self):
+        '''
+        Every change is committed as it is made, so this only checkpoints the
+        WAL into the main database file
+        '''
+        with self._lock:
+            self._db.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        return 0
+
+    def snapshot(self):
+        with self._lock:
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def shutdown(self):
+        '''
+        Checkpoints the WAL and closes the database. Safe to call more than once
+        '''
+        with self._lock:
+            if self._closed:
+                return
+            self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._db.close()
+            self._closed = True
+
+    ############################ HELPER FUNCTIONS #############################
+
+    def _create_tables(self):
+        '''
+        Creates a table for each collection, with indexes on its looked up fields
+        '''
+        with self._lock:
+            for table, key_field in TABLE_KEYS.items():
+                columns = "".join(f", {field}" for field in INDEXED[table])
+                self._db.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table} "
+                    f"({key_field} INTEGER PRIMARY KEY{columns}, body TEXT NOT NULL)"
+                )
+                if table == "messages":
+                    self._add_position_column()
+                for field in INDEXED[table]:
+                    self._db.execute(
+                        f"CREATE INDEX IF NOT EXISTS {table}_{field} ON {table} ({field})"
+                    )
+            for field in HISTORY_FIELDS:
+                self._db.execute(f"DROP INDEX IF EXISTS messages_{field}_history")
+                self._db.execute(
+                    f"CREATE INDEX IF NOT EXISTS messages_{field}_by_position "
+                    f"ON messages ({field}, removed, position)"
+                )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS members "
+                "(tbl TEXT, id INTEGER, field TEXT, u_id INTEGER, PRIMARY KEY (tbl, id, field, u_id))"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS changes "
+                "(seq INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT, id INTEGER)"
+            )
+
+    def _add_position_column(self):
+        '''
+        Adds the position column to a database made before messages had one,
+        when every message was placed by its message_id
+        '''
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(messages)")]
+        if "position" not in columns:
+            self._db.execute("ALTER TABLE messages ADD COLUMN position")
+            self._db.execute("UPDATE messages SET position = message_id")
+
+    def _import_snapshot(self):
+        '''
+        Seeds a brand new database from the JSON snapshot, if there is one
+        '''
+        if not os.path.exists(config.data_path):
+            return
+        with open(config.data_path) as f:
+            data = upgrade(json.load(f))
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            for table in TABLE_KEYS:
+                for record in data.get(table, []):
+                    self._put(table, record)
+            self._db.execute("COMMIT")
+
+    def _put(self, table, record):
+        '''
+        Inserts or replaces a record, keeping its indexed columns in step with its body
+        '''
+        fields = (TABLE_KEYS[table],) + INDEXED[table]
+        placeholders = ", ".join("?" for _ in range(len(fields) + 1))
+        self._db.execute(
+            f"INSERT OR REPLACE INTO {table} ({', '.join(fields)}, body) VALUES ({placeholders})",
+            tuple(record.get(field) for field in fields) + (json.dumps(record),)
+        )
+        if table in MEMBER_FIELDS:
+            key = record[TABLE_KEYS[table]]
+            self._db.execute("DELETE FROM members WHERE tbl = ? AND id = ?", (table, key))
+            self._db.executemany(
+                "INSERT OR IGNORE INTO members (tbl, id, field, u_id) VALUES (?, ?, ?, ?)",
+                [(table, key, field, u_id) for field in MEMBER_FIELDS[table] for u_id in record.get(field, ())]
+            )
+
+    def _log_change(self, entry):
+        '''
+        Appends each record a change record changes to the changes table, a
+        clear being logged with no table, and drops the rows that are more
+        than config.change_log_size old every config.change_log_size rows.
+        Must be called inside the transaction that made the change
+
+        Return Value:
+            Returns the seqs of the new rows
+        '''
+        if entry["op"] == "clear":
+            table, keys = None, [None]
+        elif entry["op"] == "insert":
+            table, keys = entry["table"], [entry["value"][TABLE_KEYS[entry["table"]]]]
+        elif entry["op"] == "delete_many":
+            table, keys = entry["table"], entry["keys"]
+        else:
+            table, keys = entry["table"], [entry["key"]]
+        seqs = []
+        for key in keys:
+            seq = self._db.execute("INSERT INTO changes (tbl, id) VALUES (?, ?)", (table, key)).lastrowid
+            if seq % config.change_log_size == 0:
+                self._db.execute("DELETE FROM changes WHERE seq <= ?", (seq - config.change_log_size,))
+            seqs.append(seq)
+        return seqs
+
+    def _saw_change(self, seq):
+        '''
+        Counts a change this connection committed as read, so changes() only
+        reports those of other connections
+        '''
+        if seq == self._last_change + 1:
+            self._last_change = seq
+        else:
+            # Another connection committed in between, which changes() has
+            # still to report
+            self._own_changes.add(seq)
+
+    def _one(self, query, params=()):
+        with self._lock:
+            row = self._db.execute(query, params).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _all(self, query, params=()):
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [json.loads(row[0]) for row in rows]
@@ -4,20 +4,42 @@ standup.py
 standup_start_v1
 standup_active_v1
 standup_send_v1
+
+Every active standup is kept in _standups by channel_id, with its own lock
+and the lines sent to it so far, so sends to different standups never wait
+on each other. The lines are joined into one message once, when the
+standup finishes. One TimerWheel (timer_wheel.py) finishes every standup,
+at most config.standup_tick seconds after its time_finish, however many
+are running.
+
+Active standups are kept in the "standups" collection of the store and
+their lines in "standup_lines", so a standup running when the server stops
+carries on once it is back, or finishes straight away if its time has
+passed.
+
+Starting, sending to and finishing a standup each hold the channel with
+store.conversation, so when the server runs as several processes each of
+them sees the standups and lines the others have stored before it acts on
+one, and a standup is finished by whichever process's timer fires first.
 '''
 import threading
-import src.data as d
+import time
+from bisect import bisect_left, insort
+from src import config
+import src.store as store
+import src.ids as ids
 from src.helper import  token_decode, \
                         get_user, user_exists, \
                         get_channel, channel_exists, is_member
 from src.error import AccessError, InputError
-from src.message import message_send_v1
-from datetime import datetime
-import time
+from src.message import post_message
+from src.timer_wheel import TimerWheel
 
-SU_TIME     = {}
-SU_MESSAGES = {} 
-SU_ACTIVE   = {}
+_lock = threading.Lock()
+_built = False
+# channel_id -> {"u_id", "time_finish", "lines", "size", "lock", "finished"}
+_standups = {}
+_wheel = None
 
 def standup_start_v1(token, channel_id, length):
     '''
@@ -51,28 +73,23 @@ def standup_start_v1(token, channel_id, length):
     if channel_exists(channel_id) is False:
         raise InputError(description="Error: Channel does not exist")
 
-    # Check if a standup is currently running in this channel
-    is_active = standup_active_v1(token, channel_id)['is_active']
-    if is_active is True:
-        raise InputError(description='''Error: An active standup is
-                            currently running in this channel''')
-    
     # Check if length is valid
     if (length < 1):
         raise InputError(description="Error: Standup must be at least 1 second")
-    
-    '''now = datetime.now()
-    time_start = int(now.replace().timestamp())
-    time_finish = time_start + length'''
+
+    u_id = token_decode(token)
     time_finish = int(time.time()) + length
 
-    global SU_TIME, SU_ACTIVE, SU_MESSAGES
-    SU_TIME[channel_id] = time_finish
-    SU_ACTIVE[channel_id] = True
-    SU_MESSAGES[channel_id] = []
+    with store.conversation("channel_id", channel_id), _lock:
+        _build()
+        # Check if a standup is currently running in this channel
+        if channel_id in _standups:
+            raise InputError(description='''Error: An active standup is
+                            currently running in this channel''')
 
-    timer = threading.Timer(length, standup_message, kwargs={'token': token, 'channel_id': channel_id})
-    timer.start()
+        standup = {"channel_id": channel_id, "u_id": u_id, "time_finish": time_finish}
+        store.insert("standups", standup)
+        _add(standup, [])
 
     return {
         'time_finish': time_finish
@@ -108,13 +125,13 @@ def standup_active_v1(token, channel_id):
         raise InputError(description="Error: Channel does not exist")
 
     # Check if there is an active standup
-    global SU_ACTIVE, SU_TIME
-    is_active = SU_ACTIVE.get(channel_id, False)
-    time_finish = SU_TIME.get(channel_id, None)
+    with _lock:
+        _build()
+        standup = _standups.get(channel_id)
 
     return {
-        'is_active': is_active,
-        'time_finish': time_finish
+        'is_active': standup is not None,
+        'time_finish': standup["time_finish"] if standup is not None else None
     }
 
 def standup_send_v1(token, channel_id, message):
@@ -138,6 +155,8 @@ def standup_send_v1(token, channel_id, message):
                             the username and colon)
                         3. An active standup is not currently running in 
                             this channel
+                        4. The standup already holds config.standup_max_buffer
+                            characters
 
     Return Value:
         {}
@@ -159,39 +178,174 @@ def standup_send_v1(token, channel_id, message):
         raise InputError(description="Error: Message is too long! Message should \
             be shorter than 1000 characters")
 
-    # Check if a standup is currently running in this channel
-    is_active = standup_active_v1(token, channel_id)['is_active']
-    if is_active is False:
-        raise InputError(description="Error: An active standup is not currently \
-            running in this channel")
+    with store.conversation("channel_id", channel_id):
+        with _lock:
+            _build()
+            standup = _standups.get(channel_id)
+        # Check if a standup is currently running in this channel
+        if standup is None:
+            raise InputError(description="Error: An active standup is not currently \
+                running in this channel")
+
+        # Buffer message
+        u_handle = get_user(u_id)['handle_str']
+        msg_data = f"{u_handle}: {message}"
+        with standup["lock"]:
+            if standup["finished"]:
+                raise InputError(description="Error: An active standup is not currently \
+                    running in this channel")
+            if standup["size"] + len(msg_data) + 1 > config.standup_max_buffer:
+                raise InputError(description="Error: The standup has no room for more messages")
+            line_id = ids.next_id("standup_lines")
+            store.insert("standup_lines", {"line_id": line_id, "channel_id": channel_id, "line": msg_data})
+            # Kept in line_id order, as lines other server processes send
+            # are added by sync_line
+            insort(standup["lines"], (line_id, msg_data))
+            standup["size"] += len(msg_data) + 1
+
+    return {}
+
+def reset():
+    '''
+    Reads the active standups from the store again. Called whenever the
+    data store is cleared or reloaded, so standups running before a restart
+    carry on
+    '''
+    global _built
+    with _lock:
+        _built = False
+        _standups.clear()
+        if _wheel is not None:
+            _wheel.clear()
+        _build()
+
+def sync_standup(channel_id):
+    '''
+    Brings a standup up to date with the store, eg once another server
+    process has started or finished it
+
+    Arguments:
+    channel_id (Integer) - The channel of the standup
 
-    # Send message
-    global SU_MESSAGES
-    u_handle = get_user(u_id)['handle_str']
-    msg_data = f"{u_handle}: {message}"
-    for c_id in SU_MESSAGES:
-        if channel_id == c_id: 
-            SU_MESSAGES[channel_id].append(msg_data)
+    Return Value: None
+    '''
+    with _lock:
+        if not _built:
+            return
+        record = store.get("standups", channel_id)
+        if record is None:
+            standup = _standups.pop(channel_id, None)
+            if standup is not None:
+                with standup["lock"]:
+                    standup["finished"] = True
+        elif channel_id not in _standups:
+            lines = store.find_all("standup_lines", "channel_id", channel_id)
+            _add(record, sorted((line["line_id"], line["line"]) for line in lines))
+
+def sync_line(line_id):
+    '''
+    Adds a line another server process has sent to a standup. Lines are only
+    deleted along with their standup, which sync_standup sees to
 
-################################# HELPER FUNCTIONS ###################################
+    Arguments:
+    line_id (Integer) - The line
 
-def standup_message(token, channel_id):
+    Return Value: None
     '''
-    < To send the buffered message from standup as a single message, and update
-        standup to inactive >
+    line = store.get("standup_lines", line_id)
+    if line is None:
+        return
+    with _lock:
+        standup = _standups.get(line["channel_id"]) if _built else None
+    if standup is None:
+        return
+    entry = (line_id, line["line"])
+    with standup["lock"]:
+        lines = standup["lines"]
+        i = bisect_left(lines, entry)
+        if i == len(lines) or lines[i] != entry:
+            lines.insert(i, entry)
+            standup["size"] += len(entry[1]) + 1
+
+def shutdown():
+    '''
+    Stops the timer wheel's thread. Standups carry on once it starts again
     '''
+    if _wheel is not None:
+        _wheel.shutdown()
 
-    global SU_ACTIVE, SU_TIME, SU_MESSAGES
-    
-    # Concatinate the message into a one single string 
-    str_send = ""
-    for string in SU_MESSAGES[channel_id]:
-        str_send += string 
-        str_send += '\n'
+def wait_until_finished(timeout=None):
+    '''
+    Waits until every standup whose time has come has been finished
 
-    SU_MESSAGES[channel_id] = []
-    SU_ACTIVE[channel_id] = False
-    SU_TIME[channel_id] = None
+    Return Value:
+        Returns True if none are waiting, False if timeout ran out first
+    '''
+    return _timers().wait_until_idle(timeout)
 
-    u_id = token_decode(token)
-    message_send_v1(u_id, channel_id, str(str_send))
+################################# HELPER FUNCTIONS ###################################
+
+def _timers():
+    '''
+    Returns the wheel that finishes standups, creating it the first time
+    '''
+    global _wheel
+    if _wheel is None:
+        _wheel = TimerWheel(standup_message, config.standup_tick, config.standup_wheel_slots, name="standups")
+    return _wheel
+
+def _build():
+    '''
+    Reads the active standups from the store the first time they are needed.
+    Must be called with _lock held
+    '''
+    global _built
+    if _built:
+        return
+    _built = True
+    lines = {}
+    for line in store.scan("standup_lines"):
+        lines.setdefault(line["channel_id"], []).append((line["line_id"], line["line"]))
+    for standup in store.scan("standups"):
+        _add(standup, sorted(lines.get(standup["channel_id"], [])))
+
+def _add(standup, lines):
+    '''
+    Makes a standup active and sets its timer. Must be called with _lock held
+    '''
+    _standups[standup["channel_id"]] = {
+        "u_id": standup["u_id"],
+        "time_finish": standup["time_finish"],
+        "lines": lines,
+        "size": sum(len(line) + 1 for _, line in lines),
+        "lock": threading.Lock(),
+        "finished": False,
+    }
+    _timers().add(standup["channel_id"], standup["time_finish"])
+
+@store.per_conversation(lambda channel_id: ("channel_id", channel_id))
+def standup_message(channel_id):
+    '''
+    < To send the buffered message from standup as a single message, and update
+        standup to inactive >
+    '''
+    with _lock:
+        standup = _standups.pop(channel_id, None)
+    if standup is None or store.get("standups", channel_id) is None:
+        # Already finished, maybe by another server process
+        return
+
+    with standup["lock"]:
+        standup["finished"] = True
+        lines = standup["lines"]
+
+    # Join the messages into one single string, once
+    str_send = "".join(f"{line}\n" for _, line in lines)
+
+    store.delete("standups", channel_id)
+    store.delete_many("standup_lines", [line_id for line_id, _ in lines])
+
+    # The standup is dropped if whoever started it has since left
+    u_id = standup["u_id"]
+    if is_member(u_id, channel_id):
+        post_message(u_id, "channel_id", channel_id, str_send, ids.next_id("messages"), time.time())
@@ -0,0 +1,184 @@
+'''
+stats.py
+
+Running counters behind user_stats_v1 and users_stats_v1.
+
+Every user has a record in the "stats" collection, keyed by their u_id,
+holding the current value of each of their metrics, and Dreams as a whole
+has one more record keyed by DREAMS. The modules call update_user and
+update_dreams as channels, dms and messages come and go, so reading the
+statistics never has to count anything.
+
+Each metric is a field of its record, with the time it last changed in
+the field named by _stamp and its newest config.stats_history_size values,
+each with its time stamp, in the field named by _series. That series is
+what the stats endpoints return as each metric's history, so reading it
+never grows with how much has happened. A change is one store.increment,
+which sets all three and which no other writer, in this process or
+another, can come between, so sends to different channels and dms never
+wait on a lock of their own here.
+'''
+import time
+from src import config
+import src.store as store
+
+# stats_id of the Dreams wide statistics
+DREAMS = -1
+
+# Each metric and the name of its value in the stats responses
+USER_METRICS = {
+    "channels_joined": "num_channels_joined",
+    "dms_joined": "num_dms_joined",
+    "messages_sent": "num_messages_sent",
+}
+DREAMS_METRICS = {
+    "channels_exist": "num_channels_exist",
+    "dms_exist": "num_dms_exist",
+    "messages_exist": "num_messages_exist",
+}
+
+def init_user(u_id):
+    '''
+    Creates the statistics of a newly registered user, starting every metric
+    at zero, and the Dreams statistics if this is the first user
+
+    Arguments:
+    u_id (Integer) - The new user
+
+    Return Value: None
+    '''
+    store.insert("stats", _initial(u_id, USER_METRICS, time.time()))
+    if store.get("stats", DREAMS) is None:
+        # Inserted at most once, however many users register at the same time
+        store.increment("stats", DREAMS, "channels_exist", 0, _initial(DREAMS, DREAMS_METRICS, time.time()))
+
+def update_user(u_id, metric, change):
+    '''
+    Adds change to one of a user's metrics
+
+    Arguments:
+    u_id (Integer)   - The user
+    metric (String)  - One of USER_METRICS, eg "channels_joined"
+    change (Integer) - The amount to add, eg 1 or -1
+
+    Return Value: None
+    '''
+    _update(u_id, USER_METRICS, metric, change)
+
+def update_dreams(metric, change):
+    '''
+    Adds change to one of the Dreams wide metrics
+
+    Arguments:
+    metric (String)  - One of DREAMS_METRICS, eg "messages_exist"
+    change (Integer) - The amount to add, eg 1 or -1
+
+    Return Value: None
+    '''
+    _update(DREAMS, DREAMS_METRICS, metric, change)
+
+def user_stats(u_id):
+    '''
+    Returns the current statistics of a user, and the history of each
+
+    Return Value:
+        Returns {
+            "channels_joined": {"num_channels_joined": Integer, "time_stamp": Float},
+            "dms_joined": {"num_dms_joined": Integer, "time_stamp": Float},
+            "messages_sent": {"num_messages_sent": Integer, "time_stamp": Float},
+            "history": {
+                "channels_joined": [{"num_channels_joined": Integer, "time_stamp": Float}, ...],
+                ...
+            },
+        }, each history oldest first
+    '''
+    return _current(u_id, USER_METRICS)
+
+def dreams_stats():
+    '''
+    Returns the current Dreams wide statistics, and the history of each
+
+    Return Value:
+        Returns {
+            "channels_exist": {"num_channels_exist": Integer, "time_stamp": Float},
+            "dms_exist": {"num_dms_exist": Integer, "time_stamp": Float},
+            "messages_exist": {"num_messages_exist": Integer, "time_stamp": Float},
+            "history": {
+                "channels_exist": [{"num_channels_exist": Integer, "time_stamp": Float}, ...],
+                ...
+            },
+        }, each history oldest first
+    '''
+    return _current(DREAMS, DREAMS_METRICS)
+
+def counted(stats_id, counts):
+    '''
+    Returns a stats record holding counts made some other way, eg by
+    upgrade.py for data from before there were statistics
+
+    Arguments:
+    stats_id (Integer)  - A u_id, or DREAMS
+    counts (Dictionary) - Every metric of the record and its value
+
+    Return Value:
+        Returns the record, to be inserted into the "stats" collection
+    '''
+    time_stamp = time.time()
+    record = _initial(stats_id, counts, time_stamp)
+    for metric, value in counts.items():
+        record[metric] = value
+        record[_series(metric)] = [[value, time_stamp]]
+    return record
+
+############################## HELPER FUNCTIONS ###############################
+
+def _stamp(metric):
+    '''
+    Returns the field holding the time a metric last changed
+    '''
+    return f"{metric}_time_stamp"
+
+def _series(metric):
+    '''
+    Returns the field holding the newest values of a metric, as
+    [[value, time stamp], ...] oldest first
+    '''
+    return f"{metric}_history"
+
+def _initial(stats_id, metrics, time_stamp):
+    '''
+    Returns a stats record with every metric at zero
+    '''
+    record = {"stats_id": stats_id}
+    for metric in metrics:
+        record[metric] = 0
+        record[_stamp(metric)] = time_stamp
+        record[_series(metric)] = [[0, time_stamp]]
+    return record
+
+def _update(stats_id, metrics, metric, change):
+    '''
+    Adds change to a metric, creating the stats record first if there is none
+    '''
+    time_stamp = time.time()
+    store.increment(
+        "stats", stats_id, metric, change, _initial(stats_id, metrics, time_stamp),
+        {_stamp(metric): time_stamp}, (_series(metric), config.stats_history_size, time_stamp)
+    )
+
+def _current(stats_id, metrics):
+    '''
+    Formats the current value and the history of every metric of a stats record
+    '''
+    record = store.get("stats", stats_id)
+    time_stamp = time.time()
+    stats = {"history": {}}
+    for metric, name in metrics.items():
+        if record is None:
+            stats[metric] = {name: 0, "time_stamp": time_stamp}
+            series = [[0, time_stamp]]
+        else:
+            stats[metric] = {name: record[metric], "time_stamp": record[_stamp(metric)]}
+            series = record.get(_series(metric), [])
+        stats["history"][metric] = [{name: value, "time_stamp": stamp} for value, stamp in series]
+    return stats
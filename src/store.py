@@ -0,0 +1,633 @@
+'''
+store.py
+
+The storage layer behind the data store. Every module reads and changes
+users, channels, dms and messages through the functions in this file, which
+hand the work to the storage engine selected by config.storage_engine:
+
+    "json"   - JSONEngine (json_engine.py), the data store held in memory
+               in d.data and persisted as src/data.json plus a change log
+    "sqlite" - SQLiteEngine (sqlite_engine.py), the data store held in an
+               indexed SQLite database in WAL mode
+
+Records returned by the read functions must be treated as read only. Every
+change goes through one of the mutations (insert, update, append, remove,
+delete, clear), which each describe the change as one small record that the engine
+applies and persists.
+
+Each mutation is atomic on its own, but most operations read the store and
+then change it, eg by checking membership first, so they are serialized
+with the locks below. Operations that only touch one channel or dm, like
+sending, reacting to, pinning or editing a message, run under
+conversation(), which holds the reader-writer lock shared plus one of
+config.lock_stripes locks picked by the channel or dm. Operations on
+different channels or dms then run at once, and only those on the same
+one, or whose ids share a stripe, wait for each other. Operations that
+reach across channels, dms and users, like removing a user, run under
+writing(), usually through the @atomic decorator, with nothing else part
+way through. Requests that only read run under reading(), any number at
+once, and see no writing() operation part way through.
+
+When the server runs as several processes over one SQLite database, share()
+backs every one of these locks with a byte of a lock file, so they exclude
+the threads of every process alike. Each process still holds some of the
+store in memory, eg the search index or the heap of scheduled messages, so
+whenever a process takes a lock that no thread of it already holds it
+calls sync(), which asks the engine which records other processes have
+changed since and tells the listeners registered with on_change, which
+bring what they hold of those records up to date.
+'''
+import atexit
+import functools
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from src import config
+from src.rwlock import RWLock
+from src.file_lock import FileLock, FileRLock
+
+# The field that identifies a record in each collection
+TABLE_KEYS = {
+    "users": "u_id",
+    "channels": "channel_id",
+    "dms": "dm_id",
+    "messages": "message_id",
+    "stats": "stats_id",
+    "notifications": "u_id",
+    "sessions": "session_id",
+    "outbox": "mail_id",
+    "reset_codes": "code_id",
+    "scheduled": "message_id",
+    "standups": "channel_id",
+    "standup_lines": "line_id",
+    "sequences": "sequence_id",
+}
+
+# List fields holding the u_ids of members, which the engines also index as
+# sets so that membership tests never scan the list
+MEMBER_FIELDS = {
+    "channels": ("all_members", "owner_members"),
+    "dms": ("members",),
+}
+
+# Fields whose values are unique within their collection, which the engines
+# index so that looking a record up by one with find() never scans
+UNIQUE_FIELDS = {
+    "users": ("email", "handle_str"),
+    "reset_codes": ("code",),
+}
+
+# Fields of a message naming the conversation it was sent to. The engines
+# keep the live messages of each conversation ordered by position(), which
+# is what history() pages through
+HISTORY_FIELDS = ("channel_id", "dm_id")
+
+_engine = None
+_lock = RWLock()
+_stripes = [threading.RLock() for _ in range(config.lock_stripes)]
+_shared = False
+_held = threading.local()
+_sync_lock = threading.Lock()
+_syncer_pid = None
+_listeners = []
+_lock_path = None
+# name -> the lock exclusive(name) returns
+_exclusive = {}
+_exclusive_lock = threading.Lock()
+
+def engine():
+    '''
+    Returns the active storage engine, creating the one named in
+    config.storage_engine the first time it is needed
+    '''
+    global _engine
+    if _engine is None:
+        _engine = make_engine(config.storage_engine)
+    return _engine
+
+def make_engine(name):
+    '''
+    Creates a storage engine
+
+    Arguments:
+    name (String) - "json" or "sqlite"
+
+    Exceptions:
+        ValueError - When name is not a known engine
+
+    Return Value:
+        Returns the new engine
+    '''
+    if name == "json":
+        from src.json_engine import JSONEngine
+        return JSONEngine()
+    if name == "sqlite":
+        from src.sqlite_engine import SQLiteEngine
+        return SQLiteEngine()
+    raise ValueError(f"Unknown storage engine {name}")
+
+def use(name):
+    '''
+    Shuts down the active engine and switches to another one
+
+    Arguments:
+    name (String) - "json" or "sqlite"
+
+    Return Value:
+        Returns the new engine
+    '''
+    global _engine
+    if _engine is not None:
+        _engine.shutdown()
+    _engine = make_engine(name)
+    return _engine
+
+################################ CONCURRENCY ##################################
+
+@contextmanager
+def reading():
+    '''
+    Holds the store for reading, so that no operation under writing() runs
+    until the block ends. Any number of threads can read at once
+    '''
+    _lock.acquire_read()
+    try:
+        with _synced():
+            yield
+    finally:
+        _lock.release_read()
+
+@contextmanager
+def writing():
+    '''
+    Holds the store for writing, so that the block runs on its own, with no
+    other writer or reader part way through. Reentrant, so an operation can
+    call other operations that also write
+    '''
+    _lock.acquire_write()
+    try:
+        with _synced():
+            yield
+    finally:
+        _lock.release_write()
+
+def atomic(function):
+    '''
+    Decorates an operation that changes the store so that it runs under
+    writing()
+    '''
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with writing():
+            return function(*args, **kwargs)
+    return wrapper
+
+@contextmanager
+def conversation(field, key):
+    '''
+    Holds one channel or dm, so that the block runs with no other
+    conversation() operation on the same channel or dm, and no writing()
+    operation, part way through. Reentrant, and can be taken inside
+    writing()
+
+    Arguments:
+    field (String) - "channel_id" or "dm_id"
+    key (Integer)  - The id of the channel or dm
+    '''
+    # Channels and dms take turns through the stripes, so consecutive ids
+    # never share one
+    stripe = _stripes[(2 * key + (field == "dm_id")) % len(_stripes)]
+    _lock.acquire_read()
+    try:
+        with stripe:
+            with _synced():
+                yield
+    finally:
+        _lock.release_read()
+
+def per_conversation(locate):
+    '''
+    Decorates an operation that only changes one channel or dm so that it
+    runs under conversation()
+
+    Arguments:
+    locate (Function) - Called with the operation's arguments, returns the
+                        (field, key) of the channel or dm it changes, or
+                        None when that isn't known, eg the message doesn't
+                        exist, in which case it runs under writing()
+    '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            where = locate(*args, **kwargs)
+            if where is None:
+                with writing():
+                    return function(*args, **kwargs)
+            with conversation(*where):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def exclusive(name):
+    '''
+    Returns a reentrant lock held by one thread at a time, for changes that
+    read a record and write it back outside any one conversation, eg adding
+    to a user's notifications. It excludes the threads of other server
+    processes too once the store is shared
+
+    Arguments:
+    name (String) - The name of the lock, the same in every process, eg "notifications:3"
+
+    Return Value:
+        Returns the lock
+    '''
+    with _exclusive_lock:
+        lock = _exclusive.get(name)
+        if lock is None:
+            if _shared:
+                # Past the bytes of the reader-writer lock and the stripes
+                offset = 1 + config.lock_stripes + zlib.crc32(name.encode()) % 256
+                lock = FileRLock(_lock_path, offset)
+            else:
+                lock = threading.RLock()
+            _exclusive[name] = lock
+        return lock
+
+def share(lock_path):
+    '''
+    Shares the store with other server processes using the same database.
+    Every lock is backed by a byte of the file at lock_path from then on,
+    and sync() picks up what the other processes change. Called before the
+    server forks its worker processes
+
+    Arguments:
+    lock_path (String) - The lock file every process uses
+
+    Exceptions:
+        ValueError - When the engine keeps the data store in the memory of
+                     one process, which the others can't see
+
+    Return Value: None
+    '''
+    global _lock, _stripes, _shared, _lock_path, _exclusive
+    if not engine().shareable:
+        raise ValueError(f"The {config.storage_engine} engine can't be shared between processes")
+    _lock = RWLock(FileLock(lock_path, 0))
+    _stripes = [FileRLock(lock_path, 1 + stripe) for stripe in range(config.lock_stripes)]
+    _lock_path = lock_path
+    _exclusive = {}
+    _shared = True
+
+def shared():
+    '''
+    Checks if the store is shared with other server processes
+    '''
+    return _shared
+
+def on_change(listener):
+    '''
+    Registers a function to be told when sync() finds that other server
+    processes have changed the store
+
+    Arguments:
+    listener (Function) - Called with a dict from each collection changed to
+                          the set of keys changed in it, or None when they
+                          are not known, eg {"messages": {4, 7}, "stats": None}
+
+    Return Value: None
+    '''
+    _listeners.append(listener)
+
+def sync():
+    '''
+    Picks up the changes other server processes have committed since this
+    process last looked, telling every listener registered with on_change
+    which records they were. Also called every config.sync_interval
+    seconds, so work other processes queue, like scheduled messages, is
+    seen while this one is idle. Does nothing unless the store is shared
+    '''
+    global _syncer_pid
+    if not _shared:
+        return
+    with _sync_lock:
+        if _syncer_pid != os.getpid():
+            _syncer_pid = os.getpid()
+            threading.Thread(target=_sync_loop, name="store-sync", daemon=True).start()
+        changed = engine().changes()
+        if changed:
+            for listener in _listeners:
+                listener(changed)
+
+@contextmanager
+def _synced():
+    '''
+    Calls sync() when the calling thread did not already hold the store,
+    so each operation sees everything committed before it took its locks
+    '''
+    depth = getattr(_held, "depth", 0)
+    _held.depth = depth + 1
+    try:
+        if not depth:
+            sync()
+        yield
+    finally:
+        _held.depth = depth
+
+def _sync_loop():
+    '''
+    Body of the thread that syncs a shared store while no operations run
+    '''
+    while True:
+        time.sleep(config.sync_interval)
+        try:
+            sync()
+        except Exception:
+            # The engine may be shut down or replaced, eg between tests
+            pass
+
+################################### READS #####################################
+
+def get(table, key):
+    '''
+    Returns the record in table with the given key, or None
+
+    Arguments:
+    table (String) - The collection to look in, eg "messages"
+    key (Integer)  - The id of the record
+    '''
+    return engine().get(table, key)
+
+def scan(table):
+    '''
+    Returns a list of every record in table
+    '''
+    return engine().scan(table)
+
+def find(table, field, value):
+    '''
+    Returns the first record in table whose field equals value, or None
+
+    Arguments:
+    table (String) - The collection to look in, eg "users"
+    field (String) - The field to match on, eg "email"
+    value          - The value to match
+    '''
+    return engine().find(table, field, value)
+
+def find_all(table, field, value):
+    '''
+    Returns a list of every record in table whose field equals value
+    '''
+    return engine().find_all(table, field, value)
+
+def contains(table, key, field, u_id):
+    '''
+    Checks if a user is in one of the member fields of a record
+
+    Arguments:
+    table (String) - "channels" or "dms"
+    key (Integer)  - The id of the channel or dm
+    field (String) - The member field, one of MEMBER_FIELDS[table]
+    u_id (Integer) - The user to look for
+
+    Return Value:
+        Returns True if the record exists and u_id is in the field, False otherwise
+    '''
+    return engine().contains(table, key, field, u_id)
+
+def first(table):
+    '''
+    Returns the first record in table, or None if it is empty
+    '''
+    return engine().first(table)
+
+def count(table):
+    '''
+    Returns the number of records in table
+    '''
+    return engine().count(table)
+
+def max_key(table):
+    '''
+    Returns the largest key in table, or None if it is empty
+    '''
+    return engine().max_key(table)
+
+def position(message):
+    '''
+    Returns the place of a message in the history of its channel or dm. That
+    is its message_id, except for a message sent later, which keeps the
+    message_id it was given when it was scheduled but is placed by an id
+    reserved when it was delivered, so that it comes after every message
+    that was there before it
+
+    Arguments:
+    message (Dictionary) - The message, as stored
+
+    Return Value:
+        Returns an Integer, never the same for two messages
+    '''
+    return message.get("position", message["message_id"])
+
+def history(field, key, limit, before=None, after=None, offset=0):
+    '''
+    Returns a page of the live (not removed) messages of a channel or dm,
+    newest first. Costs O(limit) however long the conversation is
+
+    Arguments:
+    field (String)   - One of HISTORY_FIELDS, "channel_id" or "dm_id"
+    key (Integer)    - The id of the channel or dm
+    limit (Integer)  - The most messages to return
+    before (Integer) - Only return messages placed before the message with
+                       this message_id, see position()
+    after (Integer)  - Only return messages placed after the message with
+                       this message_id. The page is then the limit messages
+                       straight after it
+    offset (Integer) - The number of newest messages to skip first, ignored
+                       when after is given
+
+    Return Value:
+        Returns a list of messages, ordered by position, largest first
+    '''
+    return engine().history(field, key, limit, before, after, offset)
+
+def history_count(field, key):
+    '''
+    Returns the number of live messages of a channel or dm
+
+    Arguments:
+    field (String) - One of HISTORY_FIELDS, "channel_id" or "dm_id"
+    key (Integer)  - The id of the channel or dm
+    '''
+    return engine().history_count(field, key)
+
+################################# MUTATIONS ###################################
+
+def insert(table, record):
+    '''
+    Adds a new record to a collection
+
+    Arguments:
+    table (String)      - The collection to add to, eg "messages"
+    record (Dictionary) - The record, keyed by the table's field in TABLE_KEYS
+
+    Return Value: None
+    '''
+    engine().commit({"op": "insert", "table": table, "value": record})
+
+def update(table, key, fields):
+    '''
+    Sets fields on an existing record
+
+    Arguments:
+    table (String)      - The collection the record is in
+    key (Integer)       - The id of the record
+    fields (Dictionary) - Field names and their new values
+
+    Return Value: None
+    '''
+    engine().commit({"op": "update", "table": table, "key": key, "fields": fields})
+
+def increment(table, key, field, amount, initial, fields=None, series=None):
+    '''
+    Adds amount to an integer field of a record and returns its new value,
+    in one step that no other writer, in this process or another sharing
+    the engine's storage, can come between. Written to the log as the
+    update it makes, so replaying it is idempotent
+
+    Arguments:
+    table (String)       - The collection the record is in
+    key (Integer)        - The id of the record
+    field (String)       - The integer field, eg "high_water"
+    amount (Integer)     - The amount to add
+    initial (Dictionary) - The record to insert first, if there is no record
+                           with that key yet
+    fields (Dictionary)  - Other fields to set in the same step, eg a time stamp
+    series (Tuple)       - (list field, size, time stamp) to append
+                           [new value, time stamp] to in the same step,
+                           keeping only its newest size entries
+
+    Return Value:
+        Returns the new value of the field
+    '''
+    return engine().increment(table, key, field, amount, initial, fields, series)
+
+def append(table, key, field, value):
+    '''
+    Adds a value to a list field of a record, if it is not already in it
+
+    Arguments:
+    table (String)  - The collection the record is in
+    key (Integer)   - The id of the record
+    field (String)  - The list field, eg "all_members"
+    value           - The value to add
+
+    Return Value: None
+    '''
+    engine().commit({"op": "append", "table": table, "key": key, "field": field, "value": value})
+
+def remove(table, key, field, value):
+    '''
+    Removes a value from a list field of a record, if it is in it
+
+    Arguments:
+    table (String)  - The collection the record is in
+    key (Integer)   - The id of the record
+    field (String)  - The list field, eg "all_members"
+    value           - The value to remove
+
+    Return Value: None
+    '''
+    engine().commit({"op": "remove", "table": table, "key": key, "field": field, "value": value})
+
+def delete(table, key):
+    '''
+    Deletes a record from a collection, if it exists
+
+    Arguments:
+    table (String) - The collection the record is in
+    key (Integer)  - The id of the record
+
+    Return Value: None
+    '''
+    engine().commit({"op": "delete", "table": table, "key": key})
+
+def delete_many(table, keys):
+    '''
+    Deletes several records from a collection as one change, skipping any
+    that do not exist
+
+    Arguments:
+    table (String) - The collection the records are in
+    keys (List)    - The ids of the records
+
+    Return Value: None
+    '''
+    engine().commit({"op": "delete_many", "table": table, "keys": list(keys)})
+
+def clear():
+    '''
+    Empties every collection, durably and straight away
+    '''
+    engine().clear()
+
+################################ PERSISTENCE ##################################
+
+def load():
+    '''
+    Loads the persisted data store at start up
+
+    Return Value:
+        Returns the number of log records that were replayed
+    '''
+    return engine().load()
+
+def export():
+    '''
+    Returns the whole persisted data store as one image in the data.json
+    format, eg {"users": [...], "channels": [...], "dms": [...], "messages": [...]}
+    '''
+    return engine().export()
+
+def flush():
+    '''
+    Makes every change made so far durable, returning once it is on disk
+    '''
+    return engine().flush()
+
+def snapshot():
+    '''
+    Compacts whatever the engine has accumulated since its last snapshot
+    '''
+    engine().snapshot()
+
+def shutdown():
+    '''
+    Writes out anything still pending and stops the engine's background work.
+    Registered with atexit so pending changes survive a normal shutdown
+    '''
+    if _engine is not None:
+        _engine.shutdown()
+
+def write_file(path, contents):
+    '''
+    Atomically replaces the file at path with contents. The new contents are
+    written and fsynced to a temporary file first, so a crash part way through
+    leaves the previous version of the file intact
+
+    Arguments:
+    path (String)     - The file to replace
+    contents (String) - The new contents of the file
+
+    Return Value: None
+    '''
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(contents)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+atexit.register(shutdown)
@@ -0,0 +1,189 @@
+'''
+timer_wheel.py
+
+A hashed timer wheel, which runs any number of timers on one thread.
+
+Time is cut into ticks of `tick` seconds, and a timer due at time t is put
+in slot int(t / tick) % slots of a fixed ring of slots. The thread wakes
+once a tick and only looks at the slots of the ticks that have passed since
+it last woke, firing the timers in them that are due. A timer more than one
+turn of the wheel away shares its slot with nearer ones and is skipped until
+its turn comes round. Adding and cancelling a timer are O(1), and a timer
+fires at most one tick after it is due. While no timers are set the thread
+sleeps until one is added.
+'''
+import threading
+import time
+
+class TimerWheel:
+    def __init__(self, callback, tick, slots, name="timer-wheel"):
+        '''
+        Arguments:
+        callback (Function) - Called with the key of each timer as it fires,
+                              on the wheel's thread
+        tick (Float)        - Seconds per slot, the most a timer fires late by
+        slots (Integer)     - The number of slots in the ring
+        name (String)       - The name of the thread
+        '''
+        self._callback = callback
+        self._tick = tick
+        self._slots = [set() for _ in range(slots)]
+        self._name = name
+        self._cond = threading.Condition()
+        # key -> (deadline, slot)
+        self._timers = {}
+        # The last tick whose slot has been looked at. A tick is only looked
+        # at once it has ended, when every timer in it is due
+        self._cursor = self._tick_of(time.time()) - 1
+        self._running = False
+        self._thread = None
+        self._firing = 0
+
+    def add(self, key, deadline):
+        '''
+        Sets a timer to fire at deadline, replacing any timer already set
+        for key
+
+        Arguments:
+        key              - What the callback is called with, eg a channel_id
+        deadline (Float) - The unix timestamp to fire at
+        '''
+        with self._cond:
+            self._cancel(key)
+            slot = max(self._tick_of(deadline), self._cursor + 1) % len(self._slots)
+            self._timers[key] = (deadline, slot)
+            self._slots[slot].add(key)
+            self._start()
+            self._cond.notify_all()
+
+    def cancel(self, key):
+        '''
+        Cancels the timer set for key, if there is one
+
+        Return Value:
+            Returns True if a timer was cancelled
+        '''
+        with self._cond:
+            return self._cancel(key)
+
+    def deadline(self, key):
+        '''
+        Returns when the timer set for key fires, or None
+        '''
+        with self._cond:
+            timer = self._timers.get(key)
+            return timer[0] if timer is not None else None
+
+    def __len__(self):
+        with self._cond:
+            return len(self._timers)
+
+    def wait_until_idle(self, timeout=None):
+        '''
+        Waits until no timer is due and none is firing
+
+        Return Value:
+            Returns True once idle, False if timeout ran out first
+        '''
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._firing and not any(
+                    deadline <= time.time() for deadline, _ in self._timers.values()
+                ),
+                timeout=timeout
+            )
+
+    def clear(self):
+        '''
+        Cancels every timer
+        '''
+        with self._cond:
+            self._timers.clear()
+            for slot in self._slots:
+                slot.clear()
+            self._cond.notify_all()
+
+    def shutdown(self):
+        '''
+        Stops the thread, leaving the timers set. It starts again once
+        another timer is added
+        '''
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    ############################ HELPER FUNCTIONS #############################
+
+    def _tick_of(self, when):
+        return int(when / self._tick)
+
+    def _cancel(self, key):
+        '''
+        Must be called with _cond held
+        '''
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        self._slots[timer[1]].discard(key)
+        return True
+
+    def _start(self):
+        '''
+        Starts the thread if it isn't running. Must be called with _cond held
+        '''
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+        self._thread.start()
+
+    def _expired(self, now):
+        '''
+        Removes and returns the keys of the timers due by now, in the slots of
+        every tick since the last call. Must be called with _cond held
+        '''
+        current = self._tick_of(now) - 1
+        ticks = range(self._cursor + 1, current + 1)
+        if len(ticks) > len(self._slots):
+            ticks = range(current - len(self._slots) + 1, current + 1)
+        self._cursor = max(self._cursor, current)
+
+        fired = []
+        for tick in ticks:
+            slot = self._slots[tick % len(self._slots)]
+            for key in [key for key in slot if self._timers[key][0] <= now]:
+                slot.discard(key)
+                del self._timers[key]
+                fired.append(key)
+        return fired
+
+    def _run(self):
+        '''
+        Body of the wheel's thread
+        '''
+        while True:
+            with self._cond:
+                if not self._timers:
+                    # Nothing to fire, so sleep until a timer is added
+                    self._cond.wait_for(lambda: not self._running or self._timers)
+                else:
+                    tick_end = (self._cursor + 2) * self._tick
+                    self._cond.wait(timeout=max(tick_end - time.time(), 0))
+                if not self._running:
+                    return
+                fired = self._expired(time.time())
+                self._firing += len(fired)
+
+            for key in fired:
+                try:
+                    self._callback(key)
+                except Exception:
+                    # One failing timer must not stop the wheel for the others
+                    pass
+                finally:
+                    with self._cond:
+                        self._firing -= 1
+                        self._cond.notify_all()
@@ -0,0 +1,97 @@
+'''
+token_cache.py
+
+A bounded LRU cache from token to u_id in front of token_decode, so that
+the tokens sent with most requests never have to be decoded again.
+
+At most config.token_cache_size tokens are cached, past which the least
+recently used one is dropped. The tokens cached for each user are also
+kept, so that every token of a user can be dropped at once when it stops
+decoding to the same u_id, eg once they change their handle.
+'''
+import threading
+from collections import OrderedDict
+from src import config
+
+_lock = threading.Lock()
+# token -> u_id, least recently used first
+_cache = OrderedDict()
+# u_id -> {tokens}
+_by_user = {}
+
+def get(token):
+    '''
+    Returns the u_id cached for a token, or None
+
+    Arguments:
+    token (String) - The token sent with a request
+    '''
+    with _lock:
+        u_id = _cache.get(token)
+        if u_id is not None:
+            _cache.move_to_end(token)
+        return u_id
+
+def put(token, u_id):
+    '''
+    Caches the u_id a token decoded to, dropping the least recently used
+    token once config.token_cache_size are cached
+
+    Arguments:
+    token (String)  - The token
+    u_id (Integer)  - The user it belongs to
+
+    Return Value: None
+    '''
+    with _lock:
+        if token in _cache:
+            _drop(token)
+        _cache[token] = u_id
+        _by_user.setdefault(u_id, set()).add(token)
+        while len(_cache) > config.token_cache_size:
+            _drop(next(iter(_cache)))
+
+def invalidate(token):
+    '''
+    Drops a token from the cache, eg on logout
+    '''
+    with _lock:
+        if token in _cache:
+            _drop(token)
+
+def invalidate_user(u_id):
+    '''
+    Drops every token of a user from the cache, eg once they change their
+    handle or are removed from Dreams
+    '''
+    with _lock:
+        for token in list(_by_user.get(u_id, ())):
+            _drop(token)
+
+def clear():
+    '''
+    Empties the cache. Called whenever the data store is cleared or reloaded,
+    as u_ids can then be given to other users
+    '''
+    with _lock:
+        _cache.clear()
+        _by_user.clear()
+
+def size():
+    '''
+    Returns the number of tokens cached
+    '''
+    with _lock:
+        return len(_cache)
+
+############################## HELPER FUNCTIONS ###############################
+
+def _drop(token):
+    '''
+    Removes a cached token. Must be called with _lock held
+    '''
+    u_id = _cache.pop(token)
+    tokens = _by_user[u_id]
+    tokens.discard(token)
+    if not tokens:
+        del _by_user[u_id]
@@ -0,0 +1,105 @@
+'''
+upgrade.py
+
+Brings a data file written by an older version of Dreams up to the current
+format as it is loaded, so upgrading the server keeps its data. Older
+versions kept
+    - the members of channels and dms as copies of the members' profiles,
+      rather than their u_ids
+    - the reacts of a message as a list of
+      {"react_id", "u_ids", "is_this_user_reacted"}, rather than
+      {react_id: [u_ids]}
+    - no lists of the channels and dms each user is in, and no statistics
+    - no position for messages, as every message was placed by its
+      message_id
+
+Both engines run upgrade() on the snapshot they load, before anything reads
+it. Records already in the current format are left as they are, so only the
+first load of an old file changes anything, and the next snapshot is
+written in the current format.
+'''
+import src.stats as stats
+from src.store import MEMBER_FIELDS
+
+def upgrade(data):
+    '''
+    Brings an image of the data store up to the current format
+
+    Arguments:
+    data (Dictionary) - The image, in the data.json format
+
+    Return Value:
+        Returns data, changed in place
+    '''
+    for table, fields in MEMBER_FIELDS.items():
+        for record in data.get(table, []):
+            for field in fields:
+                members = record.get(field, [])
+                if any(isinstance(member, dict) for member in members):
+                    record[field] = list(dict.fromkeys(_u_id(member) for member in members))
+    for message in data.get("messages", []):
+        message.setdefault("position", message["message_id"])
+        if isinstance(message.get("reacts"), list):
+            message["reacts"] = {
+                str(react["react_id"]): list(react["u_ids"]) for react in message["reacts"] if react["u_ids"]
+            }
+    users = data.get("users", [])
+    if any("channels" not in user or "dms" not in user for user in users):
+        _add_user_lists(data)
+    if users and not data.get("stats"):
+        data["stats"] = _count_stats(data)
+    return data
+
+############################## HELPER FUNCTIONS ###############################
+
+def _u_id(member):
+    '''
+    Returns the u_id of a member, kept either as a u_id or as a profile
+    '''
+    return member["u_id"] if isinstance(member, dict) else member
+
+def _add_user_lists(data):
+    '''
+    Gives every user without them the lists of the channels and active dms
+    they are a member of
+    '''
+    channels, dms = {}, {}
+    for channel in data.get("channels", []):
+        for u_id in channel.get("all_members", []):
+            channels.setdefault(u_id, []).append(channel["channel_id"])
+    for dm in data.get("dms", []):
+        if dm.get("active", True):
+            for u_id in dm.get("members", []):
+                dms.setdefault(u_id, []).append(dm["dm_id"])
+    for user in data["users"]:
+        user.setdefault("channels", channels.get(user["u_id"], []))
+        user.setdefault("dms", dms.get(user["u_id"], []))
+
+def _count_stats(data):
+    '''
+    Counts the statistics of every user and of Dreams from the rest of the image
+
+    Return Value:
+        Returns the records of the "stats" collection
+    '''
+    live_dms = {dm["dm_id"] for dm in data.get("dms", []) if dm.get("active", True)}
+    sent = {}
+    live_messages = 0
+    for message in data.get("messages", []):
+        sent[message["u_id"]] = sent.get(message["u_id"], 0) + 1
+        if not message.get("removed") and ("channel_id" in message or message.get("dm_id") in live_dms):
+            live_messages += 1
+    records = [
+        stats.counted(user["u_id"], {
+            "channels_joined": len(user["channels"]),
+            "dms_joined": len(user["dms"]),
+            "messages_sent": sent.get(user["u_id"], 0),
+        })
+        for user in data["users"]
+    ]
+    records.append(stats.counted(stats.DREAMS, {
+        "channels_exist": len(data.get("channels", [])),
+        "dms_exist": len(live_dms),
+        "messages_exist": live_messages,
+    }))
+    return records
@@ -3,12 +3,12 @@ user.py
 '''
 
 import re
-import src.data as d
-from src.helper import user_exists, get_user, get_channel, get_dm, token_decode, load_data, save_data, get_message
+import src.store as store
+import src.stats as stats
+import src.mentions as mentions
+import src.token_cache as token_cache
+from src.helper import user_exists, get_user, token_decode
 from src.error import InputError, AccessError
-from src.channels import channels_listall_v2, channels_list_v2
-from src.dm import dm_list_v1
-import time
 
 
 def user_profile_v1(token, u_id):
@@ -28,13 +28,11 @@ def user_profile_v1(token, u_id):
         Returns { user }, a dictionary containing u_id, email, name_first, name_last, handle_str
 
     '''
-    d.data = load_data()
     # Check for valid u_id
     if user_exists(u_id) is False:
         raise InputError("Invalid user ID")
 
     user = get_user(u_id)
-    save_data()
     return {
         'user': {
             'u_id': user['u_id'],
@@ -45,6 +43,7 @@ def user_profile_v1(token, u_id):
         }
     }
 
+@store.atomic
 def user_profile_setname_v1(token, name_first, name_last):
     '''
     < Update the authorised user's first and last name >
@@ -63,7 +62,6 @@ def user_profile_setname_v1(token, name_first, name_last):
         Returns { }
 
     '''
-    d.data = load_data()
     # Retrieve user id from token
     u_id = token_decode(token)
 
@@ -73,13 +71,13 @@ def user_profile_setname_v1(token, name_first, name_last):
         raise InputError("Invalid name: Name length not within limits")
 
     # Update the user's name
-    for user in d.data['users']:
-        if u_id == user['u_id']:
-            user['name_first'] = name_first
-            user['name_last'] = name_last
-    save_data()
+    store.update("users", u_id, {
+        'name_first': name_first,
+        'name_last': name_last
+    })
     return {}
 
+@store.atomic
 def user_profile_setemail_v1(token, email):
     '''
     < Update the authorised user's email address >
@@ -98,7 +96,6 @@ def user_profile_setemail_v1(token, email):
         Returns { }
 
     '''
-    d.data = load_data()
     # Retrieve user id from token
     u_id = token_decode(token)
 
@@ -108,17 +105,14 @@ def user_profile_setemail_v1(token, email):
         raise InputError("Invalid email")
 
     # Check if the email entered is not already being used by another user
-    for user in d.data['users']:
-        if email == user['email']:
-            raise InputError("Invalid email: email is already being used by another user")
+    if store.find('users', 'email', email) is not None:
+        raise InputError("Invalid email: email is already being used by another user")
 
     # Update the authorised user's email
-    for user in d.data['users']:
-        if u_id == user['u_id']:
-            user['email'] = email
-    save_data()
+    store.update("users", u_id, {'email': email})
     return {}
 
+@store.atomic
 def user_profile_sethandle_v1(token, handle_str):
     '''
     < Update the authorised user's handle (i.e. display name) >
@@ -136,7 +130,6 @@ def user_profile_sethandle_v1(token, handle_str):
         Returns { }
 
     '''
-    d.data = load_data()
     # Retrieve user id from token
     u_id = token_decode(token)
 
@@ -145,15 +138,15 @@ def user_profile_sethandle_v1(token, handle_str):
         raise InputError("Invalid handle: Handle length not within limits")
 
     # Check if the handle entered is not already being used by another user
-    for user in d.data['users']:
-        if handle_str == user['handle_str']:
-            raise InputError("Invalid email: Handle is already being used by another user")
-
-    # Update the authorised user's email
-    for user in d.data['users']:
-        if u_id == user['u_id']:
-            user.update({'handle_str': handle_str})
-    save_data()
+    if store.find('users', 'handle_str', handle_str) is not None:
+        raise InputError("Invalid email: Handle is already being used by another user")
+
+    # Update the authorised user's handle
+    mentions.remove_handle(get_user(u_id)['handle_str'])
+    store.update("users", u_id, {'handle_str': handle_str})
+    mentions.add_handle(handle_str, u_id)
+    # Tokens made for the old handle no longer belong to this user
+    token_cache.invalidate_user(u_id)
     return {}
 
 def users_all_v1(token):
@@ -169,7 +162,6 @@ def users_all_v1(token):
         Returns {users}
 
     '''
-    d.data = load_data()
 
     """ ***ADD IN ACCESS ERROR RAISE***
     # Exception raise
@@ -183,7 +175,7 @@ def users_all_v1(token):
     # Creates the empty list of users that will be returned
     users = []
 
-    for user in d.data['users']:
+    for user in store.scan('users'):
         if u_id != user['u_id']:
             users.append({
                 "u_id": user["u_id"],
@@ -216,49 +208,8 @@ def user_stats_v1(token):
         raise AccessError
     """
 
-    stats = {}
-    time_stamp = time.time()
     u_id = token_decode(token)
-
-    # Creating channels_joined
-    channels_joined = {}
-    channels_joined["num_channels_joined"] = len(channels_list_v2(token)["channels"])
-    channels_joined["time_stamp"] = time_stamp
-    stats["channels_joined"] = channels_joined
-
-    # Creating dms_joined
-    dms_joined = {}
-    dms_joined["num_dms_joined"] = len(dm_list_v1(u_id)["dms"])
-    dms_joined["time_stamp"] = time_stamp
-    stats["dms_joined"] = dms_joined
-
-    # Creating messages_sent
-    messages_sent = {}
-    message_counter = 0
-
-    # Counts channel messages
-    for channel in channels_list_v2(token)["channels"]:
-        expanded_channel = get_channel(channel["channel_id"])
-        for message_id in expanded_channel["messages"]:
-            message = get_message(message_id)
-            if message["u_id"] == u_id:
-                
-                message_counter += 1
-
-    # Counts dm messages
-    for dm in dm_list_v1(u_id)["dms"]:
-        expanded_dm = get_dm(dm["dm_id"])
-        for message_id in expanded_dm["messages"]:
-            message = get_message(message_id)
-            if message["u_id"] == u_id:
-                message_counter += 1
-    
-    # Puts together messages_sent
-    messages_sent["num_messages_sent"] = message_counter
-    messages_sent["time_stamp"] = time_stamp
-    stats["messages_sent"] = messages_sent
-
-    return stats
+    return stats.user_stats(u_id)
 
 
 def users_stats_v1(token):
@@ -281,47 +232,4 @@ def users_stats_v1(token):
         raise AccessError
     """
 
-    stats = {}
-    time_stamp = time.time()
-
-    # Creating channels_exist
-    channels_exist = {}
-    channels_exist["num_channels_exist"] = len(channels_listall_v2(token)["channels"])
-    channels_exist["time_stamp"] = time_stamp
-    stats["channels_exist"] = channels_exist
-
-    # Creating messages_exist
-    messages_exist = {}
-    message_counter = 0
-
-    # Creating and counting dms_exist
-    dms_exist = {}
-
-    dm_count = 0
-    dm_ids_covered = []
-    for user in users_all_v1(token)['users']:
-        for dm in dm_list_v1(user["u_id"])["dms"]:
-            if dm["dm_id"] not in dm_ids_covered:
-                dm_count += 1
-                # Counts messages in the dm
-                expanded_dm = get_dm(dm["dm_id"])
-                message_counter += len(expanded_dm["messages"])
-                # Adds to the covered dm list
-                dm_ids_covered.append(dm["dm_id"])
-
-    dms_exist["num_dms_exist"] = dm_count
-    dms_exist["time_stamp"] = time_stamp
-    stats["dms_exist"] = dms_exist
-
-    # Counts channel messages
-    for channel in channels_listall_v2(token)["channels"]:
-        expanded_channel = get_channel(channel["channel_id"])
-        message_counter += len(expanded_channel["messages"])
-        print(len(expanded_channel["messages"]))
-    
-    # Puts together messages_exist
-    messages_exist["num_messages_exist"] = message_counter
-    messages_exist["time_stamp"] = time_stamp
-    stats["messages_exist"] = messages_exist
-
-    return stats
\ No newline at end of file
+    return stats.dreams_stats()
@@ -6,10 +6,21 @@ from src.auth import auth_passwordreset_request_v1, auth_passwordreset_reset_v1,
 from src.error import InputError
 from src.other import clear_v1
 from src.helper import get_id_and_password, create_token
-import src.data as d
+from src import config
+import src.mail as mail
+import src.store as store
 import pytest
 
-def test_auth_passwordreset_request_and_reset():
+@pytest.fixture
+def outbox():
+    '''
+    < Sends mail to a MemoryTransport instead of the mail server >
+    '''
+    transport = mail.set_transport(mail.MemoryTransport())
+    yield transport
+    mail.set_transport(None)
+
+def test_auth_passwordreset_request_and_reset(outbox):
     '''
     Tests that the user is able to request for a password reset and then login using the new password
     '''
@@ -22,33 +33,63 @@ def test_auth_passwordreset_request_and_reset():
     auth_passwordreset_request_v1(email)
 
     code = None
-    for user in d.data['users']:
-        if email == user['email']:
-            code = user['code']
-    
+    for reset in store.scan('reset_codes'):
+        code = reset['code']
+
     assert code is not None
+    assert mail.wait_until_sent(timeout=5)
+    assert outbox.sent[0]['to'] == email
+    assert code in outbox.sent[0]['body']
 
     auth_passwordreset_reset_v1(code, "password2")
+    assert auth_login_v2(email, "password2")['auth_user_id'] == 0
+    with pytest.raises(InputError):
+        assert auth_login_v2(email, "password")
+
+    #the code can only be used once
     with pytest.raises(InputError):
-        assert auth_login_v2(email, "password2")
+        auth_passwordreset_reset_v1(code, "password3")
 
-def test_auth_passwordreset_invalid_code_and_password():
+def test_auth_passwordreset_invalid_code_and_password(outbox):
     clear_v1()
     email = "someemail@gmail.com"
     auth_register_v2(email, "password", "Joel", "Engelman")
     auth_passwordreset_request_v1(email)
 
     code = None
-    for user in d.data['users']:
-        if email == user['email']:
-            code = user['code']
-    
+    for reset in store.scan('reset_codes'):
+        code = reset['code']
+
     assert code is not None
 
     #invalid password test
     with pytest.raises(InputError):
         assert auth_passwordreset_reset_v1(code, "")
-    
+
     #invalid code test
     with pytest.raises(InputError):
        assert auth_passwordreset_reset_v1("invalidcode", "password2")
+
+def test_auth_passwordreset_new_code_replaces_old(outbox):
+    clear_v1()
+    email = "someemail@gmail.com"
+    auth_register_v2(email, "password", "Joel", "Engelman")
+    auth_passwordreset_request_v1(email)
+    old_code = store.first('reset_codes')['code']
+    auth_passwordreset_request_v1(email)
+
+    assert store.count('reset_codes') == 1
+    with pytest.raises(InputError):
+        auth_passwordreset_reset_v1(old_code, "password2")
+
+def test_auth_passwordreset_code_expires(outbox, monkeypatch):
+    clear_v1()
+    email = "someemail@gmail.com"
+    auth_register_v2(email, "password", "Joel", "Engelman")
+    monkeypatch.setattr(config, "reset_code_ttl", -1)
+    auth_passwordreset_request_v1(email)
+    code = store.first('reset_codes')['code']
+
+    with pytest.raises(InputError):
+        auth_passwordreset_reset_v1(code, "password2")
+    assert store.count('reset_codes') == 0
@@ -2,6 +2,7 @@ from src.channel import channel_invite_v1, \
                         channel_details_v1,\
                         channel_join_v1, \
                         channel_messages_v1, \
+                        channel_history_v1, \
                         channel_removeowner_v1, \
                         channel_addowner_v1, \
                         channel_invite_v1, \
@@ -10,8 +11,9 @@ from src.auth import auth_login_v2, auth_register_v2
 from src.channels import channels_create_v2, channels_list_v2, channels_listall_v2
 from src.error import AccessError, InputError
 from src.helper import get_channel, get_user, create_token
-from src.message import message_send_v1
+from src.message import message_send_v1, message_remove_v1
 from src.other import clear_v1
+from src.user import user_profile_setname_v1
 import pytest
 
 @pytest.fixture
@@ -83,8 +85,14 @@ def test_channel_detail_output(Case1):
     details = channel_details_v1(Case1["ID1"], Case1["CH1"])
     channel = get_channel(Case1["CH1"])
     assert channel["name"] == details["name"]
-    assert channel["owner_members"] == details["owner_members"]
-    assert channel["all_members"] == details["all_members"]
+    assert [get_user(u_id) for u_id in channel["owner_members"]] == details["owner_members"]
+    assert [get_user(u_id) for u_id in channel["all_members"]] == details["all_members"]
+
+def test_channel_detail_after_setname(Case1):
+    user_profile_setname_v1(create_token("davidpeng"), "new", "name")
+    details = channel_details_v1(Case1["ID1"], Case1["CH1"])
+    assert details["owner_members"][0]["name_first"] == "new"
+    assert details["all_members"][0]["name_last"] == "name"
     
 def test_channel_messages_no_channel(Case1):
     #Channel does not exist
@@ -122,6 +130,63 @@ def test_channel_messages_normal_output(Case1):
     assert len(message_return["messages"]) == i
 
 
+def test_channel_messages_skips_removed(Case1):
+    # Removed messages are not counted towards start and end
+    ids = [message_send_v1(Case1["ID1"], Case1["CH1"], f"{i}")["message_id"] for i in range(60)]
+    message_remove_v1(Case1["ID1"], ids[-1])
+    message_remove_v1(Case1["ID1"], ids[0])
+
+    first = channel_messages_v1(Case1["ID1"], Case1["CH1"], 0)
+    assert [m["message_id"] for m in first["messages"]] == ids[58:8:-1]
+    assert first["end"] == 50
+    second = channel_messages_v1(Case1["ID1"], Case1["CH1"], 50)
+    assert [m["message_id"] for m in second["messages"]] == ids[8:0:-1]
+    assert second["end"] == -1
+    with pytest.raises(InputError):
+        channel_messages_v1(Case1["ID1"], Case1["CH1"], 59)
+
+
+# channel_history_v1 tests
+
+def test_channel_history_before_cursor(Case1):
+    ids = [message_send_v1(Case1["ID1"], Case1["CH1"], f"{i}")["message_id"] for i in range(25)]
+    message_remove_v1(Case1["ID1"], ids[14])
+
+    pages = []
+    before = -1
+    while True:
+        page = channel_history_v1(Case1["ID1"], Case1["CH1"], before_message_id=before, limit=10)
+        pages.append([m["message_id"] for m in page["messages"]])
+        before = page["before_message_id"]
+        if before == -1:
+            break
+    assert pages == [ids[24:14:-1], ids[13:3:-1], ids[3::-1]]
+
+
+def test_channel_history_after_cursor(Case1):
+    ids = [message_send_v1(Case1["ID1"], Case1["CH1"], f"{i}")["message_id"] for i in range(25)]
+
+    page = channel_history_v1(Case1["ID1"], Case1["CH1"], after_message_id=ids[4], limit=10)
+    assert [m["message_id"] for m in page["messages"]] == ids[14:4:-1]
+    assert page["after_message_id"] == ids[14]
+    assert page["before_message_id"] == ids[5]
+
+    latest = channel_history_v1(Case1["ID1"], Case1["CH1"], after_message_id=ids[24])
+    assert latest["messages"] == []
+    assert latest["after_message_id"] == ids[24]
+
+
+def test_channel_history_invalid(Case1):
+    with pytest.raises(InputError):
+        channel_history_v1(Case1["ID1"], 100)
+    with pytest.raises(InputError):
+        channel_history_v1(Case1["ID1"], Case1["CH1"], limit=0)
+    with pytest.raises(InputError):
+        channel_history_v1(Case1["ID1"], Case1["CH1"], limit=51)
+    with pytest.raises(AccessError):
+        channel_history_v1(Case1["ID2"], Case1["CH1"])
+
+
 # channel_join_v1 tests
 
 def test_channel_join_private(Case1):
@@ -153,7 +218,7 @@ def test_channel_join_global_owner(Case1):
     channel_join_v1(Case1["ID1"], Case1["CH2"])
     # If we get any valid return value, then member must now be apart of the 
     # channel
-    assert get_user(Case1["ID1"]) in get_channel(Case1["CH2"])["all_members"]
+    assert Case1["ID1"] in get_channel(Case1["CH2"])["all_members"]
 
 # channel_addowner
 
@@ -173,7 +238,7 @@ def test_channel_addowner_not_auth(Case1):
 def test_channel_addowner_valid(Case1):
     channel_addowner_v1(Case1["ID1"], Case1["CH1"], Case1["ID2"])
     channel = get_channel(Case1["CH1"])
-    assert get_user(Case1["ID2"]) in channel["owner_members"]
+    assert Case1["ID2"] in channel["owner_members"]
 
 # channel_removeowner
 
@@ -206,8 +271,8 @@ def test_channel_removeowner_valid(Case1):
 
     channel = get_channel(Case1["CH1"])
 
-    assert get_user(Case1["ID2"]) in channel["owner_members"]
-    assert get_user(Case1["ID1"]) not in channel["owner_members"]
+    assert Case1["ID2"] in channel["owner_members"]
+    assert Case1["ID1"] not in channel["owner_members"]
 
 # channel_leave
 
@@ -225,7 +290,7 @@ def test_channel_leave_valid(Case1):
 
     channel = get_channel(Case1["CH1"])
 
-    assert get_user(Case1["ID2"]) not in channel["all_members"]
+    assert Case1["ID2"] not in channel["all_members"]
 
 
 
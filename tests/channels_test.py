@@ -3,7 +3,8 @@ from src.auth import auth_register_v2
 from src.channels import channels_list_v2, channels_listall_v2, channels_create_v2
 from src.error import InputError, AccessError
 from src.other import clear_v1
-from src.helper import get_channel_listformat
+from src.helper import get_channel_listformat, token_decode
+from src.channel import channel_join_v1, channel_leave_v1
 
 @pytest.fixture
 def setup ():
@@ -68,6 +69,25 @@ def test_channels_list(setup):
 	assert get_channel_listformat(setup["channel2"]) in channels
 	assert get_channel_listformat(setup["channel3"]) not in channels
 
+def test_channels_list_after_join_and_leave(setup):
+	""" Tests that channels_list_v2 follows the channels a user joins and leaves
+
+	Parameters:
+		setup (fixture): the setup fixture
+
+	Returns:
+		assertion: pass if the list only holds the channels the user is currently in, fail if not
+
+	"""
+	u_id = token_decode(setup['user2'])
+	channel_join_v1(u_id, setup["channel1"])
+	assert channels_list_v2(setup['user2'])["channels"] == [
+		get_channel_listformat(setup["channel1"]),
+		get_channel_listformat(setup["channel3"]),
+	]
+	channel_leave_v1(u_id, setup["channel1"])
+	assert channels_list_v2(setup['user2'])["channels"] == [get_channel_listformat(setup["channel3"])]
+
 def test_channels_list_all(setup):
 	""" Tests that the channels_listall_v2 returns all channels that have been created
 
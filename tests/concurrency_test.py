@@ -0,0 +1,184 @@
+'''
+concurrency_test.py
+Tests for running operations on the store from many threads at once, the
+per channel and dm locks, and the reader-writer lock in rwlock.py behind them
+'''
+
+import threading
+import time
+import pytest
+import src.store as store
+import src.stats as stats
+from src.auth import auth_register_v2
+from src.channels import channels_create_v2
+from src.channel import channel_join_v1
+from src.message import message_send_v1, message_react_v1, message_share_v1
+from src.rwlock import RWLock
+from src.other import clear_v1
+
+THREADS = 16
+PER_THREAD = 50
+
+@pytest.fixture
+def channel():
+    clear_v1()
+    users = [auth_register_v2(f"email{i}@gmail.com", "password", "user", f"number{chr(97 + i)}")["auth_user_id"] for i in range(4)]
+    channel_id = channels_create_v2(auth_register_v2("owner@gmail.com", "password", "the", "owner")["token"], "channel", True)["channel_id"]
+    for u_id in users:
+        channel_join_v1(u_id, channel_id)
+    return users, channel_id
+
+def run_threads(target, count=THREADS):
+    errors = []
+    def run(i):
+        try:
+            target(i)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+def test_concurrent_sends_unique_and_none_lost(channel):
+    users, channel_id = channel
+    sent = [[] for _ in range(THREADS)]
+
+    def send(i):
+        for j in range(PER_THREAD):
+            sent[i].append(message_send_v1(users[i % len(users)], channel_id, f"{i}-{j}")["message_id"])
+    run_threads(send)
+
+    message_ids = [message_id for ids in sent for message_id in ids]
+    assert len(set(message_ids)) == THREADS * PER_THREAD
+    assert store.history_count("channel_id", channel_id) == THREADS * PER_THREAD
+    texts = {message["message_id"]: message["message"] for message in store.history("channel_id", channel_id, THREADS * PER_THREAD)}
+    for i, ids in enumerate(sent):
+        assert [texts[message_id] for message_id in ids] == [f"{i}-{j}" for j in range(PER_THREAD)]
+    assert store.get("stats", stats.DREAMS)["messages_exist"] == THREADS * PER_THREAD
+
+def test_concurrent_reacts(channel):
+    users, channel_id = channel
+    message_id = message_send_v1(users[0], channel_id, "react to me")["message_id"]
+    run_threads(lambda i: message_react_v1(users[i], message_id, 1), count=len(users))
+    assert sorted(store.get("messages", message_id)["reacts"]["1"]) == sorted(users)
+
+def test_reads_during_writes_see_whole_operations(channel):
+    users, channel_id = channel
+    done = threading.Event()
+    seen = []
+
+    def read(_):
+        while not done.is_set():
+            with store.conversation("channel_id", channel_id):
+                # Sending a message adds it and counts it in one operation
+                seen.append(store.history_count("channel_id", channel_id) == store.get("stats", stats.DREAMS)["messages_exist"])
+
+    readers = [threading.Thread(target=read, args=(i,)) for i in range(4)]
+    for reader in readers:
+        reader.start()
+    for j in range(200):
+        message_send_v1(users[0], channel_id, str(j))
+    done.set()
+    for reader in readers:
+        reader.join()
+    assert seen and all(seen)
+
+def test_sends_to_different_channels_run_at_once(channel):
+    users, channel_id = channel
+    other_id = channels_create_v2(auth_register_v2("other@gmail.com", "password", "other", "owner")["token"], "other", True)["channel_id"]
+    channel_join_v1(users[0], other_id)
+    sent = {}
+    def send(key):
+        sent[key] = message_send_v1(users[0], key, "hello")["message_id"]
+
+    with store.conversation("channel_id", channel_id):
+        # A send to another channel isn't held up by this one
+        other = threading.Thread(target=send, args=(other_id,))
+        other.start()
+        other.join(timeout=5)
+        assert other_id in sent
+
+        # But one to the same channel waits for it
+        same = threading.Thread(target=send, args=(channel_id,))
+        same.start()
+        same.join(timeout=0.1)
+        assert channel_id not in sent
+    same.join(timeout=5)
+    assert sent[channel_id] != sent[other_id]
+
+def test_sends_across_channels_unique_ids(channel):
+    users, channel_id = channel
+    channel_ids = [channel_id] + [
+        channels_create_v2(auth_register_v2(f"owner{i}@gmail.com", "password", "owner", f"number{chr(97 + i)}")["token"], f"channel{i}", True)["channel_id"]
+        for i in range(3)
+    ]
+    for key in channel_ids[1:]:
+        for u_id in users:
+            channel_join_v1(u_id, key)
+    sent = [[] for _ in range(THREADS)]
+
+    def send(i):
+        for j in range(PER_THREAD):
+            message_id = message_send_v1(users[i % len(users)], channel_ids[i % len(channel_ids)], f"{i}-{j}")["message_id"]
+            sent[i].append(message_id)
+            if j % 10 == 0:
+                # Sharing reaches across channels, so it holds the whole store
+                sent[i].append(message_share_v1(users[i % len(users)], message_id, "", channel_ids[(i + 1) % len(channel_ids)], -1)["shared_message_id"])
+    run_threads(send)
+
+    message_ids = [message_id for ids in sent for message_id in ids]
+    assert len(set(message_ids)) == len(message_ids)
+    assert sum(store.history_count("channel_id", key) for key in channel_ids) == len(message_ids)
+    assert store.get("stats", stats.DREAMS)["messages_exist"] == len(message_ids)
+    assert sum(store.get("stats", u_id)["messages_sent"] for u_id in users) == len(message_ids)
+
+def test_readers_share_writers_exclude():
+    lock = RWLock()
+    inside = []
+    peak = [0]
+    guard = threading.Lock()
+
+    def read(_):
+        lock.acquire_read()
+        with guard:
+            inside.append(1)
+            peak[0] = max(peak[0], len(inside))
+        time.sleep(0.05)
+        with guard:
+            inside.pop()
+        lock.release_read()
+    run_threads(read, count=8)
+    assert peak[0] > 1
+
+    lock.acquire_write()
+    started = threading.Event()
+    finished = threading.Event()
+    def blocked_read():
+        started.set()
+        lock.acquire_read()
+        finished.set()
+        lock.release_read()
+    reader = threading.Thread(target=blocked_read)
+    reader.start()
+    started.wait()
+    assert not finished.wait(0.1)
+    lock.release_write()
+    reader.join()
+    assert finished.is_set()
+
+def test_reentrant_and_no_upgrade():
+    lock = RWLock()
+    lock.acquire_write()
+    lock.acquire_write()
+    lock.acquire_read()
+    lock.release_read()
+    lock.release_write()
+    lock.release_write()
+
+    lock.acquire_read()
+    with pytest.raises(RuntimeError):
+        lock.acquire_write()
+    lock.release_read()
@@ -1,10 +1,11 @@
 import pytest
 from src.error import AccessError, InputError
 from src.other import clear_v1
-from src.helper import get_user, get_dm, get_message
+from src.helper import get_user, get_dm, get_message, format_message
 from src.auth import auth_register_v2 as auth_register_v1
-from src.message import message_senddm_v1, message_remove_v1
-from src.dm import dm_create_v1, dm_details_v1, dm_invite_v1, dm_list_v1, dm_messages_v1, dm_remove_v1, dm_leave_v1
+from src.message import message_senddm_v1, message_remove_v1, message_edit_v1
+import src.stats as stats
+from src.dm import dm_create_v1, dm_details_v1, dm_invite_v1, dm_list_v1, dm_messages_v1, dm_remove_v1, dm_leave_v1, dm_history_v1
 '''
 Tests for:
     dm_create_v1(ID, u_ids) => { dm_id, dm_name }
@@ -14,6 +15,7 @@ Tests for:
     dm_remove_v1(ID, dm_id) => {}
     dm_messages_v1(ID, dm_id, start) => { messages, start, end }
     dm_leave_v1(ID, dm_id)
+    dm_history_v1(ID, dm_id, before_message_id, after_message_id, limit) => { messages, before_message_id, after_message_id }
 
 '''
 def get_dm_listformat(dm_id):
@@ -142,6 +144,15 @@ def test_dm_list_Case1ext(Case1ext):
     assert get_dm_listformat(Case1ext['DMID3']) in dm_list_v1(Case1ext['ID2'])['dms']
     assert get_dm_listformat(Case1ext['DMID4']) in dm_list_v1(Case1ext['ID2'])['dms']
 
+def test_dm_list_after_leave_and_remove(Case1ext):
+    dm_leave_v1(Case1ext['ID2'], Case1ext['DMID2'])
+    dm_remove_v1(Case1ext['ID1'], Case1ext['DMID4'])
+    assert dm_list_v1(Case1ext['ID2'])['dms'] == [
+        get_dm_listformat(Case1ext['DMID1']),
+        get_dm_listformat(Case1ext['DMID3']),
+    ]
+    assert dm_list_v1(Case1ext['ID4'])['dms'] == []
+
 
 def test_dm_remove_noDm(Case1ext):
     with pytest.raises(InputError):
@@ -165,6 +176,18 @@ def test_dm_remove_valid2(Case1ext):
     with pytest.raises(InputError):
         dm_details_v1(Case1ext['ID2'], Case1ext['DMID3'])
 
+def test_dm_remove_messages_counted_once(Case1ext):
+    message_id = message_senddm_v1(Case1ext["ID1"], Case1ext["DMID1"], "Hello World")["message_id"]
+    dm_remove_v1(Case1ext['ID1'], Case1ext['DMID1'])
+    assert stats.dreams_stats()["messages_exist"]["num_messages_exist"] == 0
+    with pytest.raises(InputError):
+        message_remove_v1(Case1ext["ID1"], message_id)
+    with pytest.raises(InputError):
+        message_edit_v1(Case1ext["ID1"], message_id, "Goodbye World")
+    with pytest.raises(InputError):
+        message_senddm_v1(Case1ext["ID1"], Case1ext["DMID1"], "Hello again")
+    assert stats.dreams_stats()["messages_exist"]["num_messages_exist"] == 0
+
 def test_dm_message_noDM(Case1ext):
     with pytest.raises(InputError):
         assert dm_messages_v1(Case1ext['ID1'], 5, 0)
@@ -182,7 +205,7 @@ def test_dm_message_notMember(Case1ext):
 def test_dm_message_valid(Case1ext):
     messageID = message_senddm_v1(Case1ext["ID1"], Case1ext["DMID1"], "Hello World")['message_id']
     assert dm_messages_v1(Case1ext['ID1'], Case1ext["DMID1"], 0) == {
-        'messages': [get_message(messageID)],
+        'messages': [format_message(get_message(messageID), Case1ext['ID1'])],
         'start': 0,
         'end': -1
     }
@@ -193,12 +216,12 @@ def test_dm_message_valid2(Case1ext):
     print(dm_messages_v1(Case1ext['ID1'], Case1ext["DMID1"], 1))
     print("/////////")
     print({
-        'messages': [get_message(messageID1), get_message(messageID2)],
+        'messages': [format_message(get_message(messageID1), Case1ext['ID1']), format_message(get_message(messageID2), Case1ext['ID1'])],
         'start': 1,
         'end': -1
     })
     assert dm_messages_v1(Case1ext['ID1'], Case1ext["DMID1"], 1) == {
-        'messages': [get_message(messageID2)],
+        'messages': [format_message(get_message(messageID1), Case1ext['ID1'])],
         'start': 1,
         'end': -1
     }
@@ -210,13 +233,13 @@ def test_dm_message_valid100(Case1ext):
 
     dms = dm_messages_v1(Case1ext['ID1'], Case1ext["DMID1"], 37)['messages']
     print(dms[0])
-    assert get_message(messageIDs[13]) in dms
-    assert get_message(messageIDs[38]) in dms
-    assert get_message(messageIDs[56]) in dms
-    assert get_message(messageIDs[58]) in dms
-    assert get_message(messageIDs[86]) not in dms
-    assert get_message(messageIDs[87]) not in dms
-    assert get_message(messageIDs[88]) not in dms
+    assert format_message(get_message(messageIDs[13]), Case1ext['ID1']) in dms
+    assert format_message(get_message(messageIDs[38]), Case1ext['ID1']) in dms
+    assert format_message(get_message(messageIDs[56]), Case1ext['ID1']) in dms
+    assert format_message(get_message(messageIDs[58]), Case1ext['ID1']) in dms
+    assert format_message(get_message(messageIDs[86]), Case1ext['ID1']) not in dms
+    assert format_message(get_message(messageIDs[87]), Case1ext['ID1']) not in dms
+    assert format_message(get_message(messageIDs[88]), Case1ext['ID1']) not in dms
 
 def test_dm_message_validRemoval(Case1ext):
     messageIDs = []
@@ -225,8 +248,27 @@ def test_dm_message_validRemoval(Case1ext):
         
     message_remove_v1(Case1ext["ID1"], messageIDs[58])
 
-    assert get_message(messageIDs[58]) not in dm_messages_v1(Case1ext['ID1'], Case1ext["DMID1"], 37)['messages']
+    assert format_message(get_message(messageIDs[58]), Case1ext['ID1']) not in dm_messages_v1(Case1ext['ID1'], Case1ext["DMID1"], 37)['messages']
+
 
+def test_dm_history_valid(Case1ext):
+    messageIDs = []
+    for _ in range(30):
+        messageIDs.append(message_senddm_v1(Case1ext["ID1"], Case1ext["DMID1"], "Hello World")['message_id'])
+    message_remove_v1(Case1ext["ID1"], messageIDs[20])
+
+    page = dm_history_v1(Case1ext['ID2'], Case1ext["DMID1"], limit=10)
+    assert page['messages'] == [format_message(get_message(i), Case1ext['ID2']) for i in messageIDs[29:20:-1] + [messageIDs[19]]]
+    older = dm_history_v1(Case1ext['ID2'], Case1ext["DMID1"], before_message_id=page['before_message_id'], limit=10)
+    assert [m['message_id'] for m in older['messages']] == messageIDs[18:8:-1]
+
+def test_dm_history_invalid(Case1ext):
+    with pytest.raises(InputError):
+        dm_history_v1(Case1ext['ID1'], 5)
+    with pytest.raises(InputError):
+        dm_history_v1(Case1ext['ID1'], Case1ext["DMID1"], limit=100)
+    with pytest.raises(AccessError):
+        dm_history_v1(Case1ext['ID4'], Case1ext["DMID1"])
 
 def test_dm_leave_noDM(Case1ext):
     with pytest.raises(InputError):
@@ -243,4 +285,4 @@ def test_dm_leave_notmember(Case1ext):
 
 def test_dm_leave_valid(Case1ext):
     dm_leave_v1(Case1ext["ID1"], Case1ext["DMID1"])
-    assert get_user(Case1ext["ID1"]) not in get_dm(Case1ext["DMID1"])['members']
\ No newline at end of file
+    assert Case1ext["ID1"] not in get_dm(Case1ext["DMID1"])['members']
\ No newline at end of file
@@ -0,0 +1,133 @@
+'''
+events_test.py
+Tests for the activity stream, events_stream_v1, and the hub in events.py
+'''
+
+import json
+import threading
+import pytest
+import src.events as events
+import src.sessions as sessions
+from src import config
+from src.auth import auth_register_v2
+from src.channels import channels_create_v2
+from src.channel import channel_join_v1
+from src.dm import dm_create_v1
+from src.message import message_send_v1, message_senddm_v1, message_edit_v1, message_remove_v1, message_react_v1, message_unreact_v1, message_pin_v1
+from src.other import clear_v1, events_stream_v1
+
+@pytest.fixture
+def users(monkeypatch):
+    monkeypatch.setattr(config, "stream_keepalive", 0.05)
+    clear_v1()
+    user1 = auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    user2 = auth_register_v2("email2@gmail.com", "password2", "joel", "engelman")
+    for user in (user1, user2):
+        sessions.start(user["token"], user["auth_user_id"])
+    channel_id = channels_create_v2(user1["token"], "channel", True)["channel_id"]
+    return user1, user2, channel_id
+
+def open_stream(user, last_event_id=None):
+    stream = events_stream_v1(user["auth_user_id"], user["token"], last_event_id)
+    assert next(stream) == f"retry: {config.stream_retry}\n\n"
+    return stream
+
+def read(stream):
+    '''
+    Returns the events of the next chunk of the stream that holds any, as
+    (id, type, data)
+    '''
+    chunk = next(stream)
+    while chunk.startswith(":"):
+        chunk = next(stream)
+    parsed = []
+    for text in chunk.strip("\n").split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in text.split("\n"))
+        parsed.append((fields["id"], fields["event"], json.loads(fields["data"])))
+    return parsed
+
+def test_only_conversations_of_the_user(users):
+    user1, user2, channel_id = users
+    stream = open_stream(user2)
+    dm_id = dm_create_v1(user1["auth_user_id"], [user2["auth_user_id"]])["dm_id"]
+    message_send_v1(user1["auth_user_id"], channel_id, "not for joel")
+    message_senddm_v1(user1["auth_user_id"], dm_id, "for joel")
+
+    [(_, kind, data)] = read(stream)
+    assert kind == events.SENT
+    assert data["message"]["message"] == "for joel"
+    assert data["message"]["dm_id"] == dm_id
+
+    channel_join_v1(user2["auth_user_id"], channel_id)
+    message_send_v1(user1["auth_user_id"], channel_id, "now for joel")
+    assert [data["message"]["message"] for _, _, data in read(stream)] == ["now for joel"]
+
+def test_every_change_to_a_message(users):
+    user1, user2, channel_id = users
+    channel_join_v1(user2["auth_user_id"], channel_id)
+    stream = open_stream(user2)
+    message_id = message_send_v1(user1["auth_user_id"], channel_id, "hello")["message_id"]
+    message_edit_v1(user1["auth_user_id"], message_id, "hello there")
+    message_react_v1(user1["auth_user_id"], message_id, 1)
+    message_react_v1(user2["auth_user_id"], message_id, 1)
+    message_unreact_v1(user1["auth_user_id"], message_id, 1)
+    message_pin_v1(user1["auth_user_id"], message_id)
+    message_remove_v1(user1["auth_user_id"], message_id)
+
+    received = read(stream)
+    assert [kind for _, kind, _ in received] == [
+        events.SENT, events.EDITED, events.REACTS, events.REACTS, events.REACTS, events.PIN, events.REMOVED,
+    ]
+    assert received[1][2]["message"]["message"] == "hello there"
+    assert received[3][2]["message"]["reacts"] == [
+        {"react_id": 1, "u_ids": [user1["auth_user_id"], user2["auth_user_id"]], "is_this_user_reacted": True},
+    ]
+    assert received[5][2]["message"]["is_pinned"]
+    assert received[6][2] == {"message_id": message_id, "channel_id": channel_id}
+
+def test_resume_from_last_event_id(users):
+    user1, _, channel_id = users
+    stream = open_stream(user1)
+    message_send_v1(user1["auth_user_id"], channel_id, "first")
+    [(last_event_id, _, _)] = read(stream)
+    stream.close()
+
+    message_send_v1(user1["auth_user_id"], channel_id, "second")
+    message_send_v1(user1["auth_user_id"], channel_id, "third")
+    stream = open_stream(user1, last_event_id)
+    assert [data["message"]["message"] for _, _, data in read(stream)] == ["second", "third"]
+
+def test_reset_once_events_are_dropped(users, monkeypatch):
+    user1, _, channel_id = users
+    monkeypatch.setattr(config, "event_buffer_size", 2)
+    stream = open_stream(user1)
+    message_send_v1(user1["auth_user_id"], channel_id, "first")
+    [(last_event_id, _, _)] = read(stream)
+    for i in range(3):
+        message_send_v1(user1["auth_user_id"], channel_id, str(i))
+
+    [(reset_id, kind, data)] = read(open_stream(user1, last_event_id))
+    assert (kind, data) == ("reset", {})
+    assert reset_id == events.position()
+
+    # Ids from before the store was cleared are never resumed from
+    assert events.wait(reset_id, 0) == []
+    events.reset()
+    assert events.wait(reset_id, 0) is None
+
+def test_wakes_when_published(users):
+    after = events.position()
+    received = []
+    waiter = threading.Thread(target=lambda: received.append(events.wait(after, 5)))
+    waiter.start()
+    events.publish(events.PIN, {"message_id": 0, "channel_id": users[2]})
+    waiter.join()
+    assert [event["message"]["message_id"] for event in received[0]] == [0]
+
+def test_ends_with_session(users):
+    user1 = users[0]
+    stream = open_stream(user1)
+    assert next(stream) == ": keepalive\n\n"
+    sessions.end(user1["token"])
+    with pytest.raises(StopIteration):
+        next(stream)
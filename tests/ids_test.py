@@ -0,0 +1,81 @@
+'''
+ids_test.py
+Tests for the leased blocks of ids handed out by ids.py
+'''
+
+import threading
+import pytest
+import src.ids as ids
+import src.store as store
+from src import config
+from src.sqlite_engine import SQLiteEngine
+from src.auth import auth_register_v2
+from src.channels import channels_create_v2
+from src.dm import dm_create_v1
+from src.message import message_send_v1
+from src.other import clear_v1
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(config, "id_block_size", 5)
+    clear_v1()
+
+def test_first_ids(small_blocks):
+    user1 = auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    user2 = auth_register_v2("email2@gmail.com", "password2", "joel", "engelman")
+    channel_id = channels_create_v2(user1["token"], "channel", True)["channel_id"]
+    dm_id = dm_create_v1(user1["auth_user_id"], [user2["auth_user_id"]])["dm_id"]
+    message_ids = [message_send_v1(user1["auth_user_id"], channel_id, str(i))["message_id"] for i in range(12)]
+    assert (user1["auth_user_id"], user2["auth_user_id"]) == (0, 1)
+    assert channel_id == 1 and dm_id == 0
+    assert message_ids == list(range(12))
+    assert store.get("sequences", ids.SEQUENCES["messages"][0])["high_water"] == 15
+
+def test_another_process_gets_its_own_block(small_blocks):
+    first = [ids.next_id("messages") for _ in range(3)]
+    # A second process shares the store but none of this one's blocks
+    leased = dict(ids._blocks)
+    ids.reset()
+    second = [ids.next_id("messages") for _ in range(3)]
+    ids._blocks.update(leased)
+    assert first == [0, 1, 2]
+    assert second == [5, 6, 7]
+    assert ids.next_id("messages") == 3
+
+def test_starts_past_existing_records(small_blocks):
+    store.insert("scheduled", {"message_id": 41, "u_id": 0, "channel_id": 1, "message": "later", "time_sent": 0})
+    ids.reset()
+    assert ids.next_id("messages") == 42
+
+def test_concurrent_ids_unique(small_blocks):
+    taken = [[] for _ in range(8)]
+    def take(i):
+        for _ in range(200):
+            taken[i].append(ids.next_id("users"))
+    threads = [threading.Thread(target=take, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    every = [new_id for ids_taken in taken for new_id in ids_taken]
+    assert sorted(every) == list(range(len(every)))
+    for ids_taken in taken:
+        assert ids_taken == sorted(ids_taken)
+
+def test_sqlite_leases_across_connections(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "data_path", str(tmp_path / "data.json"))
+    path = str(tmp_path / "data.db")
+    engines = [SQLiteEngine(path), SQLiteEngine(path)]
+    initial = {"sequence_id": 0, "kind": "users", "high_water": 0}
+    ends = []
+    def lease(engine):
+        for _ in range(50):
+            ends.append(engine.increment("sequences", 0, "high_water", 10, initial))
+    threads = [threading.Thread(target=lease, args=(engine,)) for engine in engines]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(ends) == list(range(10, 1001, 10))
+    for engine in engines:
+        engine.shutdown()
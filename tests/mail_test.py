@@ -0,0 +1,87 @@
+'''
+mail_test.py
+Tests for the outbound mail queue in mail.py
+'''
+
+import pytest
+import src.mail as mail
+import src.store as store
+from src import config
+from src.other import clear_v1
+
+@pytest.fixture
+def transport(monkeypatch):
+    '''
+    < Sends mail to a MemoryTransport, retrying straight away >
+    '''
+    monkeypatch.setattr(config, "mail_retry_backoff", 0)
+    clear_v1()
+    memory = mail.set_transport(mail.MemoryTransport())
+    yield memory
+    mail.set_transport(None)
+
+def test_send_is_queued_and_delivered(transport):
+    mail.send("email@gmail.com", "Subject", "Body")
+    assert mail.wait_until_sent(timeout=5)
+    assert transport.sent == [{"to": "email@gmail.com", "subject": "Subject", "body": "Body"}]
+    assert store.count("outbox") == 0
+    assert mail.pending() == 0
+    assert mail.counts()["sent"] == 1
+
+def test_connection_reused_for_a_batch(transport):
+    with mail._cond:
+        # Hold the sender back until every message is queued
+        for i in range(5):
+            mail.send(f"email{i}@gmail.com", "Subject", "Body")
+    assert mail.wait_until_sent(timeout=5)
+    assert len(transport.sent) == 5
+    assert transport.connections == 1
+
+def test_failures_are_retried(transport):
+    transport.failures = 2
+    mail.send("email@gmail.com", "Subject", "Body")
+    assert mail.wait_until_sent(timeout=5)
+    assert len(transport.sent) == 1
+    assert mail.counts() == {"sent": 1, "retried": 2, "dropped": 0}
+
+def test_dropped_after_max_attempts(transport, monkeypatch):
+    monkeypatch.setattr(config, "mail_max_attempts", 3)
+    transport.failures = 10
+    mail.send("email@gmail.com", "Subject", "Body")
+    assert mail.wait_until_sent(timeout=5)
+    assert transport.sent == []
+    assert mail.counts()["dropped"] == 1
+    assert store.count("outbox") == 0
+
+def test_outbox_survives_restart(transport, monkeypatch):
+    monkeypatch.setattr(config, "mail_retry_backoff", 60)
+    transport.failures = 1
+    mail.send("email@gmail.com", "Subject", "Body")
+    assert mail.wait_until_sent(timeout=5)
+    assert store.get("outbox", 0)["attempts"] == 1
+
+    # Make the retry due and read the outbox again, as a restart would
+    store.update("outbox", 0, {"next_attempt": 0})
+    mail.reset()
+    assert mail.wait_until_sent(timeout=5)
+    assert len(transport.sent) == 1
+
+def test_unknown_transport():
+    with pytest.raises(ValueError):
+        mail.make_transport("carrier pigeon")
+
+def test_sender_survives_a_transport_that_cannot_be_made(transport, monkeypatch):
+    monkeypatch.setattr(config, "mail_retry_backoff", 60)
+    monkeypatch.setattr(config, "mail_transport", "carrier pigeon")
+    mail.set_transport(None)
+    mail.send("email@gmail.com", "Subject", "Body")
+    assert mail.wait_until_sent(timeout=5)
+    assert store.get("outbox", 0)["attempts"] == 0
+    assert mail.counts()["retried"] == 1
+    assert mail._sender.is_alive()
+
+    # The same sender sends it once there is a transport again
+    mail.set_transport(transport)
+    mail.reset()
+    assert mail.wait_until_sent(timeout=5)
+    assert len(transport.sent) == 1
@@ -0,0 +1,72 @@
+'''
+mentions_test.py
+Tests for the handle trie in mentions.py
+'''
+
+import pytest
+import src.mentions as mentions
+import src.store as store
+from src.auth import auth_register_v2
+from src.channels import channels_create_v2
+from src.channel import channel_join_v1
+from src.message import message_send_v1, message_edit_v1
+from src.user import user_profile_sethandle_v1
+from src.other import clear_v1, notification_v1
+
+@pytest.fixture
+def users():
+    clear_v1()
+    user1 = auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    user2 = auth_register_v2("email2@gmail.com", "password2", "david", "peng")
+    user3 = auth_register_v2("email3@gmail.com", "password3", "mary jane", "o'neil")
+    return user1, user2, user3
+
+def test_extract(users):
+    user1, user2, user3 = users
+    u_id1, u_id2, u_id3 = user1["auth_user_id"], user2["auth_user_id"], user3["auth_user_id"]
+
+    assert mentions.extract("hi @davidpeng") == [u_id1]
+    # The longest handle wins, and must not run on into a letter or digit
+    assert mentions.extract("@davidpeng0, @davidpeng") == [u_id2, u_id1]
+    assert mentions.extract("@davidpeng1 @davidpengs") == []
+    assert mentions.extract("@mary janeo'neil!") == [u_id3]
+    assert mentions.extract("@davidpeng @davidpeng@davidpeng") == [u_id1]
+    assert mentions.extract("no tags @ all @") == []
+
+def test_trie_follows_handle_changes(users):
+    user1, user2, _ = users
+    user_profile_sethandle_v1(user2["token"], "dave")
+    assert mentions.extract("@davidpeng0 @dave") == [user2["auth_user_id"]]
+
+    user_profile_sethandle_v1(user1["token"], "davidpeng0")
+    assert mentions.extract("@davidpeng0 @davidpeng") == [user1["auth_user_id"]]
+
+    # Rebuilding from the store gives the same trie
+    mentions.reset()
+    assert mentions.extract("@davidpeng0 @davidpeng @dave") == [user1["auth_user_id"], user2["auth_user_id"]]
+
+def test_sync_user_follows_the_store(users):
+    user1, _, _ = users
+    u_id1 = user1["auth_user_id"]
+    assert mentions.extract("@davidpeng") == [u_id1]
+    # As another server process would change it
+    store.update("users", u_id1, {"handle_str": "dp"})
+    mentions.sync_user(u_id1)
+    assert mentions.extract("@davidpeng @dp") == [u_id1]
+    mentions.sync_user(u_id1)
+    assert mentions.extract("@davidpeng @dp") == [u_id1]
+
+def test_edit_notifies_newly_tagged(users):
+    user1, user2, _ = users
+    channel_id = channels_create_v2(user1["token"], "channel", True)["channel_id"]
+    channel_join_v1(user2["auth_user_id"], channel_id)
+    message_id = message_send_v1(user1["auth_user_id"], channel_id, "hi @davidpeng0")["message_id"]
+    message_edit_v1(user1["auth_user_id"], message_id, "hi again @davidpeng0")
+    assert len(notification_v1(user2["auth_user_id"])["notifications"]) == 1
+
+    message_edit_v1(user1["auth_user_id"], message_id, "bye")
+    message_edit_v1(user1["auth_user_id"], message_id, "bye @davidpeng0")
+    assert [n["notification_message"] for n in notification_v1(user2["auth_user_id"])["notifications"]] == [
+        "davidpeng tagged you in channel: bye @davidpeng0",
+        "davidpeng tagged you in channel: hi @davidpeng0",
+    ]
@@ -17,6 +17,7 @@ from src.other import clear_v1
 from src.error import AccessError, InputError
 from src.helper import is_member, valid_message, get_message_text, create_token, save_data
 import time
+import src.scheduler as scheduler
 
 @pytest.fixture
 def testing_data():
@@ -267,6 +268,17 @@ def test_message_react_is_this_user_reacted(testing_data):
     assert testing_data['ID2'] in test_react['u_ids']
     assert test_react['is_this_user_reacted'] == False
 
+def test_message_react_is_this_user_reacted_per_viewer(testing_data):
+    new_message = message_send_v1(testing_data["ID1"], testing_data["CH1"], "This is a new message")    
+    channel_invite_v1(testing_data["ID1"], testing_data["CH1"], testing_data["ID2"])
+
+    message_react_v1(testing_data["ID2"], new_message["message_id"], 1)
+
+    reacts1 = channel_messages_v1(testing_data['ID1'], testing_data['CH1'], 0)['messages'][0]['reacts']
+    reacts2 = channel_messages_v1(testing_data['ID2'], testing_data['CH1'], 0)['messages'][0]['reacts']
+    assert reacts1 == [{'react_id': 1, 'u_ids': [testing_data['ID2']], 'is_this_user_reacted': False}]
+    assert reacts2 == [{'react_id': 1, 'u_ids': [testing_data['ID2']], 'is_this_user_reacted': True}]
+
 def test_message_react_invalid_message(testing_data):
     #message_id is not a valid message within a channel or DM that the authorised user has joined
     with pytest.raises(InputError):
@@ -500,11 +512,16 @@ def test_message_sendlater_5_seconds(testing_data):
     message = message_sendlater_v1(testing_data['ID1'], testing_data['CH1'], "Hello", timestamp)
     end = time.time()
 
-    assert int(end - start) == 5
+    # Returns straight away, and the message appears once the time comes
+    assert int(end - start) == 0
+    assert channel_messages_v1(testing_data['ID1'], testing_data['CH1'], 0)['messages'] == []
+    time.sleep(max(timestamp - time.time(), 0))
+    assert scheduler.wait_until_delivered(timeout=5)
     messages = channel_messages_v1(testing_data['ID1'], testing_data['CH1'], 0)
-    message = messages['messages'][0]
+    sent = messages['messages'][0]
     
-    assert message['message'] == 'Hello'
+    assert sent['message'] == 'Hello'
+    assert sent['message_id'] == message['message_id']
 
 ######################################################################################################################
 
@@ -551,8 +568,11 @@ def test_message_sendlaterdm_5_seconds(testing_data):
     timestamp = time.time()
     timestamp = timestamp + 5
     start = time.time()
-    message_sendlaterdm_v1(testing_data['ID1'], dm_id, "hello", timestamp)
+    message = message_sendlaterdm_v1(testing_data['ID1'], dm_id, "hello", timestamp)
     end = time.time()
 
-    assert int(end - start) == 5
+    assert int(end - start) == 0
+    time.sleep(max(timestamp - time.time(), 0))
+    assert scheduler.wait_until_delivered(timeout=5)
+    assert dm_messages_v1(testing_data['ID1'], dm_id, 0)['messages'][0]['message_id'] == message['message_id']
 
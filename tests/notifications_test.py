@@ -0,0 +1,68 @@
+'''
+notifications_test.py
+Tests for the notification inboxes in notifications.py
+'''
+
+import pytest
+import src.notifications as notifications
+from src.auth import auth_register_v2
+from src.channels import channels_create_v2
+from src.channel import channel_invite_v1, channel_join_v1
+from src.dm import dm_create_v1, dm_invite_v1
+from src.message import message_send_v1, message_senddm_v1
+from src.other import clear_v1, notification_v1
+
+@pytest.fixture
+def users():
+    clear_v1()
+    user1 = auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    user2 = auth_register_v2("email2@gmail.com", "password2", "joel", "engelman")
+    user3 = auth_register_v2("email3@gmail.com", "password3", "krishnan", "winter")
+    channel_id = channels_create_v2(user1["token"], "channel", True)["channel_id"]
+    return user1["auth_user_id"], user2["auth_user_id"], user3["auth_user_id"], channel_id
+
+def texts(u_id):
+    return [n["notification_message"] for n in notification_v1(u_id)["notifications"]]
+
+def test_new_user_has_none(users):
+    assert notification_v1(users[0]) == {"notifications": []}
+
+def test_added_to_channel_and_dm(users):
+    u_id1, u_id2, u_id3, channel_id = users
+    channel_invite_v1(u_id1, channel_id, u_id2)
+    dm = dm_create_v1(u_id1, [u_id2, u_id2])
+    dm_invite_v1(u_id1, dm["dm_id"], u_id3)
+    channel_join_v1(u_id3, channel_id)
+
+    assert notification_v1(u_id2)["notifications"] == [
+        {"channel_id": -1, "dm_id": dm["dm_id"], "notification_message": f"davidpeng added you to {dm['dm_name']}"},
+        {"channel_id": channel_id, "dm_id": -1, "notification_message": "davidpeng added you to channel"},
+    ]
+    assert texts(u_id3) == [f"davidpeng added you to {dm['dm_name']}"]
+    assert texts(u_id1) == []
+
+def test_tagged_members_only(users):
+    u_id1, u_id2, u_id3, channel_id = users
+    channel_join_v1(u_id2, channel_id)
+    message_send_v1(u_id1, channel_id, "hey @joelengelman and @krishnanwinter, @joelengelman @nobody")
+    assert texts(u_id2) == ["davidpeng tagged you in channel: hey @joelengelman an"]
+    assert texts(u_id3) == []
+
+    dm = dm_create_v1(u_id2, [u_id3])
+    message_senddm_v1(u_id3, dm["dm_id"], "@joelengelman hi")
+    assert notification_v1(u_id2)["notifications"][0] == {
+        "channel_id": -1,
+        "dm_id": dm["dm_id"],
+        "notification_message": f"krishnanwinter tagged you in {dm['dm_name']}: @joelengelman hi",
+    }
+
+def test_keeps_newest_twenty(users):
+    u_id1, u_id2, _, channel_id = users
+    channel_join_v1(u_id2, channel_id)
+    for i in range(notifications.CAPACITY + 5):
+        message_send_v1(u_id1, channel_id, f"@joelengelman {i}")
+
+    assert texts(u_id2) == [
+        f"davidpeng tagged you in channel: @joelengelman {i}"
+        for i in reversed(range(5, notifications.CAPACITY + 5))
+    ]
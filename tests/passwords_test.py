@@ -0,0 +1,92 @@
+'''
+passwords_test.py
+Tests for the password hashing in passwords.py
+'''
+
+import threading
+import jwt
+import pytest
+import src.passwords as passwords
+import src.store as store
+from src import config
+from src.auth import auth_register_v2, auth_login_v2
+from src.error import InputError, ServiceUnavailableError
+from src.helper import get_id_and_password
+from src.other import clear_v1
+
+@pytest.fixture
+def cheap_kdf(monkeypatch):
+    '''
+    < Makes new hashes cheap, and starts each test with a fresh pool >
+    '''
+    monkeypatch.setattr(config, "password_scrypt_n", 2 ** 10)
+    passwords.shutdown()
+    yield
+    passwords.shutdown()
+
+def test_hash_and_verify(cheap_kdf):
+    stored = passwords.hash_password("password1")
+    assert stored["kdf"] == "scrypt" and stored["n"] == 2 ** 10
+    assert "password1" not in stored.values()
+    assert passwords.verify("password1", stored)
+    assert not passwords.verify("password2", stored)
+    assert passwords.hash_password("password1")["salt"] != stored["salt"]
+
+def test_register_stores_hash(cheap_kdf):
+    clear_v1()
+    auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    stored = get_id_and_password("email@gmail.com")["password"]
+    assert isinstance(stored, dict) and stored["hash"]
+    assert auth_login_v2("email@gmail.com", "password1")["auth_user_id"] == 0
+    with pytest.raises(InputError):
+        auth_login_v2("email@gmail.com", "password2")
+
+def test_old_hashes_rehashed_on_login(monkeypatch, cheap_kdf):
+    clear_v1()
+    user = auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    monkeypatch.setattr(config, "password_scrypt_n", 2 ** 11)
+    assert passwords.needs_rehash(get_id_and_password("email@gmail.com")["password"])
+
+    auth_login_v2("email@gmail.com", "password1")
+    stored = store.get("users", user["auth_user_id"])["password"]
+    assert stored["n"] == 2 ** 11
+    assert not passwords.needs_rehash(stored)
+
+def test_legacy_jwt_passwords_accepted_and_rehashed(cheap_kdf):
+    clear_v1()
+    user = auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    legacy = jwt.encode({'password': "password1"}, "", algorithm='HS256')
+    store.update("users", user["auth_user_id"], {'password': legacy})
+
+    auth_login_v2("email@gmail.com", "password1")
+    assert isinstance(store.get("users", user["auth_user_id"])["password"], dict)
+
+def test_metrics(cheap_kdf):
+    stored = passwords.hash_password("password1")
+    passwords.verify("password1", stored)
+    passwords.verify("password2", stored)
+
+    metrics = passwords.metrics()
+    assert metrics["hash"]["count"] == 1
+    assert metrics["verify"]["count"] == 2
+    assert metrics["verify"]["run_seconds"] > 0
+    assert metrics["in_flight"] == 0
+
+def test_full_queue_rejected(monkeypatch, cheap_kdf):
+    monkeypatch.setattr(config, "password_workers", 1)
+    monkeypatch.setattr(config, "password_queue_depth", 0)
+    release = threading.Event()
+
+    def slow(*args):
+        release.wait()
+        return None, 0.0
+    running = threading.Thread(target=passwords._run, args=("hash", slow))
+    running.start()
+    while passwords.metrics()["in_flight"] == 0:
+        pass
+
+    with pytest.raises(ServiceUnavailableError):
+        passwords.hash_password("password1")
+    assert passwords.metrics()["rejected"] == 1
+    release.set()
+    running.join()
@@ -0,0 +1,100 @@
+'''
+scheduler_test.py
+Tests for the scheduled delivery of messages in scheduler.py
+'''
+
+import threading
+import time
+import pytest
+import src.scheduler as scheduler
+import src.store as store
+from src.auth import auth_register_v2
+from src.channels import channels_create_v2
+from src.channel import channel_messages_v1, channel_history_v1, channel_join_v1, channel_leave_v1
+from src.message import message_send_v1, message_sendlater_v1, message_sendlater_list_v1, message_sendlater_cancel_v1
+from src.error import InputError
+from src.helper import create_token
+from src.other import clear_v1
+
+@pytest.fixture
+def channel():
+    clear_v1()
+    user = auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    channel_id = channels_create_v2(create_token("davidpeng"), "channel", True)["channel_id"]
+    return user["auth_user_id"], channel_id
+
+def history(u_id, channel_id):
+    return [message["message_id"] for message in channel_messages_v1(u_id, channel_id, 0)["messages"]]
+
+def test_message_id_reserved(channel):
+    u_id, channel_id = channel
+    later = message_sendlater_v1(u_id, channel_id, "later", time.time() + 60)["message_id"]
+    now = message_send_v1(u_id, channel_id, "now")["message_id"]
+    assert later == 0 and now == 1
+
+    # Due straight away, as it would be after a restart
+    store.update("scheduled", later, {"time_sent": time.time()})
+    scheduler.reset()
+    assert scheduler.wait_until_delivered(timeout=5)
+    # Placed as of when it was delivered, after the message sent meanwhile
+    assert history(u_id, channel_id) == [0, 1]
+    assert store.count("scheduled") == 0
+
+def test_polling_after_sees_delivered_message(channel):
+    u_id, channel_id = channel
+    later = message_sendlater_v1(u_id, channel_id, "later", time.time() + 60)["message_id"]
+    now = message_send_v1(u_id, channel_id, "now")["message_id"]
+    page = channel_history_v1(u_id, channel_id, after_message_id=-1)
+    assert [message["message_id"] for message in page["messages"]] == [now]
+
+    store.update("scheduled", later, {"time_sent": time.time()})
+    scheduler.reset()
+    assert scheduler.wait_until_delivered(timeout=5)
+    page = channel_history_v1(u_id, channel_id, after_message_id=page["after_message_id"])
+    assert [message["message_id"] for message in page["messages"]] == [later]
+    older = channel_history_v1(u_id, channel_id, before_message_id=later)
+    assert [message["message_id"] for message in older["messages"]] == [now]
+
+def test_list_and_cancel(channel):
+    u_id, channel_id = channel
+    first = message_sendlater_v1(u_id, channel_id, "first", time.time() + 120)["message_id"]
+    second = message_sendlater_v1(u_id, channel_id, "second", time.time() + 60)["message_id"]
+
+    pending = message_sendlater_list_v1(u_id)["messages"]
+    assert [message["message_id"] for message in pending] == [second, first]
+    assert pending[0] == {"message_id": second, "channel_id": channel_id, "message": "second", "time_sent": pending[0]["time_sent"]}
+
+    message_sendlater_cancel_v1(u_id, second)
+    assert [message["message_id"] for message in message_sendlater_list_v1(u_id)["messages"]] == [first]
+    with pytest.raises(InputError):
+        message_sendlater_cancel_v1(u_id, second)
+    with pytest.raises(InputError):
+        message_sendlater_cancel_v1(u_id + 1, first)
+
+def test_cancelled_never_delivered(channel):
+    u_id, channel_id = channel
+    message_id = message_sendlater_v1(u_id, channel_id, "cancelled", time.time() + 1)["message_id"]
+    message_sendlater_cancel_v1(u_id, message_id)
+    time.sleep(1.2)
+    assert scheduler.wait_until_delivered(timeout=5)
+    assert history(u_id, channel_id) == []
+
+def test_not_delivered_after_leaving(channel):
+    _, channel_id = channel
+    u_id = auth_register_v2("email2@gmail.com", "password2", "joel", "engelman")["auth_user_id"]
+    channel_join_v1(u_id, channel_id)
+    message_id = message_sendlater_v1(u_id, channel_id, "hello", time.time() + 60)["message_id"]
+    channel_leave_v1(u_id, channel_id)
+    store.update("scheduled", message_id, {"time_sent": time.time()})
+    scheduler.reset()
+    assert scheduler.wait_until_delivered(timeout=5)
+    assert store.get("messages", message_id) is None
+    assert store.count("scheduled") == 0
+
+def test_one_thread_for_many_messages(channel):
+    u_id, channel_id = channel
+    threads = threading.active_count()
+    for i in range(1000):
+        message_sendlater_v1(u_id, channel_id, str(i), time.time() + 3600)
+    assert threading.active_count() <= threads + 1
+    assert len(message_sendlater_list_v1(u_id)["messages"]) == 1000
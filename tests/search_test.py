@@ -0,0 +1,129 @@
+'''
+search_test.py
+Tests for the inverted index in search.py behind search_v1
+'''
+
+import pytest
+import src.search as search
+from src.auth import auth_register_v2
+from src.admin import admin_user_remove_v1
+from src.channels import channels_create_v2
+from src.channel import channel_join_v1
+from src.dm import dm_create_v1, dm_remove_v1
+from src.error import InputError
+from src.message import message_send_v1, message_senddm_v1, message_edit_v1, message_remove_v1
+from src.other import clear_v1, search_v1
+
+@pytest.fixture
+def users():
+    clear_v1()
+    user1 = auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    user2 = auth_register_v2("email2@gmail.com", "password2", "joel", "engelman")
+    channel_id = channels_create_v2(user1["token"], "channel", True)["channel_id"]
+    return user1, user2, channel_id
+
+def search_ids(u_id, query_str, limit=50):
+    return [message["message_id"] for message in search_v1(u_id, query_str, limit)["messages"]]
+
+def test_all_terms_must_match(users):
+    user1, _, channel_id = users
+    u_id = user1["auth_user_id"]
+    both = message_send_v1(u_id, channel_id, "Deploy the ticket today")["message_id"]
+    message_send_v1(u_id, channel_id, "deploy tomorrow")
+    message_send_v1(u_id, channel_id, "a ticket")
+
+    assert search_ids(u_id, "TICKET deploy") == [both]
+    assert len(search_ids(u_id, "deploy")) == 2
+    assert search_ids(u_id, "deploy nothing") == []
+    assert search_ids(u_id, "  ") == []
+
+def test_newest_first_with_limit(users):
+    user1, _, channel_id = users
+    u_id = user1["auth_user_id"]
+    ids = [message_send_v1(u_id, channel_id, f"hello {i}")["message_id"] for i in range(10)]
+
+    assert search_ids(u_id, "hello") == ids[::-1]
+    assert search_ids(u_id, "hello", 3) == ids[:6:-1]
+    with pytest.raises(InputError):
+        search_v1(u_id, "hello", 0)
+
+def test_only_member_conversations(users):
+    user1, user2, channel_id = users
+    in_channel = message_send_v1(user1["auth_user_id"], channel_id, "hello")["message_id"]
+    dm_id = dm_create_v1(user1["auth_user_id"], [user2["auth_user_id"]])["dm_id"]
+    in_dm = message_senddm_v1(user1["auth_user_id"], dm_id, "hello")["message_id"]
+
+    assert search_ids(user1["auth_user_id"], "hello") == [in_dm, in_channel]
+    assert search_ids(user2["auth_user_id"], "hello") == [in_dm]
+    channel_join_v1(user2["auth_user_id"], channel_id)
+    assert search_ids(user2["auth_user_id"], "hello") == [in_dm, in_channel]
+
+def test_removed_dm_is_not_searched(users):
+    user1, user2, channel_id = users
+    in_channel = message_send_v1(user1["auth_user_id"], channel_id, "hello")["message_id"]
+    dm_id = dm_create_v1(user1["auth_user_id"], [user2["auth_user_id"]])["dm_id"]
+    message_senddm_v1(user2["auth_user_id"], dm_id, "hello")
+
+    dm_remove_v1(user1["auth_user_id"], dm_id)
+    assert search_ids(user1["auth_user_id"], "hello") == [in_channel]
+    assert search_ids(user2["auth_user_id"], "hello") == []
+
+def test_index_follows_edit_and_remove(users):
+    user1, user2, channel_id = users
+    u_id = user1["auth_user_id"]
+    first = message_send_v1(u_id, channel_id, "hello world")["message_id"]
+    second = message_send_v1(u_id, channel_id, "hello there")["message_id"]
+
+    message_edit_v1(u_id, first, "goodbye world")
+    assert search_ids(u_id, "hello") == [second]
+    assert search_ids(u_id, "goodbye") == [first]
+
+    message_remove_v1(u_id, second)
+    assert search_ids(u_id, "hello") == []
+
+    channel_join_v1(user2["auth_user_id"], channel_id)
+    message_send_v1(user2["auth_user_id"], channel_id, "goodbye")
+    admin_user_remove_v1(user1["token"], user2["auth_user_id"])
+    assert search_ids(u_id, "goodbye") == [first]
+    assert len(search_ids(u_id, "removed user")) == 1
+
+def test_index_is_rebuilt_from_store(users):
+    user1, _, channel_id = users
+    u_id = user1["auth_user_id"]
+    message_id = message_send_v1(u_id, channel_id, "hello")["message_id"]
+
+    search.reset()
+    assert search_ids(u_id, "hello") == [message_id]
+
+def test_substring_mode(users):
+    user1, user2, channel_id = users
+    u_id = user1["auth_user_id"]
+    ticket = message_send_v1(u_id, channel_id, "Closing Ticket #12 now")["message_id"]
+    message_send_v1(u_id, channel_id, "ticket #1")
+    deploy = message_send_v1(u_id, channel_id, "redeployed")["message_id"]
+
+    result = search_v1(u_id, "ticket #12", mode="substring")
+    assert [message["message_id"] for message in result["messages"]] == [ticket]
+    assert result["candidates_checked"] == 1
+    assert [message["message_id"] for message in search_v1(u_id, "deploy", mode="substring")["messages"]] == [deploy]
+    assert search_v1(user2["auth_user_id"], "deploy", mode="substring")["messages"] == []
+
+    # Too short to have trigrams, so every message is a candidate
+    result = search_v1(u_id, "#1", mode="substring")
+    assert len(result["messages"]) == 2
+    assert result["candidates_checked"] == 3
+
+    with pytest.raises(InputError):
+        search_v1(u_id, "deploy", mode="regex")
+
+def test_substring_index_follows_edit_and_remove(users):
+    user1, _, channel_id = users
+    u_id = user1["auth_user_id"]
+    message_id = message_send_v1(u_id, channel_id, "deploy friday")["message_id"]
+
+    message_edit_v1(u_id, message_id, "ship monday")
+    assert search_v1(u_id, "deploy", mode="substring") == {"messages": [], "candidates_checked": 0}
+    assert len(search_v1(u_id, "monday", mode="substring")["messages"]) == 1
+
+    message_remove_v1(u_id, message_id)
+    assert search_v1(u_id, "monday", mode="substring") == {"messages": [], "candidates_checked": 0}
@@ -0,0 +1,113 @@
+'''
+sessions_test.py
+Tests for the login sessions in sessions.py
+'''
+
+import pytest
+import src.sessions as sessions
+import src.store as store
+from src import config
+from src.auth import auth_register_v2
+from src.admin import admin_user_remove_v1
+from src.helper import token_active
+from src.other import clear_v1
+
+class Clock:
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    '''
+    < Replaces the time seen by sessions.py with a clock the test moves by hand >
+    '''
+    fake = Clock()
+    monkeypatch.setattr(sessions, "time", fake)
+    monkeypatch.setattr(config, "session_idle_ttl", 100)
+    monkeypatch.setattr(config, "session_absolute_ttl", 1000)
+    monkeypatch.setattr(config, "session_sweep_interval", 10)
+    monkeypatch.setattr(config, "session_touch_interval", 0)
+    clear_v1()
+    return fake
+
+@pytest.fixture
+def users(clock):
+    user1 = auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    user2 = auth_register_v2("email2@gmail.com", "password2", "joel", "engelman")
+    return user1, user2
+
+def test_start_and_end(users):
+    user1, _ = users
+    session = sessions.start(user1["token"], user1["auth_user_id"])
+    assert token_active(user1["token"])
+    assert store.get("sessions", session["session_id"])["u_id"] == user1["auth_user_id"]
+
+    assert sessions.end(user1["token"])
+    assert not sessions.end(user1["token"])
+    assert not token_active(user1["token"])
+    assert store.get("sessions", session["session_id"]) is None
+
+def test_idle_and_absolute_expiry(clock, users):
+    user1, user2 = users
+    sessions.start(user1["token"], user1["auth_user_id"])
+    sessions.start(user2["token"], user2["auth_user_id"])
+
+    clock.now += 90
+    assert token_active(user1["token"])
+    clock.now += 90
+    assert token_active(user1["token"])
+    assert not token_active(user2["token"])
+
+    # Using a session does not keep it alive past the absolute limit
+    for _ in range(11):
+        clock.now += 90
+        token_active(user1["token"])
+    assert not token_active(user1["token"])
+
+def test_sweep_drops_unused_sessions(clock, users):
+    user1, user2 = users
+    for i in range(5):
+        sessions.start(f"token{i}", user1["auth_user_id"])
+    sessions.start(user2["token"], user2["auth_user_id"])
+    assert sessions.count() == 6
+
+    clock.now += 60
+    assert token_active(user2["token"])
+    clock.now += 60
+    assert token_active(user2["token"])
+    assert sessions.count() == 1
+    assert len(store.scan("sessions")) == 1
+
+def test_oldest_session_ended_past_limit(monkeypatch, users):
+    user1, _ = users
+    monkeypatch.setattr(config, "max_sessions_per_user", 3)
+    for i in range(5):
+        sessions.start(f"token{i}", user1["auth_user_id"])
+
+    assert [session["token"] for session in sessions.user_sessions(user1["auth_user_id"])] == ["token2", "token3", "token4"]
+    assert not token_active("token1")
+
+def test_removed_user_is_logged_out(users):
+    user1, user2 = users
+    sessions.start(user2["token"], user2["auth_user_id"])
+    sessions.start("another", user2["auth_user_id"])
+
+    admin_user_remove_v1(user1["token"], user2["auth_user_id"])
+    assert sessions.user_sessions(user2["auth_user_id"]) == []
+    assert not token_active("another")
+
+def test_sessions_survive_reload(clock, users):
+    user1, user2 = users
+    sessions.start(user1["token"], user1["auth_user_id"])
+    sessions.start(user2["token"], user2["auth_user_id"])
+    clock.now += 60
+    token_active(user1["token"])
+
+    sessions.reset()
+    clock.now += 60
+    assert token_active(user1["token"])
+    assert not token_active(user2["token"])
+    assert [session["u_id"] for session in store.scan("sessions")] == [user1["auth_user_id"]]
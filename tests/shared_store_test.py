@@ -0,0 +1,137 @@
+'''
+shared_store_test.py
+Tests for sharing the store between server processes, with store.share and
+the SQLite engine. The other processes are started with their own
+interpreter, as a server's workers would be
+'''
+
+import json
+import os
+import subprocess
+import sys
+import time
+import pytest
+import src.store as store
+import src.sessions as sessions
+import src.search as search
+from src import config
+from src.sqlite_engine import SQLiteEngine
+from src.json_engine import JSONEngine
+from src.auth import auth_register_v2
+from src.channels import channels_create_v2
+from src.message import message_send_v1
+from src.helper import create_token, token_active
+from src.other import clear_v1, search_v1
+import src.stats as stats
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run first in every other process, with the paths of the shared files as
+# its arguments
+PREAMBLE = '''
+import json, sys, time
+from src import config
+config.data_path, config.sqlite_path, config.lock_path = sys.argv[1:4]
+config.storage_engine = "sqlite"
+import src.store as store
+import src.helper as helper
+store.share(config.lock_path)
+helper.init_data()
+'''
+
+@pytest.fixture
+def shared(tmp_path, monkeypatch):
+    '''
+    < Points the store at a SQLite database in a temporary directory and
+    shares it, as the parent of a server's workers would >
+    '''
+    paths = [str(tmp_path / name) for name in ("data.json", "data.db", "data.lock")]
+    monkeypatch.setattr(config, "data_path", paths[0])
+    monkeypatch.setattr(config, "sqlite_path", paths[1])
+    monkeypatch.setattr(config, "lock_path", paths[2])
+    monkeypatch.setattr(config, "sync_interval", 0.1)
+    engine = SQLiteEngine()
+    monkeypatch.setattr(store, "_engine", engine)
+    for name in ("_lock", "_stripes", "_shared", "_lock_path", "_exclusive"):
+        monkeypatch.setattr(store, name, getattr(store, name))
+    store.share(paths[2])
+    clear_v1()
+    yield paths
+    engine.shutdown()
+
+def start(paths, code):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT] + os.environ.get("PYTHONPATH", "").split(os.pathsep)))
+    return subprocess.Popen(
+        [sys.executable, "-c", PREAMBLE + code] + paths,
+        cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+
+def finish(process):
+    out, err = process.communicate(timeout=60)
+    assert process.returncode == 0, err
+    return out
+
+def test_processes_send_with_unique_ids(shared):
+    owner = auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    channel_ids = [channels_create_v2(owner["token"], f"channel {i}", True)["channel_id"] for i in range(2)]
+
+    workers = [start(shared, f'''
+from src.message import message_send_v1
+ids = [message_send_v1({owner["auth_user_id"]}, {channel_ids}[i % 2], "{worker}-" + str(i))["message_id"] for i in range(50)]
+print(json.dumps(ids))
+''') for worker in range(4)]
+    ids = [message_id for worker in workers for message_id in json.loads(finish(worker))]
+
+    with store.reading():
+        assert len(set(ids)) == len(ids) == 200
+        assert sum(store.history_count("channel_id", channel_id) for channel_id in channel_ids) == 200
+        assert store.get("stats", stats.DREAMS)["messages_exist"] == 200
+        assert store.get("stats", owner["auth_user_id"])["messages_sent"] == 200
+
+def test_changes_of_other_processes_are_seen(shared):
+    owner = auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    channel_id = channels_create_v2(owner["token"], "channel", True)["channel_id"]
+    message_send_v1(owner["auth_user_id"], channel_id, "hello world")
+    assert len(search_v1(owner["auth_user_id"], "hello")["messages"]) == 1
+    session_id = sessions.next_session_id()
+    token = create_token("davidpeng", owner["auth_user_id"], session_id)
+    assert not token_active(token)
+
+    finish(start(shared, f'''
+from src.message import message_send_v1, message_sendlater_v1
+import src.sessions as sessions
+message_send_v1({owner["auth_user_id"]}, {channel_id}, "hello again")
+message_sendlater_v1({owner["auth_user_id"]}, {channel_id}, "hello later", time.time() + 0.5)
+sessions.start({token!r}, {owner["auth_user_id"]}, {session_id})
+'''))
+
+    with store.reading():
+        # Brought up to date record by record, rather than built again
+        assert search._built
+        assert len(search_v1(owner["auth_user_id"], "hello")["messages"]) == 2
+        assert token_active(token)
+
+    # The other process has stopped, so this one delivers its scheduled message
+    deadline = time.time() + 5
+    while store.count("scheduled") and time.time() < deadline:
+        time.sleep(0.05)
+    with store.reading():
+        assert len(search_v1(owner["auth_user_id"], "hello")["messages"]) == 3
+
+def test_locks_exclude_other_processes(shared):
+    worker = start(shared, '''
+with store.writing():
+    print("held", flush=True)
+    time.sleep(0.5)
+''')
+    assert worker.stdout.readline().strip() == "held"
+    started = time.time()
+    with store.reading():
+        assert time.time() - started > 0.3
+    finish(worker)
+
+def test_share_needs_sqlite(monkeypatch):
+    monkeypatch.setattr(store, "_engine", JSONEngine())
+    with pytest.raises(ValueError):
+        store.share("unused.lock")
+    assert not store.shared()
@@ -0,0 +1,152 @@
+'''
+sqlite_engine_test.py
+Tests for the SQLite storage engine
+'''
+
+import json
+import sqlite3
+import pytest
+import src.store as store
+from src import config
+from src.sqlite_engine import SQLiteEngine
+from src.auth import auth_register_v2
+from src.channels import channels_create_v2
+from src.channel import channel_join_v1
+from src.message import message_send_v1, message_react_v1, message_remove_v1
+from src.helper import get_message, token_decode
+from src.other import clear_v1
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    '''
+    < Points the store at a SQLite engine with a temporary database >
+    '''
+    monkeypatch.setattr(config, "data_path", str(tmp_path / "data.json"))
+    monkeypatch.setattr(config, "sqlite_path", str(tmp_path / "data.db"))
+    engine = SQLiteEngine()
+    monkeypatch.setattr(store, "_engine", engine)
+    clear_v1()
+    yield tmp_path / "data.db"
+    engine.shutdown()
+
+@pytest.fixture
+def activity(db):
+    '''
+    < Registers two users, a channel and some messages and reacts >
+    '''
+    user1 = auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    user2 = auth_register_v2("email2@gmail.com", "password2", "joel", "engelman")
+    channel_id = channels_create_v2(user1["token"], "channel", True)["channel_id"]
+    channel_join_v1(user2["auth_user_id"], channel_id)
+    for i in range(10):
+        message_send_v1(user1["auth_user_id"], channel_id, f"message {i}")
+    message_react_v1(user2["auth_user_id"], 3, 1)
+    return {"user1": user1, "user2": user2, "channel_id": channel_id}
+
+def test_changes_are_committed_to_the_database(db, activity):
+    con = sqlite3.connect(db)
+    assert con.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 2
+    assert con.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 10
+    body = con.execute("SELECT body FROM messages WHERE message_id = 3").fetchone()[0]
+    con.close()
+    assert json.loads(body)["reacts"]["1"] == [activity["user2"]["auth_user_id"]]
+
+def test_database_survives_reopen(db, activity):
+    expected = store.export()
+    store.engine().shutdown()
+
+    reopened = SQLiteEngine()
+    assert reopened.export() == expected
+    reopened.shutdown()
+
+def test_indexed_lookups(activity):
+    user1 = activity["user1"]
+    assert store.find("users", "email", "email2@gmail.com")["u_id"] == activity["user2"]["auth_user_id"]
+    assert token_decode(user1["token"]) == user1["auth_user_id"]
+    assert len(store.find_all("messages", "u_id", user1["auth_user_id"])) == 10
+    assert store.find("users", "email", "nobody@gmail.com") is None
+
+def test_list_mutations(activity):
+    channel_id = activity["channel_id"]
+    user2 = activity["user2"]["auth_user_id"]
+    store.remove("channels", channel_id, "all_members", user2)
+    store.remove("channels", channel_id, "all_members", user2)
+    assert user2 not in store.get("channels", channel_id)["all_members"]
+    assert not store.contains("channels", channel_id, "all_members", user2)
+
+    store.append("channels", channel_id, "all_members", user2)
+    store.append("channels", channel_id, "all_members", user2)
+    assert store.get("channels", channel_id)["all_members"].count(user2) == 1
+    assert store.contains("channels", channel_id, "all_members", user2)
+    assert not store.contains("channels", channel_id, "owner_members", user2)
+
+def test_delete_many(db, activity):
+    other = SQLiteEngine(str(db))
+    other.changes()
+    store.delete_many("messages", [2, 3, 99])
+    assert [message["message_id"] for message in store.scan("messages")] == [0, 1, 4, 5, 6, 7, 8, 9]
+    assert store.history_count("channel_id", activity["channel_id"]) == 8
+    assert other.changes() == {"messages": {2, 3, 99}}
+    other.shutdown()
+
+def test_history_pages(activity):
+    channel_id = activity["channel_id"]
+    message_remove_v1(activity["user1"]["auth_user_id"], 4)
+    page = [message["message_id"] for message in store.history("channel_id", channel_id, 4, before=7)]
+    assert page == [6, 5, 3, 2]
+    assert [message["message_id"] for message in store.history("channel_id", channel_id, 3, after=2)] == [6, 5, 3]
+    assert [message["message_id"] for message in store.history("channel_id", channel_id, 2, offset=7)] == [1, 0]
+    assert store.history_count("channel_id", channel_id) == 9
+
+def test_history_follows_position(activity):
+    channel_id = activity["channel_id"]
+    store.insert("messages", dict(store.get("messages", 2), position=100))
+    assert [message["message_id"] for message in store.history("channel_id", channel_id, 2)] == [2, 9]
+    assert [message["message_id"] for message in store.history("channel_id", channel_id, 5, after=9)] == [2]
+    assert [message["message_id"] for message in store.history("channel_id", channel_id, 1, before=2)] == [9]
+
+def test_failed_change_is_rolled_back(activity):
+    with pytest.raises(KeyError):
+        store.append("messages", 0, "no_such_field", 1)
+    store.update("messages", 0, {"message": "edited"})
+    assert get_message(0)["message"] == "edited"
+
+def test_new_database_imports_json_snapshot(tmp_path, monkeypatch):
+    snapshot = {
+        "users": [{"u_id": 0, "email": "email@gmail.com", "handle_str": "davidpeng", "channels": [], "dms": []}],
+        "channels": [{"channel_id": 1, "name": "channel"}],
+        "dms": [],
+        "messages": [],
+        "stats": [{"stats_id": 0, "channels_joined": 0}],
+    }
+    (tmp_path / "data.json").write_text(json.dumps(snapshot))
+    monkeypatch.setattr(config, "data_path", str(tmp_path / "data.json"))
+    monkeypatch.setattr(config, "sqlite_path", str(tmp_path / "data.db"))
+
+    engine = SQLiteEngine()
+    assert engine.export() == dict(snapshot, notifications=[], sessions=[], outbox=[], reset_codes=[], scheduled=[], standups=[], standup_lines=[], sequences=[])
+    assert engine.find("users", "handle_str", "davidpeng")["u_id"] == 0
+    assert engine.max_key("channels") == 1
+    engine.shutdown()
+
+def test_changes_of_other_connections(db, monkeypatch):
+    monkeypatch.setattr(config, "change_log_size", 4)
+    mine, other = store.engine(), SQLiteEngine(str(db))
+    assert mine.changes() == {}
+
+    other.commit({"op": "insert", "table": "users", "value": {"u_id": 5, "email": "a", "handle_str": "a"}})
+    mine.commit({"op": "insert", "table": "users", "value": {"u_id": 6, "email": "b", "handle_str": "b"}})
+    other.commit({"op": "update", "table": "users", "key": 5, "fields": {"email": "c"}})
+    other.increment("sequences", 0, "high_water", 10, {"sequence_id": 0, "kind": "users", "high_water": 0})
+    assert mine.changes() == {"users": {5}, "sequences": {0}}
+    assert other.changes() == {"users": {6}}
+    assert mine.changes() == {}
+
+    # Once the rows this connection has not read are dropped, or the store
+    # is cleared, which records changed is no longer known
+    for i in range(8):
+        other.commit({"op": "update", "table": "users", "key": 5, "fields": {"email": str(i)}})
+    assert mine.changes() == dict.fromkeys(store.TABLE_KEYS)
+    other.clear()
+    assert mine.changes() == dict.fromkeys(store.TABLE_KEYS)
+    other.shutdown()
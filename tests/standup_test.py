@@ -18,6 +18,10 @@ from src.error import AccessError, InputError
 from src.helper import create_token, get_user
 from src.other import clear_v1
 from time import sleep
+from src import config
+import src.standup as standup
+import src.store as store
+import threading
 
 @pytest.fixture
 def register_users_channels():
@@ -223,3 +227,56 @@ def test_standup_send_valid(register_users_channels):
     standup_messages = f"{handle_str}: Test Message 1\n" + f"{handle_str}: Test Message 2\n"
 
     assert messages['message'] == standup_messages'''
+
+def test_standup_send_joined_at_finish(register_users_channels):
+    token = register_users_channels['owner']['token']
+    u_id = register_users_channels['owner']['auth_user_id']
+    channel_id = register_users_channels['c_id2']
+    member_token = register_users_channels['member']['token']
+
+    standup_start_v1(token, channel_id, 1)
+    standup_send_v1(token, channel_id, 'Test Message 1')
+    standup_send_v1(member_token, channel_id, 'Test Message 2')
+    sleep(1)
+    assert standup.wait_until_finished(timeout=5)
+
+    messages = channel_messages_v1(u_id, channel_id, 0)['messages']
+    assert messages[0]['u_id'] == u_id
+    assert messages[0]['message'] == "haydensmith: Test Message 1\nnadyaulibasa: Test Message 2\n"
+    assert standup_active_v1(token, channel_id) == {'is_active': False, 'time_finish': None}
+    assert store.count('standups') == 0 and store.count('standup_lines') == 0
+
+def test_standup_send_buffer_full(register_users_channels, monkeypatch):
+    token = register_users_channels['owner']['token']
+    channel_id = register_users_channels['c_id2']
+    monkeypatch.setattr(config, "standup_max_buffer", 40)
+
+    standup_start_v1(token, channel_id, 60)
+    standup_send_v1(token, channel_id, 'a' * 20)
+    with pytest.raises(InputError):
+        standup_send_v1(token, channel_id, 'a' * 20)
+
+def test_standup_survives_restart(register_users_channels):
+    token = register_users_channels['owner']['token']
+    u_id = register_users_channels['owner']['auth_user_id']
+    channel_id = register_users_channels['c_id2']
+
+    time_finish = standup_start_v1(token, channel_id, 60)['time_finish']
+    standup_send_v1(token, channel_id, 'before restart')
+    standup.reset()
+    assert standup_active_v1(token, channel_id) == {'is_active': True, 'time_finish': time_finish}
+
+    # Its time passed while the server was down
+    store.update('standups', channel_id, {'time_finish': time_finish - 60})
+    standup.reset()
+    assert standup.wait_until_finished(timeout=5)
+    assert channel_messages_v1(u_id, channel_id, 0)['messages'][0]['message'] == "haydensmith: before restart\n"
+
+def test_standup_many_concurrent(register_users_channels):
+    token = register_users_channels['owner']['token']
+    channel_ids = [channels_create_v2(token, f"Channel{i}", True)['channel_id'] for i in range(200)]
+    threads = threading.active_count()
+    for channel_id in channel_ids:
+        standup_start_v1(token, channel_id, 60)
+    assert threading.active_count() <= threads + 1
+    assert all(standup_active_v1(token, channel_id)['is_active'] for channel_id in channel_ids)
@@ -0,0 +1,95 @@
+'''
+stats_test.py
+Tests for the running counters in stats.py
+'''
+
+import pytest
+from src import config
+from src.auth import auth_register_v2
+from src.channels import channels_create_v2
+from src.channel import channel_join_v1, channel_leave_v1
+from src.dm import dm_create_v1, dm_remove_v1
+from src.message import message_send_v1, message_senddm_v1, message_remove_v1
+from src.user import user_stats_v1, users_stats_v1
+from src.other import clear_v1
+
+@pytest.fixture
+def users():
+    clear_v1()
+    user1 = auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    user2 = auth_register_v2("email2@gmail.com", "password2", "joel", "engelman")
+    return user1, user2
+
+def test_new_user_starts_at_zero(users):
+    user1, _ = users
+    user = user_stats_v1(user1["token"])
+    assert user["channels_joined"]["num_channels_joined"] == 0
+    assert user["dms_joined"]["num_dms_joined"] == 0
+    assert user["messages_sent"]["num_messages_sent"] == 0
+    dreams = users_stats_v1(user1["token"])
+    assert dreams["channels_exist"]["num_channels_exist"] == 0
+    assert dreams["dms_exist"]["num_dms_exist"] == 0
+    assert dreams["messages_exist"]["num_messages_exist"] == 0
+
+def test_counters_follow_leaving_and_removing(users):
+    user1, user2 = users
+    channel_id = channels_create_v2(user1["token"], "channel", True)["channel_id"]
+    channel_join_v1(user2["auth_user_id"], channel_id)
+    message_id = message_send_v1(user2["auth_user_id"], channel_id, "hello")["message_id"]
+    dm_id = dm_create_v1(user1["auth_user_id"], [user2["auth_user_id"]])["dm_id"]
+    message_senddm_v1(user2["auth_user_id"], dm_id, "hello")
+
+    user = user_stats_v1(user2["token"])
+    assert user["channels_joined"]["num_channels_joined"] == 1
+    assert user["dms_joined"]["num_dms_joined"] == 1
+    assert user["messages_sent"]["num_messages_sent"] == 2
+    assert users_stats_v1(user1["token"])["messages_exist"]["num_messages_exist"] == 2
+
+    channel_leave_v1(user2["auth_user_id"], channel_id)
+    message_remove_v1(user2["auth_user_id"], message_id)
+    dm_remove_v1(user1["auth_user_id"], dm_id)
+
+    user = user_stats_v1(user2["token"])
+    assert user["channels_joined"]["num_channels_joined"] == 0
+    assert user["dms_joined"]["num_dms_joined"] == 0
+    assert user["messages_sent"]["num_messages_sent"] == 2
+    dreams = users_stats_v1(user1["token"])
+    assert dreams["channels_exist"]["num_channels_exist"] == 1
+    assert dreams["dms_exist"]["num_dms_exist"] == 0
+    assert dreams["messages_exist"]["num_messages_exist"] == 0
+
+def test_time_stamp_follows_its_own_metric(users):
+    user1, _ = users
+    before = user_stats_v1(user1["token"])
+    channels_create_v2(user1["token"], "channel", True)
+    after = user_stats_v1(user1["token"])
+    assert after["channels_joined"]["time_stamp"] >= before["channels_joined"]["time_stamp"]
+    assert after["dms_joined"] == before["dms_joined"]
+    assert after["messages_sent"] == before["messages_sent"]
+
+def test_history_gains_a_sample_per_change(users):
+    user1, user2 = users
+    history = user_stats_v1(user1["token"])["history"]
+    assert [sample["num_channels_joined"] for sample in history["channels_joined"]] == [0]
+
+    channel_id = channels_create_v2(user1["token"], "channel", True)["channel_id"]
+    channel_join_v1(user2["auth_user_id"], channel_id)
+    channel_leave_v1(user2["auth_user_id"], channel_id)
+
+    history = user_stats_v1(user2["token"])["history"]
+    assert [sample["num_channels_joined"] for sample in history["channels_joined"]] == [0, 1, 0]
+    assert [sample["num_messages_sent"] for sample in history["messages_sent"]] == [0]
+    stamps = [sample["time_stamp"] for sample in history["channels_joined"]]
+    assert stamps == sorted(stamps)
+    assert history["channels_joined"][-1] == user_stats_v1(user2["token"])["channels_joined"]
+    dreams = users_stats_v1(user1["token"])["history"]
+    assert [sample["num_channels_exist"] for sample in dreams["channels_exist"]] == [0, 1]
+
+def test_history_keeps_only_the_newest_samples(users, monkeypatch):
+    monkeypatch.setattr(config, "stats_history_size", 3)
+    user1, _ = users
+    channel_id = channels_create_v2(user1["token"], "channel", True)["channel_id"]
+    for message in range(5):
+        message_send_v1(user1["auth_user_id"], channel_id, str(message))
+    history = user_stats_v1(user1["token"])["history"]
+    assert [sample["num_messages_sent"] for sample in history["messages_sent"]] == [3, 4, 5]
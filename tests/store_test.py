@@ -0,0 +1,236 @@
+'''
+store_test.py
+Tests for the write-ahead log and snapshots of the JSON storage engine
+'''
+
+import copy
+import json
+import time
+import pytest
+import src.data as d
+import src.store as store
+from src import config
+from src.json_engine import JSONEngine
+from src.auth import auth_register_v2
+from src.channels import channels_create_v2
+from src.channel import channel_join_v1, channel_messages_v1
+from src.message import message_send_v1, message_react_v1, message_remove_v1
+from src.other import clear_v1
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    '''
+    < Points a JSON engine at a temporary snapshot and log and stops the flusher
+    from writing on its own so each test controls when writes happen >
+    '''
+    # Changes still queued by the previous engine must not land in this log
+    store.flush()
+    engine = JSONEngine()
+    monkeypatch.setattr(store, "_engine", engine)
+    monkeypatch.setattr(config, "data_path", str(tmp_path / "data.json"))
+    monkeypatch.setattr(config, "log_path", str(tmp_path / "data.log"))
+    monkeypatch.setattr(config, "flush_interval", 60)
+    monkeypatch.setattr(config, "flush_threshold", 10000)
+    monkeypatch.setattr(config, "snapshot_threshold", 10000)
+    clear_v1()
+    yield {"data": tmp_path / "data.json", "log": tmp_path / "data.log"}
+    engine.shutdown()
+
+@pytest.fixture
+def activity(files):
+    '''
+    < Registers two users, a channel and some messages and reacts >
+    '''
+    user1 = auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    user2 = auth_register_v2("email2@gmail.com", "password2", "joel", "engelman")
+    channel_id = channels_create_v2(user1["token"], "channel", True)["channel_id"]
+    channel_join_v1(user2["auth_user_id"], channel_id)
+    for i in range(10):
+        message_send_v1(user1["auth_user_id"], channel_id, f"message {i}")
+    message_react_v1(user2["auth_user_id"], 3, 1)
+    return files
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+def read_log(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+def test_clear_is_written_immediately(files):
+    assert read_json(files["data"]) == {table: [] for table in store.TABLE_KEYS}
+    assert read_log(files["log"]) == []
+
+def test_mutations_are_small_log_records(activity):
+    assert read_log(activity["log"]) == []
+    queued = store.engine().queued_records()
+
+    assert store.flush() == queued
+    log = read_log(activity["log"])
+    assert len(log) == queued
+    inserts = [entry["table"] for entry in log if entry["op"] == "insert"]
+    assert len([table for table in inserts if table in ("users", "channels", "messages")]) == 2 + 1 + 10
+    send = [entry for entry in log if entry["op"] == "insert" and entry["table"] == "messages"][0]
+    assert send["value"]["message"] == "message 0"
+
+    # The snapshot is untouched until the log is compacted
+    assert read_json(activity["data"])["messages"] == []
+
+def test_load_replays_log_tail(activity):
+    store.flush()
+    expected = copy.deepcopy(d.data)
+
+    d.data = {}
+    assert store.load() == len(read_log(activity["log"]))
+    assert d.data == expected
+
+def test_torn_final_record_is_ignored(activity):
+    store.flush()
+    expected = copy.deepcopy(d.data)
+    with open(activity["log"], "a") as f:
+        f.write('{"op": "insert", "table": "messa')
+
+    store.load()
+    assert d.data == expected
+
+def test_writes_after_torn_record_survive_restart(activity):
+    store.flush()
+    with open(activity["log"], "a") as f:
+        f.write('{"op": "insert", "table": "messa')
+    store.load()
+
+    owner = store.first("users")
+    channel_ids = [channels_create_v2(auth_register_v2(f"email{i}@gmail.com", "password1", "new", "user")["token"], f"after {i}", True)["channel_id"] for i in range(2)]
+    store.flush()
+    store.load()
+    assert store.get("users", owner["u_id"]) is not None
+    assert all(store.get("channels", channel_id) is not None for channel_id in channel_ids)
+    assert all(line.endswith("\n") for line in open(activity["log"]))
+
+def test_snapshot_compacts_log(activity):
+    store.snapshot()
+    assert read_log(activity["log"]) == []
+    assert read_json(activity["data"]) == {table: list(records.values()) for table, records in d.data.items()}
+
+def test_compaction_after_threshold(files, monkeypatch):
+    monkeypatch.setattr(config, "snapshot_threshold", 5)
+    user = auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    channel_id = channels_create_v2(user["token"], "channel", True)["channel_id"]
+    for i in range(5):
+        message_send_v1(user["auth_user_id"], channel_id, f"message {i}")
+
+    store.flush()
+    assert read_log(files["log"]) == []
+    assert len(read_json(files["data"])["messages"]) == 5
+
+def test_replay_over_newer_snapshot_is_idempotent(activity):
+    store.flush()
+    log = read_log(activity["log"])
+    store.snapshot()
+    expected = copy.deepcopy(d.data)
+
+    # A crash between writing the snapshot and truncating the log
+    with open(activity["log"], "w") as f:
+        f.write("".join(json.dumps(entry) + "\n" for entry in log))
+
+    store.load()
+    assert d.data == expected
+
+def test_threshold_wakes_flusher(files, monkeypatch):
+    monkeypatch.setattr(config, "flush_threshold", 5)
+    user = auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    channel_id = channels_create_v2(user["token"], "channel", True)["channel_id"]
+    for i in range(5):
+        message_send_v1(user["auth_user_id"], channel_id, f"message {i}")
+
+    deadline = time.time() + 5
+    while store.engine().queued_records() and time.time() < deadline:
+        time.sleep(0.01)
+    assert len([entry for entry in read_log(files["log"]) if entry["table"] == "messages"]) == 5
+
+def test_index_follows_changes(activity):
+    assert store.get("messages", 3) is d.data["messages"][3]
+    assert store.max_key("messages") == 9
+    assert store.get("messages", 10) is None
+
+    store.insert("messages", dict(d.data["messages"][0], message_id=10))
+    assert store.get("messages", 10)["message"] == "message 0"
+    assert store.max_key("messages") == 10
+
+    # Replacing d.data as a whole rebuilds the index
+    store.flush()
+    d.data = store.export()
+    assert store.get("messages", 3) is d.data["messages"][3]
+
+    store.clear()
+    assert store.get("users", 0) is None
+    assert store.max_key("messages") is None
+
+def test_history_read_does_not_write(activity):
+    store.flush()
+    channel_id = store.first("channels")["channel_id"]
+    messages = channel_messages_v1(1, channel_id, 0)["messages"]
+    assert [react["is_this_user_reacted"] for message in messages for react in message["reacts"]] == [True]
+    assert store.engine().queued_records() == 0
+
+def test_history_index_follows_changes(activity):
+    channel_id = store.first("channels")["channel_id"]
+    message_remove_v1(0, 4)
+    page = [message["message_id"] for message in store.history("channel_id", channel_id, 4, before=7)]
+    assert page == [6, 5, 3, 2]
+    assert store.history_count("channel_id", channel_id) == 9
+
+    # The index is rebuilt from the log when the data store is reloaded
+    store.flush()
+    d.data = store.export()
+    assert [message["message_id"] for message in store.history("channel_id", channel_id, 3, after=2)] == [6, 5, 3]
+    assert store.history("channel_id", channel_id, 3, offset=8)[0]["message_id"] == 0
+
+def test_replace_and_delete_keep_insertion_order(activity):
+    store.insert("messages", dict(store.get("messages", 3), message="replaced"))
+    store.delete("messages", 5)
+    assert [message["message_id"] for message in store.scan("messages")] == [0, 1, 2, 3, 4, 6, 7, 8, 9]
+    assert store.scan("messages")[3]["message"] == "replaced"
+
+    store.snapshot()
+    assert [message["message_id"] for message in read_json(activity["data"])["messages"]] == [0, 1, 2, 3, 4, 6, 7, 8, 9]
+
+def test_compaction_leaves_queued_records_for_the_log(activity):
+    store.flush()
+    user = store.first("users")
+    store.update("users", user["u_id"], {"name_first": "queued"})
+    with store.engine()._write_lock:
+        store.engine()._write_snapshot()
+
+    # Compaction builds the snapshot from what was flushed, and the record
+    # still queued goes to the fresh log
+    assert read_json(activity["data"])["users"][0]["name_first"] == "david"
+    store.flush()
+    assert store.export()["users"][0]["name_first"] == "queued"
+
+def test_delete_many_is_one_record(activity):
+    store.flush()
+    store.delete_many("messages", [2, 3, 99])
+    assert store.flush() == 1
+    assert [message["message_id"] for message in store.scan("messages")] == [0, 1, 4, 5, 6, 7, 8, 9]
+    assert store.history_count("channel_id", store.first("channels")["channel_id"]) == 8
+
+    store.load()
+    assert [message["message_id"] for message in store.scan("messages")] == [0, 1, 4, 5, 6, 7, 8, 9]
+
+def test_load_drops_collections_no_longer_kept(files):
+    image = read_json(files["data"])
+    image["stats_history"] = [{"sample_id": 0, "stats_id": -1}]
+    files["data"].write_text(json.dumps(image))
+    store.load()
+    assert "stats_history" not in store.export()
+
+def test_delete_is_replayed(activity):
+    store.delete("messages", 9)
+    store.delete("messages", 9)
+    assert store.get("messages", 9) is None
+    assert store.max_key("messages") == 8
+
+    store.flush()
+    assert [message["message_id"] for message in store.export()["messages"]] == list(range(9))
@@ -0,0 +1,68 @@
+'''
+timer_wheel_test.py
+Tests for the hashed timer wheel in timer_wheel.py
+'''
+
+import threading
+import time
+from src.timer_wheel import TimerWheel
+
+def make_wheel(slots=8):
+    fired = []
+    wheel = TimerWheel(fired.append, 0.05, slots)
+    return wheel, fired
+
+def test_fires_in_order_within_a_tick():
+    wheel, fired = make_wheel()
+    now = time.time()
+    wheel.add("b", now + 0.2)
+    wheel.add("a", now + 0.1)
+    time.sleep(0.3)
+    assert wheel.wait_until_idle(timeout=1)
+    assert fired == ["a", "b"]
+    assert len(wheel) == 0
+    wheel.shutdown()
+
+def test_past_the_end_of_the_wheel():
+    # 8 slots of 0.05s is one turn every 0.4s, so this waits for two turns
+    wheel, fired = make_wheel()
+    wheel.add("late", time.time() + 0.9)
+    time.sleep(0.5)
+    assert fired == []
+    time.sleep(0.5)
+    assert wheel.wait_until_idle(timeout=1)
+    assert fired == ["late"]
+    wheel.shutdown()
+
+def test_cancel_and_replace():
+    wheel, fired = make_wheel()
+    now = time.time()
+    wheel.add("cancelled", now + 0.1)
+    wheel.add("moved", now + 0.1)
+    assert wheel.cancel("cancelled")
+    assert not wheel.cancel("cancelled")
+    wheel.add("moved", now + 10)
+    time.sleep(0.3)
+    assert fired == []
+    assert wheel.deadline("moved") == now + 10
+    wheel.shutdown()
+
+def test_past_deadline_fires_straight_away():
+    wheel, fired = make_wheel()
+    wheel.add("overdue", time.time() - 100)
+    time.sleep(0.15)
+    assert wheel.wait_until_idle(timeout=1)
+    assert fired == ["overdue"]
+    wheel.shutdown()
+
+def test_one_thread_for_many_timers():
+    wheel, fired = make_wheel(slots=64)
+    threads = threading.active_count()
+    now = time.time()
+    for i in range(5000):
+        wheel.add(i, now + 0.1 + (i % 10) * 0.01)
+    assert threading.active_count() <= threads + 1
+    time.sleep(0.35)
+    assert wheel.wait_until_idle(timeout=2)
+    assert sorted(fired) == list(range(5000))
+    wheel.shutdown()
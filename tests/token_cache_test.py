@@ -0,0 +1,79 @@
+'''
+token_cache_test.py
+Tests for the token cache in token_cache.py in front of token_decode
+'''
+
+import pytest
+import src.sessions as sessions
+import src.store as store
+import src.token_cache as token_cache
+from src import config
+from src.auth import auth_register_v2
+from src.admin import admin_user_remove_v1
+from src.helper import create_token, token_decode
+from src.user import user_profile_sethandle_v1
+from src.other import clear_v1
+
+@pytest.fixture
+def users():
+    clear_v1()
+    user1 = auth_register_v2("email@gmail.com", "password1", "david", "peng")
+    user2 = auth_register_v2("email2@gmail.com", "password2", "joel", "engelman")
+    return user1, user2
+
+def test_cached_tokens_are_not_decoded(monkeypatch, users):
+    user1, _ = users
+    assert token_decode(user1["token"]) == user1["auth_user_id"]
+
+    def no_lookups(*args):
+        raise AssertionError("the cache should answer")
+    monkeypatch.setattr(store, "find", no_lookups)
+    monkeypatch.setattr(store, "get", no_lookups)
+    assert token_decode(user1["token"]) == user1["auth_user_id"]
+
+def test_session_tokens_resolve_by_u_id(monkeypatch, users):
+    _, user2 = users
+    token = create_token("joelengelman", user2["auth_user_id"], 7)
+    assert token != user2["token"]
+
+    def no_handle_lookups(*args):
+        raise AssertionError("the u_id claim should be used")
+    monkeypatch.setattr(store, "find", no_handle_lookups)
+    assert token_decode(token) == user2["auth_user_id"]
+
+def test_bounded_least_recently_used(monkeypatch, users):
+    user1, user2 = users
+    monkeypatch.setattr(config, "token_cache_size", 2)
+    extra = create_token("davidpeng", user1["auth_user_id"], 1)
+    token_decode(user1["token"])
+    token_decode(user2["token"])
+    token_decode(user1["token"])
+    token_decode(extra)
+
+    assert token_cache.size() == 2
+    assert token_cache.get(user2["token"]) is None
+    assert token_cache.get(user1["token"]) == user1["auth_user_id"]
+
+def test_invalidated_on_handle_change(users):
+    user1, _ = users
+    old_session = create_token("davidpeng", user1["auth_user_id"], 1)
+    token_decode(user1["token"])
+    token_decode(old_session)
+
+    user_profile_sethandle_v1(user1["token"], "dave")
+    with pytest.raises(ValueError):
+        token_decode(user1["token"])
+    with pytest.raises(ValueError):
+        token_decode(old_session)
+    assert token_decode(create_token("dave")) == user1["auth_user_id"]
+
+def test_invalidated_on_logout_and_removal(users):
+    user1, user2 = users
+    sessions.start(user1["token"], user1["auth_user_id"])
+    token_decode(user1["token"])
+    sessions.end(user1["token"])
+    assert token_cache.get(user1["token"]) is None
+
+    token_decode(user2["token"])
+    admin_user_remove_v1(user1["token"], user2["auth_user_id"])
+    assert token_cache.get(user2["token"]) is None
@@ -0,0 +1,118 @@
+'''
+upgrade_test.py
+Tests for loading a data file written by an older version of Dreams, with
+upgrade.py
+'''
+
+import json
+import pytest
+import src.store as store
+import src.stats as stats
+from src import config
+from src.json_engine import JSONEngine
+from src.sqlite_engine import SQLiteEngine
+from src.helper import init_data
+from src.channel import channel_details_v1, channel_join_v1, channel_leave_v1, channel_messages_v1
+from src.dm import dm_details_v1, dm_list_v1
+from src.message import message_react_v1, message_unreact_v1
+
+def profile(u_id, first, last):
+    return {"u_id": u_id, "name_first": first, "name_last": last, "handle_str": f"{first}{last}", "email": f"{first}@gmail.com"}
+
+def user(u_id, first, last, permission):
+    return dict(profile(u_id, first, last), password="", permission=permission)
+
+# An image in the format of the data file before membership was kept as u_ids
+BASELINE = {
+    "users": [user(0, "david", "peng", 1), user(1, "joel", "engelman", 2), user(2, "alex", "fulton", 2)],
+    "channels": [
+        {
+            "name": "channel", "is_public": True, "channel_id": 1, "messages": [0, 1],
+            "owner_members": [profile(0, "david", "peng")],
+            "all_members": [profile(0, "david", "peng"), profile(1, "joel", "engelman")],
+        },
+    ],
+    "dms": [
+        {"dm_id": 0, "creator": 0, "name": "davidpeng, joelengelman", "active": True, "messages": [2],
+         "members": [profile(1, "joel", "engelman"), profile(0, "david", "peng")]},
+        {"dm_id": 1, "creator": 0, "name": "alexfulton, davidpeng", "active": False, "messages": [],
+         "members": [profile(2, "alex", "fulton"), profile(0, "david", "peng")]},
+    ],
+    "messages": [
+        {"message_id": 0, "u_id": 0, "message": "hello", "time_created": 1.0, "channel_id": 1, "removed": False,
+         "reacts": [{"react_id": 1, "u_ids": [1], "is_this_user_reacted": False}], "is_pinned": False},
+        {"message_id": 1, "u_id": 1, "message": "gone", "time_created": 2.0, "channel_id": 1, "removed": True,
+         "reacts": [], "is_pinned": False},
+        {"message_id": 2, "u_id": 1, "message": "hi", "time_created": 3.0, "dm_id": 0, "removed": False,
+         "reacts": [], "is_pinned": False},
+    ],
+}
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    '''
+    < Writes the old format image as the data file in a temporary directory >
+    '''
+    monkeypatch.setattr(config, "data_path", str(tmp_path / "data.json"))
+    monkeypatch.setattr(config, "log_path", str(tmp_path / "data.log"))
+    monkeypatch.setattr(config, "sqlite_path", str(tmp_path / "data.db"))
+    (tmp_path / "data.json").write_text(json.dumps(BASELINE))
+    return tmp_path
+
+@pytest.fixture(params=[JSONEngine, SQLiteEngine])
+def loaded(paths, request, monkeypatch):
+    '''
+    < Loads the old format data file with each engine >
+    '''
+    store.flush()
+    engine = request.param()
+    monkeypatch.setattr(store, "_engine", engine)
+    init_data()
+    yield engine
+    engine.shutdown()
+
+def test_members_become_u_ids(loaded):
+    assert store.get("channels", 1)["all_members"] == [0, 1]
+    assert store.contains("channels", 1, "owner_members", 0)
+    assert store.get("dms", 0)["members"] == [1, 0]
+    details = channel_details_v1(1, 1)
+    assert [member["u_id"] for member in details["all_members"]] == [0, 1]
+    assert [member["u_id"] for member in dm_details_v1(0, 0)["members"]] == [1, 0]
+
+def test_users_gain_their_channels_and_dms(loaded):
+    assert store.get("users", 0)["channels"] == [1]
+    assert store.get("users", 0)["dms"] == [0]
+    assert store.get("users", 2)["dms"] == []
+    assert [dm["dm_id"] for dm in dm_list_v1(1)["dms"]] == [0]
+
+    channel_join_v1(2, 1)
+    channel_leave_v1(1, 1)
+    assert store.get("users", 1)["channels"] == []
+    assert store.get("users", 2)["channels"] == [1]
+
+def test_reacts_become_a_dict(loaded):
+    assert store.get("messages", 0)["reacts"] == {"1": [1]}
+    message_react_v1(0, 0, 1)
+    message_unreact_v1(1, 0, 1)
+    [message] = channel_messages_v1(0, 1, 0)["messages"]
+    assert message["reacts"] == [{"react_id": 1, "u_ids": [0], "is_this_user_reacted": True}]
+
+def test_statistics_are_counted(loaded):
+    assert stats.user_stats(0)["channels_joined"]["num_channels_joined"] == 1
+    assert stats.user_stats(1)["messages_sent"]["num_messages_sent"] == 2
+    assert stats.user_stats(2)["dms_joined"]["num_dms_joined"] == 0
+    dreams = stats.dreams_stats()
+    assert dreams["channels_exist"]["num_channels_exist"] == 1
+    assert dreams["dms_exist"]["num_dms_exist"] == 1
+    assert dreams["messages_exist"]["num_messages_exist"] == 2
+
+def test_snapshot_is_written_in_the_new_format(paths, monkeypatch):
+    store.flush()
+    engine = JSONEngine()
+    monkeypatch.setattr(store, "_engine", engine)
+    init_data()
+    store.snapshot()
+    image = json.loads((paths / "data.json").read_text())
+    assert image["channels"][0]["owner_members"] == [0]
+    assert image["messages"][0]["reacts"] == {"1": [1]}
+    engine.shutdown()